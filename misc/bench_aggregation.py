@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the statistics accumulation: per-line cost of log_analyzer.aggregate_lines
+on already parsed records, i.e. without reading and parsing of the log lines.
+Run with the sources in the path:  PYTHONPATH=src python misc/bench_aggregation.py [lines_count]
+"""
+import sys
+import time
+import random
+import logging
+import log_analyzer as la
+import nginx_log_parser as nlp
+import quantile_sketch as qs
+
+def make_requests(count: int, urls_count: int = 20000) -> list:
+    rnd = random.Random(1)
+    # popular URLs are requested much more often than others
+    urls = [f'/api/v2/banner/{i}' for i in range(urls_count)]
+    weights = [1 / (i + 1) for i in range(urls_count)]
+    chosen = rnd.choices(urls, weights=weights, k=count)
+    return [nlp.Request('30/Jun/2017:03:28:22 +0300', u, int(rnd.expovariate(1/200)) + 1) for u in chosen]
+
+def bench(requests: list, estimator: str, repeat: int = 3) -> float:
+    "Returns the best time per record in nanoseconds"
+    log = logging.getLogger('bench')
+    new_estimator = qs.estimator_factory(estimator)
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        la.aggregate_lines(requests, lambda rec, _: rec, log, new_estimator)
+        best = min(best, time.perf_counter() - started)
+    return best * 1e9 / len(requests)
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    requests = make_requests(count)
+    for estimator in qs.ESTIMATORS:
+        print(f'{estimator:>6}: {bench(requests, estimator):6.0f} ns per line')
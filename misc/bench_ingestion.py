@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Benchmark of text and binary ingestion of uncompressed log: lines decoded to str and parsed by
+the str regex against undecoded lines parsed by the bytes regex (URLs decoded once per URL).
+Time is measured without tracing, peak memory of Python objects with tracemalloc.
+Usage:  PYTHONPATH=src python misc/bench_ingestion.py <log file>
+"""
+import sys
+import time
+import logging
+import tracemalloc
+import pathlib as pl
+import log_analyzer as la
+import nginx_log_parser as nlp
+
+def text_path(file_name, log):
+    with open(file_name, 'r', encoding='utf-8') as f_in:
+        return la.aggregate_lines(f_in, nlp.parse_log_line_fast, log)
+
+def bytes_path(file_name, log):
+    size = pl.Path(file_name).stat().st_size
+    return la.decode_urls(la.aggregate_lines(la.read_lines_range(file_name, 0, size),
+                                             nlp.parse_log_line_bytes, log))
+
+PATHS = {'text': text_path, 'bytes': bytes_path}
+
+if __name__ == "__main__":
+    file_name = sys.argv[1]
+    log = logging.getLogger('bench')
+    size_mb = pl.Path(file_name).stat().st_size / 1e6
+    for name, func in PATHS.items():
+        started = time.perf_counter()
+        result = func(file_name, log)
+        elapsed = time.perf_counter() - started
+        lines = result.good_lines + result.bad_lines
+        tracemalloc.start()
+        func(file_name, log)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{name:>6}: {elapsed:6.2f} s, {lines / elapsed:9.0f} lines/s, ' +
+              f'{size_mb / elapsed:6.1f} MB/s, peak memory {peak / 1e6:6.1f} MB')
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of encoding of the report table to JSON: OutputJSONEncoder (the old way)
+against the row encoders of log_analyzer.json_rows, pure Python and orjson, with full
+precision and with the numbers rounded to 3 digits.  The size of the output is printed too.
+Run with the sources in the path:  PYTHONPATH=src python misc/bench_json.py [rows_count]
+"""
+import sys
+import time
+import random
+import log_analyzer as la
+
+def make_rows(count: int) -> list:
+    rnd = random.Random(1)
+    rows = []
+    for i in range(count):
+        times = sorted(rnd.lognormvariate(-2, 1) for _ in range(4))
+        rows.append(la.OutputUrlStats(f'/api/v2/banner/{i}?date_from=2017-06-28', rnd.randrange(1, 10**5),
+                                      times[1], times[3], times[3] * 100, times[1], rnd.random(), rnd.random(),
+                                      times[2], times[3]))
+    return rows
+
+def bench(encode, rows: list, repeat: int = 5) -> tuple[float, int]:
+    "Returns the best time in seconds and the size of the JSON"
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = encode(rows)
+        best = min(best, time.perf_counter() - started)
+    return best, len(result.encode('utf-8'))
+
+ENCODERS = {
+    'OutputJSONEncoder': la.output_to_json,
+    'python':            lambda rows: ''.join(la.json_rows(rows, 'python')),
+    'python, 3 digits':  lambda rows: ''.join(la.json_rows(rows, 'python', 3)),
+    'orjson':            lambda rows: ''.join(la.json_rows(rows, 'orjson')),
+    'orjson, 3 digits':  lambda rows: ''.join(la.json_rows(rows, 'orjson', 3)),
+}
+
+if __name__ == "__main__":
+    rows = make_rows(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+    print(f'{"encoder":>18} {"ms":>8} {"rows/s":>10} {"KB":>8}')
+    for name, encode in ENCODERS.items():
+        if name.startswith('orjson') and la.orjson is None:
+            print(f'{name:>18}  orjson is not installed')
+            continue
+        seconds, size = bench(encode, rows)
+        print(f'{name:>18} {seconds * 1000:8.1f} {len(rows) / seconds:10.0f} {size / 1024:8.0f}')
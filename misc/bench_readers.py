@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Benchmark of log readers: fileinput.hook_compressed (the old way) against log_readers with
+Python decompression in a thread and with an external decompressor for compressed logs,
+and block reads against memory map for uncompressed ones.
+Every reader is timed alone (lines counting) and with parsing and aggregation of the lines.
+Usage:  PYTHONPATH=src python misc/bench_readers.py <log.gz|log.bz2|log>
+"""
+import sys
+import time
+import fileinput
+import logging
+import itertools as it
+import pathlib as pl
+import log_readers as lr
+import log_analyzer as la
+import nginx_log_parser as nlp
+
+def fileinput_lines(file_name):
+    with fileinput.input(files=file_name, encoding='utf-8', openhook=fileinput.hook_compressed) as fin:
+        yield from fin
+
+def blocks_lines(file_name):
+    return la.read_lines_range(file_name, 0, pl.Path(file_name).stat().st_size)
+
+# reader name -> (lines of the file, parser of the lines)
+COMPRESSED_READERS = {
+    'fileinput':  (fileinput_lines, nlp.parse_log_line_fast),
+    'python':     (lambda fn: it.chain.from_iterable(lr.compressed_lines(fn, 'python')), nlp.parse_log_line_bytes),
+    'external':   (lambda fn: it.chain.from_iterable(lr.compressed_lines(fn, 'external')), nlp.parse_log_line_bytes),
+}
+PLAIN_READERS = {
+    'fileinput':  (fileinput_lines, nlp.parse_log_line_fast),
+    'blocks':     (blocks_lines, nlp.parse_log_line_bytes),
+    'mmap':       (lr.mmap_lines, nlp.parse_log_line_bytes),
+}
+
+def timed(func) -> float:
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+if __name__ == "__main__":
+    file_name = sys.argv[1]
+    log = logging.getLogger('bench')
+    print(f'{"reader":>10} {"read, s":>8} {"read+parse, s":>14}')
+    readers = COMPRESSED_READERS if lr.is_compressed(file_name) else PLAIN_READERS
+    for name, (reader, parser) in readers.items():
+        if name == 'external' and lr.find_external_tool(file_name) is None:
+            print(f'{name:>10}  no external decompressor found')
+            continue
+        read_time = timed(lambda: sum(1 for _ in reader(file_name)))
+        full_time = timed(lambda: la.aggregate_lines(reader(file_name), parser, log))
+        print(f'{name:>10} {read_time:8.2f} {full_time:14.2f}')
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the log analyzer on synthetic 'ui_short' logs.
+
+The generator writes a log of given size: URLs are taken from a pool of given cardinality with
+Zipf-skewed popularity, request times are log-normal, some lines are broken, the log may be
+compressed.  Every stage of the processing is timed separately on materialized data
+(read, parse, aggregate, stats, render), then the whole file is processed the way
+log_analyzer does it (streaming).  For every stage lines/s and peak RSS of the process
+are reported.
+
+Usage:  python benchmark.py [--lines N] [--urls N] [--compress gz] ... [--json results.json]
+        python benchmark.py --log existing_log.gz
+"""
+import argparse as ap
+import bz2
+import gzip
+import itertools as it
+import json
+import logging
+import math
+import pathlib as pl
+import random
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, asdict
+from typing import NamedTuple, Optional
+
+import instrumentation as instr
+import log_analyzer as la
+import log_format as lf
+import log_readers as lr
+import nginx_log_parser as nlp
+import quantile_sketch as qs
+
+GENERATOR_BATCH = 10000
+OPENERS = {
+    'plain': open,
+    'gz':    lambda fn, mode: gzip.open(fn, mode, compresslevel=6),
+    'bz2':   lambda fn, mode: bz2.open(fn, mode),
+}
+
+@dataclass
+class SyntheticLogSpec:
+    "Parameters of a synthetic log"
+    lines:          int   = 1_000_000
+    urls:           int   = 20_000     # distinct URLs
+    zipf:           float = 1.1        # skew of URL popularity, 0 is uniform
+    latency_median: float = 0.1        # seconds
+    latency_sigma:  float = 1.0        # of the log-normal distribution
+    bad_ratio:      float = 0.001      # part of broken lines
+    compress:       str   = 'plain'    # one of OPENERS
+    seed:           int   = 1
+
+# URL shapes seen in real 'ui_short' logs, a URL number is put into the shape
+URL_SHAPES = (
+    '/api/v2/banner/{}',
+    '/api/v2/internal/banner/{}/info',
+    '/api/v2/group/{}/statistic/sites/?date_type=day&date_from=2017-06-28&date_to=2017-06-28',
+    '/api/1/photogenic_banners/list/?server_name=WIN7RB{}',
+    '/export/appinstall_raw/2017-06-{}/',
+    '/api/v2/slot/{}/groups',
+)
+USER_AGENTS = ('Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5', '-', 'Slotovod',
+               'python-requests/2.13.0', 'Go 1.1 package http')
+METHODS = ('GET', 'GET', 'GET', 'GET', 'POST', 'HEAD')
+BAD_LINES = (
+    '1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] "-" 200 983 "-" "-" "-" "-" "-" 1.403',
+    '1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] "GET /api/v2/banner/1 HTTP/1.1" 200',
+    '\\x16\\x03\\x01\\x00\\xa5\\x01\\x00\\x00\\xa1\\x03\\x03',
+)
+
+def synthetic_lines(spec: SyntheticLogSpec):
+    "Batches of the log lines"
+    rnd = random.Random(spec.seed)
+    urls = [URL_SHAPES[i % len(URL_SHAPES)].format(i) for i in range(spec.urls)]
+    cum_weights = list(it.accumulate(1 / (i + 1) ** spec.zipf for i in range(spec.urls)))
+    mu = math.log(spec.latency_median)
+    seconds_per_line = 86400 / max(spec.lines, 1)
+    for batch_start in range(0, spec.lines, GENERATOR_BATCH):
+        count = min(GENERATOR_BATCH, spec.lines - batch_start)
+        batch = []
+        for n, url in enumerate(rnd.choices(urls, cum_weights=cum_weights, k=count), batch_start):
+            if rnd.random() < spec.bad_ratio:
+                batch.append(rnd.choice(BAD_LINES))
+                continue
+            day_seconds = int(n * seconds_per_line)
+            ts = f'30/Jun/2017:{day_seconds // 3600:02}:{day_seconds // 60 % 60:02}:{day_seconds % 60:02} +0300'
+            batch.append(
+                f'1.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(256)} -  - [{ts}] '
+                f'"{rnd.choice(METHODS)} {url} HTTP/1.1" 200 {rnd.randrange(100, 100000)} "-" '
+                f'"{rnd.choice(USER_AGENTS)}" "-" "1498697422-{rnd.randrange(10**10)}-4708-{n}" '
+                f'"{rnd.randrange(16**9):x}" {rnd.lognormvariate(mu, spec.latency_sigma):.3f}')
+        yield batch
+
+def generate_log(spec: SyntheticLogSpec, directory) -> pl.Path:
+    "Writes the log to the directory, returns its name"
+    file_name = pl.Path(directory) / pl.Path('nginx-access-ui.log-20170630' +
+                                             ('' if spec.compress == 'plain' else '.' + spec.compress))
+    with OPENERS[spec.compress](file_name, 'wt') as f_out:
+        for batch in synthetic_lines(spec):
+            f_out.write('\n'.join(batch))
+            f_out.write('\n')
+    return file_name
+
+# the parser compiled from the log_format of the synthetic logs, to compare with the built-in ones
+COMPILED_PARSER = 'compiled'
+
+class StageResult(NamedTuple):
+    stage:        str
+    seconds:      float
+    lines_per_s:  float
+    peak_rss_mb:  Optional[float]
+
+def run_stages(file_name, parser: str = 'fast', quantiles: str = 'exact', reader: str = 'auto',
+               report_size: int = 1000, template: str = '$table_json') -> list[StageResult]:
+    "Times every stage of processing of the log, the stages get the data of the previous one"
+    log = logging.getLogger('benchmark')
+    new_estimator = qs.estimator_factory(quantiles)
+    if parser == COMPILED_PARSER:
+        parser = lf.compile_format(lf.UI_SHORT)
+    parse_line = la.bytes_parser(parser)
+    results = []
+    data = {}
+
+    def read():
+        if lr.is_compressed(file_name):
+            data['lines'] = list(it.chain.from_iterable(lr.compressed_lines(file_name)))
+        elif reader == 'blocks':
+            data['lines'] = list(la.read_lines_range(file_name, 0, pl.Path(file_name).stat().st_size))
+        else:
+            data['lines'] = list(lr.mmap_lines(file_name))
+
+    def parse():
+        data['requests'] = [parse_line(line, log) for line in data['lines']]
+
+    def aggregate():
+        result = la.decode_urls(la.aggregate_lines(data['requests'], lambda rec, _: rec, log, new_estimator))
+        data['stats'] = (result.url_stats, result.general_stats)
+
+    def stats():
+        data['output'] = la.process_stats(data['stats'], report_size)
+
+    def render():
+        parts = la.split_template(template)
+        data['report'] = ''.join([parts.prefix, *la.json_rows(data['output']), parts.suffix])
+
+    def streaming():
+        # the way log_analyzer reads a file, nothing is materialized
+        if lr.is_compressed(file_name):
+            la.decode_urls(la.aggregate_lines(it.chain.from_iterable(lr.compressed_lines(file_name)),
+                                              parse_line, log, new_estimator))
+        else:
+            la.process_file_chunk(file_name, 0, pl.Path(file_name).stat().st_size, parser,
+                                  new_estimator, log, reader)
+
+    stages = (('read', read), ('parse', parse), ('aggregate', aggregate), ('stats', stats),
+              ('render', render), ('streaming total', streaming))
+    lines_count = 0
+    for name, stage in stages:
+        if name == 'streaming total':
+            # free the materialized data before the streaming run
+            data.clear()
+        started = time.perf_counter()
+        stage()
+        seconds = time.perf_counter() - started
+        lines_count = len(data['lines']) if 'lines' in data else lines_count
+        results.append(StageResult(name, seconds, lines_count / seconds if seconds > 0 else 0.0,
+                                   instr.peak_rss_mb()))
+    return results
+
+def format_results(results: list[StageResult]) -> str:
+    lines = [f'{"stage":>16} {"seconds":>8} {"lines/s":>12} {"peak RSS, MB":>13}']
+    for r in results:
+        rss = f'{r.peak_rss_mb:13.1f}' if r.peak_rss_mb is not None else f'{"n/a":>13}'
+        lines.append(f'{r.stage:>16} {r.seconds:8.3f} {r.lines_per_s:12.0f} {rss}')
+    return '\n'.join(lines)
+
+def parse_cli(args) -> ap.Namespace:
+    p = ap.ArgumentParser(description='Benchmark of nginx log analyzer on a synthetic log')
+    defaults = SyntheticLogSpec()
+    p.add_argument('--lines', type=int, default=defaults.lines, help='Lines in the synthetic log')
+    p.add_argument('--urls', type=int, default=defaults.urls, help='Distinct URLs')
+    p.add_argument('--zipf', type=float, default=defaults.zipf, help='Skew of URL popularity (0 for uniform)')
+    p.add_argument('--latency-median', type=float, default=defaults.latency_median,
+                   help='Median request time, seconds')
+    p.add_argument('--latency-sigma', type=float, default=defaults.latency_sigma,
+                   help='Sigma of log-normal distribution of request times')
+    p.add_argument('--bad-ratio', type=float, default=defaults.bad_ratio, help='Part of broken lines')
+    p.add_argument('--compress', choices=list(OPENERS), default=defaults.compress, help='Compression of the log')
+    p.add_argument('--seed', type=int, default=defaults.seed, help='Random seed')
+    p.add_argument('--log', help='Benchmark on this log instead of a synthetic one')
+    p.add_argument('--keep', help='Keep the synthetic log in this directory')
+    p.add_argument('--parser', choices=list(nlp.BYTES_PARSERS) + [COMPILED_PARSER], default='fast',
+                   help=f"'{COMPILED_PARSER}' is ui_short format compiled by log_format")
+    p.add_argument('--quantiles', choices=list(qs.ESTIMATORS), default='exact')
+    p.add_argument('--reader', choices=list(lr.READERS), default='auto')
+    p.add_argument('--report-size', type=int, default=1000, help='URLs in the report')
+    p.add_argument('--json', help='Write the results to this file as JSON')
+    return p.parse_args(args)
+
+def main(args):
+    params = parse_cli(args)
+    tmp_dir = None
+    if params.log:
+        log_fn = pl.Path(params.log)
+    else:
+        spec = SyntheticLogSpec(params.lines, params.urls, params.zipf, params.latency_median,
+                                params.latency_sigma, params.bad_ratio, params.compress, params.seed)
+        if params.keep:
+            pl.Path(params.keep).mkdir(parents=True, exist_ok=True)
+        out_dir = params.keep or (tmp_dir := tempfile.mkdtemp(prefix='log_analyzer_bench'))
+        started = time.perf_counter()
+        log_fn = generate_log(spec, out_dir)
+        print(f'Generated {log_fn} ({log_fn.stat().st_size / 1e6:.1f} MB) in '
+              f'{time.perf_counter() - started:.1f} s: {asdict(spec)}')
+    try:
+        results = run_stages(log_fn, params.parser, params.quantiles, params.reader, params.report_size)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+    print(format_results(results))
+    if params.json:
+        with open(params.json, 'w', encoding='utf-8') as f_out:
+            json.dump({'log': str(log_fn), 'args': vars(params),
+                       'stages': [r._asdict() for r in results]}, f_out, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
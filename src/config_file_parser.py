@@ -14,6 +14,35 @@ from typing import Optional
 # ALLOW_EXTS    : gz, bz2
 # JOURNAL       : /tmp/nginx_parser.log
 # TEMPLATE_HTML : report.html
+# LOG_PARSER    : fast
+# WORKERS       : 4
+# QUANTILES     : sketch
+# QUANTILE_ERROR: 0.01
+# INCREMENTAL   : off
+# BACKFILL      : off
+# BACKFILL_JOBS : 4
+# DECOMPRESSOR  : auto
+# READER        : auto
+# REPORT_THRESHOLD: 1
+# REPORT_SORT   : sum
+# STRIP_QUERY   : on
+# COLLAPSE_IDS  : on
+# URL_RULES     : /etc/url_rules.txt
+# MAX_URLS      : 100000
+# STATS_BACKEND : auto
+# SAVE_AGGREGATES: on
+# MERGE         : week
+# METRICS       : on
+# PROFILE       : off
+# PROGRESS_INTERVAL: 10
+# MEMORY_BUDGET : 2048
+# SPILL_DIR     : /var/tmp
+# JSON_BACKEND  : auto
+# REPORT_PRECISION: 4
+# SERIES_INTERVAL: 60
+# LOG_FORMAT    : /etc/nginx/log_format.conf
+# DAEMON        : on
+# DAEMON_INTERVAL: 60
 
 var_name_separator = pp.Suppress(pp.Char(':='))
 comment_line = pp.Optional(pp.Suppress(pp.python_style_comment))
@@ -23,6 +52,7 @@ true_val     = pp.one_of('true on 1', caseless=True).set_parse_action(pp.replace
 false_val    = pp.one_of('false  off 0', caseless=True).set_parse_action(pp.replace_with(False))
 bool_val     = pp.Or([true_val, false_val])
 digits       = pp.Word(pp.nums)
+real_number  = pp.Combine(pp.Optional(digits) + '.' + digits) | digits
 # -- time strings in filenames
 supported_time_metas = pp.Char('YymdbF')
 time_metachar = pp.Combine('%' + supported_time_metas)
@@ -70,11 +100,77 @@ report_date_format = pp.Optional(pp.Suppress(pp.CaselessKeyword('report_date_for
                var_name_separator + time_pattern)
 report_template = pp.Optional(pp.Suppress(pp.CaselessKeyword('template_html')) +
                var_name_separator + path.set_results_name('template_html'))
+log_parser   = pp.Optional(pp.Suppress(pp.CaselessKeyword('log_parser')) +
+               var_name_separator + pp.one_of('fast strict', caseless=True).set_results_name('log_parser'))
+workers      = pp.Optional(pp.Suppress(pp.CaselessKeyword('workers')) +
+               var_name_separator + digits.set_results_name('workers'))
+quantiles    = pp.Optional(pp.Suppress(pp.CaselessKeyword('quantiles')) +
+               var_name_separator + pp.one_of('exact sketch', caseless=True).set_results_name('quantiles'))
+quantile_error = pp.Optional(pp.Suppress(pp.CaselessKeyword('quantile_error')) +
+               var_name_separator + real_number.set_results_name('quantile_error'))
+incremental  = pp.Optional(pp.Suppress(pp.CaselessKeyword('incremental')) +
+               var_name_separator + bool_val.set_results_name('incremental'))
+backfill     = pp.Optional(pp.Suppress(pp.CaselessKeyword('backfill')) +
+               var_name_separator + bool_val.set_results_name('backfill'))
+backfill_jobs = pp.Optional(pp.Suppress(pp.CaselessKeyword('backfill_jobs')) +
+               var_name_separator + digits.set_results_name('backfill_jobs'))
+decompressor = pp.Optional(pp.Suppress(pp.CaselessKeyword('decompressor')) +
+               var_name_separator + pp.one_of('auto python external', caseless=True).set_results_name('decompressor'))
+reader       = pp.Optional(pp.Suppress(pp.CaselessKeyword('reader')) +
+               var_name_separator + pp.one_of('auto mmap blocks', caseless=True).set_results_name('reader'))
+report_threshold = pp.Optional(pp.Suppress(pp.CaselessKeyword('report_threshold')) +
+               var_name_separator + digits.set_results_name('report_threshold'))
+report_sort  = pp.Optional(pp.Suppress(pp.CaselessKeyword('report_sort')) +
+               var_name_separator + pp.one_of('sum count max median p99', caseless=True).set_results_name('report_sort'))
+strip_query  = pp.Optional(pp.Suppress(pp.CaselessKeyword('strip_query')) +
+               var_name_separator + bool_val.set_results_name('strip_query'))
+collapse_ids = pp.Optional(pp.Suppress(pp.CaselessKeyword('collapse_ids')) +
+               var_name_separator + bool_val.set_results_name('collapse_ids'))
+url_rules    = pp.Optional(pp.Suppress(pp.CaselessKeyword('url_rules')) +
+               var_name_separator + path.set_results_name('url_rules'))
+max_urls     = pp.Optional(pp.Suppress(pp.CaselessKeyword('max_urls')) +
+               var_name_separator + digits.set_results_name('max_urls'))
+stats_backend = pp.Optional(pp.Suppress(pp.CaselessKeyword('stats_backend')) +
+               var_name_separator + pp.one_of('auto numpy python', caseless=True).set_results_name('stats_backend'))
+save_aggregates = pp.Optional(pp.Suppress(pp.CaselessKeyword('save_aggregates')) +
+               var_name_separator + bool_val.set_results_name('save_aggregates'))
+merge        = pp.Optional(pp.Suppress(pp.CaselessKeyword('merge')) +
+               var_name_separator + pp.one_of('off week month', caseless=True).set_results_name('merge'))
+metrics      = pp.Optional(pp.Suppress(pp.CaselessKeyword('metrics')) +
+               var_name_separator + bool_val.set_results_name('metrics'))
+profile      = pp.Optional(pp.Suppress(pp.CaselessKeyword('profile')) +
+               var_name_separator + bool_val.set_results_name('profile'))
+progress_interval = pp.Optional(pp.Suppress(pp.CaselessKeyword('progress_interval')) +
+               var_name_separator + real_number.set_results_name('progress_interval'))
+memory_budget = pp.Optional(pp.Suppress(pp.CaselessKeyword('memory_budget')) +
+               var_name_separator + digits.set_results_name('memory_budget'))
+spill_dir    = pp.Optional(pp.Suppress(pp.CaselessKeyword('spill_dir')) +
+               var_name_separator + path.set_results_name('spill_dir'))
+json_backend = pp.Optional(pp.Suppress(pp.CaselessKeyword('json_backend')) +
+               var_name_separator + pp.one_of('auto orjson python', caseless=True).set_results_name('json_backend'))
+report_precision = pp.Optional(pp.Suppress(pp.CaselessKeyword('report_precision')) +
+               var_name_separator + digits.set_results_name('report_precision'))
+series_interval = pp.Optional(pp.Suppress(pp.CaselessKeyword('series_interval')) +
+               var_name_separator + digits.set_results_name('series_interval'))
+log_format   = pp.Optional(pp.Suppress(pp.CaselessKeyword('log_format')) +
+               var_name_separator + path.set_results_name('log_format'))
+daemon       = pp.Optional(pp.Suppress(pp.CaselessKeyword('daemon')) +
+               var_name_separator + bool_val.set_results_name('daemon'))
+daemon_interval = pp.Optional(pp.Suppress(pp.CaselessKeyword('daemon_interval')) +
+               var_name_separator + real_number.set_results_name('daemon_interval'))
 # -- config as a whole
 config       = pp.Each([comment_line, report_size, report_dir, log_dir,
                         verbose_flag, log_glob, report_glob, allow_exts,
                         log_date_format, report_date_format, my_journal,
-                        report_template])
+                        report_template, log_parser, workers,
+                        quantiles, quantile_error, incremental, backfill,
+                        backfill_jobs, decompressor, reader,
+                        report_threshold, report_sort, strip_query,
+                        collapse_ids, url_rules, max_urls, stats_backend,
+                        save_aggregates, merge, metrics, profile,
+                        progress_interval, memory_budget, spill_dir,
+                        json_backend, report_precision, series_interval,
+                        log_format, daemon, daemon_interval])
 # ---- End of config file parsing ----
 
 def template_to_glob(tmpl :str) -> str:
@@ -114,6 +210,35 @@ def parse_config(parser_obj, config_string, log) -> Optional[dict]:
                 'log_glob'   : parsed.log_glob,
                 'allow_exts' : extensions_list,
                 'template_html' : parsed.template_html,
+                'log_parser' : parsed.log_parser.lower(),
+                'workers'    : parsed.workers,
+                'quantiles'  : parsed.quantiles.lower(),
+                'quantile_error' : parsed.quantile_error,
+                'incremental': parsed.incremental,
+                'backfill'   : parsed.backfill,
+                'backfill_jobs' : parsed.backfill_jobs,
+                'decompressor' : parsed.decompressor.lower(),
+                'reader'     : parsed.reader.lower(),
+                'report_threshold' : parsed.report_threshold,
+                'report_sort': parsed.report_sort.lower(),
+                'strip_query': parsed.strip_query,
+                'collapse_ids' : parsed.collapse_ids,
+                'url_rules'  : parsed.url_rules,
+                'max_urls'   : parsed.max_urls,
+                'stats_backend' : parsed.stats_backend.lower(),
+                'save_aggregates' : parsed.save_aggregates,
+                'merge'      : parsed.merge.lower(),
+                'metrics'    : parsed.metrics,
+                'profile'    : parsed.profile,
+                'progress_interval' : parsed.progress_interval,
+                'memory_budget' : parsed.memory_budget,
+                'spill_dir'  : parsed.spill_dir,
+                'json_backend' : parsed.json_backend.lower(),
+                'report_precision' : parsed.report_precision,
+                'series_interval' : parsed.series_interval,
+                'log_format' : parsed.log_format,
+                'daemon'     : parsed.daemon,
+                'daemon_interval' : parsed.daemon_interval,
             }
         else:
             log.info(f"Trying to parse empty string <{config_string}> as a program configuration")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Lightweight instrumentation of a run: wall and CPU time of the stages (CPU time includes
+finished worker processes), lines and bytes handled by a stage, arbitrary counters (like
+number of distinct URLs) and peak memory of the process.  A stage is measured as a whole,
+nothing is done per line.
+
+Progress of a long pass over a file is logged periodically by Progress, the readers of
+log_readers call it once per block of lines.
+"""
+import os
+import time
+import contextlib
+import logging
+import datetime as dt
+from dataclasses import dataclass, field, asdict
+from typing import Iterator, Optional
+
+try:
+    import resource
+except ImportError:     # not a POSIX system
+    resource = None
+
+def cpu_time() -> float:
+    "User and system time of the process and of its waited-for children"
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def peak_rss_mb() -> Optional[float]:
+    "Peak resident set size of the process so far, Linux reports it in kilobytes"
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+@dataclass
+class Stage:
+    name:   str
+    wall_s: float = 0.0
+    cpu_s:  float = 0.0
+    lines:  int = 0     # set by the code of the stage
+    bytes:  int = 0
+
+    def rates(self) -> str:
+        if self.wall_s <= 0:
+            return ''
+        result = []
+        if self.lines:
+            result.append(f'{self.lines / self.wall_s:.0f} lines/s')
+        if self.bytes:
+            result.append(f'{self.bytes / self.wall_s / 1e6:.1f} MB/s')
+        return ', '.join(result)
+
+@dataclass
+class Instruments:
+    stages:   list[Stage] = field(default_factory=list)
+    counters: dict = field(default_factory=dict)
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[Stage]:
+        "Measures the block, the block may set lines and bytes of the yielded stage"
+        current = Stage(name)
+        wall_started, cpu_started = time.perf_counter(), cpu_time()
+        try:
+            yield current
+        finally:
+            current.wall_s = time.perf_counter() - wall_started
+            current.cpu_s = cpu_time() - cpu_started
+            self.stages.append(current)
+
+    def summary(self) -> list[str]:
+        "Lines for the journal"
+        lines = []
+        for st in self.stages:
+            rates = st.rates()
+            lines.append(f'  {st.name}: {st.wall_s:.3f} s wall, {st.cpu_s:.3f} s CPU' +
+                         (f', {rates}' if rates else ''))
+        lines.extend(f'  {key}: {value}' for key, value in self.counters.items())
+        peak = peak_rss_mb()
+        if peak is not None:
+            lines.append(f'  peak RSS: {peak:.1f} MB')
+        return lines
+
+    def as_dict(self) -> dict:
+        return {'stages': [asdict(st) for st in self.stages],
+                'counters': dict(self.counters),
+                'peak_rss_mb': peak_rss_mb()}
+
+class Progress:
+    """Progress callback of the readers: logs bytes consumed of the total, lines per second
+    since the previous message and ETA, at most once per 'interval' seconds"""
+    __slots__ = ('log', 'name', 'start', 'total', 'interval', 'started', 'lines',
+                 'last_time', 'last_lines', 'next_report')
+
+    def __init__(self, log: logging.Logger, name: str, total: int, interval: float, start: int = 0):
+        self.log = log
+        self.name = name
+        self.start = start      # the pass is over bytes [start, total) of the file
+        self.total = total
+        self.interval = interval
+        self.started = self.last_time = time.monotonic()
+        self.next_report = self.started + interval
+        self.lines = self.last_lines = 0
+
+    def __call__(self, lines: int, position: int):
+        self.lines += lines
+        now = time.monotonic()
+        if now >= self.next_report:
+            self.log.info(self.message(position, now))
+            self.last_time, self.last_lines = now, self.lines
+            self.next_report = now + self.interval
+
+    def message(self, position: int, now: float) -> str:
+        done, size = position - self.start, max(self.total - self.start, 1)
+        lines_per_s = (self.lines - self.last_lines) / max(now - self.last_time, 1e-9)
+        # ETA by the average rate of the pass, the rate of the last interval jumps more
+        eta = (size - done) * (now - self.started) / done if done > 0 else None
+        return (f'{self.name}: {100 * done / size:.1f}% ({position / 1e6:.1f} of {self.total / 1e6:.1f} MB), '
+                f'{lines_per_s:.0f} lines/s, ETA {dt.timedelta(seconds=round(eta)) if eta is not None else "unknown"}')
+
+
+if __name__ == "__main__":
+    print("This is a library, not a program")
@@ -4,23 +4,48 @@
 #                     '$status $body_bytes_sent "$http_referer" '
 #                     '"$http_user_agent" "$http_x_forwarded_for" "$http_X_REQUEST_ID" "$http_X_RB_USER" '
 #                     '$request_time';
+# logs in other formats are read with LOG_FORMAT: a file with their log_format (log_format.py)
 
 import nginx_log_parser as nlp
+import log_readers as lr
+import quantile_sketch as qs
+import url_normalizer as un
+import vector_stats as vs
+import instrumentation as instr
+import time_series as tms
+import log_format as lf
 import config_file_parser as cfp
 import program_config as prgconf
 # standard library modules
 import itertools as it
+import functools as ft
+import heapq
+import operator
 import logging
+import os
 import sys
-import fileinput
+import time
 import pathlib as pl
 import datetime as dt
-from dataclasses import dataclass
-from typing import Optional, Union, NamedTuple, Callable, Any
+from dataclasses import dataclass, fields
+from typing import Optional, Union, NamedTuple, Callable, Any, Iterable, Iterator
 from collections.abc import  MutableMapping
 from array import array
 from enum import Enum, IntEnum
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import json
+import json.encoder
+import pickle
+import gzip
+import cProfile
+import shutil
+import tempfile
+import asyncio
+import signal
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # You can modify the default configuration here
 # it it just a text string to be parsed as a config file
@@ -33,6 +58,35 @@ CONFIG = """
     REPORT_GLOB: report-%Y.%m.%d.html
     ALLOW_EXTENSIONS: gz
     REPORT_TEMPLATE: report.html
+    # LOG_PARSER: fast
+    # WORKERS: 1
+    # QUANTILES: exact
+    # QUANTILE_ERROR: 0.01
+    # INCREMENTAL: off
+    # BACKFILL: off
+    # BACKFILL_JOBS: 1
+    # DECOMPRESSOR: auto
+    # READER: auto
+    # REPORT_THRESHOLD: 1
+    # REPORT_SORT: sum
+    # STRIP_QUERY: off
+    # COLLAPSE_IDS: off
+    # URL_RULES:
+    # MAX_URLS: 0
+    # STATS_BACKEND: auto
+    # SAVE_AGGREGATES: on
+    # MERGE: off
+    # METRICS: off
+    # PROFILE: off
+    # PROGRESS_INTERVAL: 10
+    # MEMORY_BUDGET: 0
+    # SPILL_DIR:
+    # JSON_BACKEND: auto
+    # SERIES_INTERVAL: 0
+    # REPORT_PRECISION:
+    # LOG_FORMAT:
+    # DAEMON: off
+    # DAEMON_INTERVAL: 60
     # Next line is for optional journal file.
     # JOURNAL:
 """
@@ -52,13 +106,49 @@ class ReportFileState(Enum):
     NOFILE = 1
     NODIR = 2
 
-class UrlInfo(NamedTuple):
+# per-URL request counters: by method (index in nginx_log_parser.METHODS, the last one is
+# METHOD_UNKNOWN), then by status class (status // 100), all in one small list: incrementing
+# a list item is twice as fast as an array one, which boxes the value on every access
+METHOD_COUNTERS = len(nlp.METHODS) + 1
+STATUS_COUNTERS = 10
+URL_COUNTERS = METHOD_COUNTERS + STATUS_COUNTERS
+
+class UrlInfo:
     """all the URL information will be collected here. The URL itself will
-       be a key in the dictionary where this tuple will be a value"""
-    durations:   array
-    occurencies: int = 0
-    max_latency: int = 0
-    sum_latency: int = 0
+       be a key in the dictionary where this object will be a value.
+       'durations' is a quantile estimator (see quantile_sketch) or a plain array of values,
+       'counters' are requests by method and by status class (see URL_COUNTERS).
+       The object is updated in place, slots save memory and attribute access time"""
+    __slots__ = ('durations', 'occurencies', 'max_latency', 'sum_latency', 'counters')
+
+    def __init__(self, durations: Union[qs.QuantileEstimator, array],
+                 occurencies: int = 0, max_latency: int = 0, sum_latency: int = 0,
+                 counters: Optional[list[int]] = None):
+        self.durations   = durations
+        self.occurencies = occurencies
+        self.max_latency = max_latency
+        self.sum_latency = sum_latency
+        self.counters    = counters if counters is not None else [0] * URL_COUNTERS
+
+    def add(self, duration: int):
+        self.durations.add(duration)
+        self.occurencies += 1
+        if duration > self.max_latency:
+            self.max_latency = duration
+        self.sum_latency += duration
+
+    def merge(self, other: 'UrlInfo'):
+        self.durations.merge(other.durations)
+        self.occurencies += other.occurencies
+        self.max_latency = max(self.max_latency, other.max_latency)
+        self.sum_latency += other.sum_latency
+        counters = self.counters
+        for idx, count in enumerate(other.counters):
+            counters[idx] += count
+
+    def __repr__(self):
+        return (f'UrlInfo(occurencies={self.occurencies}, max_latency={self.max_latency}, ' +
+                f'sum_latency={self.sum_latency})')
 
 @dataclass(frozen=True)
 class GeneralStats:
@@ -78,10 +168,243 @@ class OutputUrlStats:
     time_med  : float
     time_perc : float
     count_perc: float
+    time_p90  : float = 0.0
+    time_p99  : float = 0.0
+    count_2xx : int = 0
+    count_3xx : int = 0
+    count_4xx : int = 0
+    count_5xx : int = 0
+    count_get : int = 0
+    count_post: int = 0
+    count_head: int = 0
+    count_put : int = 0
+    count_delete: int = 0
+    count_other_methods: int = 0
 
 UrlDict     = MutableMapping[str, UrlInfo]
 StatsResult = tuple[UrlDict, GeneralStats]
 
+class UrlTable(NamedTuple):
+    """Columnar form of URL statistics: every URL is interned once to an integer id (its
+    position in 'urls'), the counters are arrays indexed by the id.  Exact durations of all
+    the URLs are concatenated into one array and 'lengths' splits it back, other estimators
+    are kept as a list, the counters of all the URLs are one array too.  Such a table is
+    pickled many times faster than a dict of UrlInfo"""
+    urls:        list
+    occurencies: array
+    max_latency: array
+    sum_latency: array
+    durations:   Union[array, list]
+    lengths:     Optional[array] = None
+    counters:    Optional[array] = None     # URL_COUNTERS of every URL, none in old tables
+
+    @classmethod
+    def from_dict(cls, url_stats: UrlDict) -> 'UrlTable':
+        return cls.from_items(list(url_stats.keys()), list(url_stats.values()))
+
+    @classmethod
+    def from_items(cls, urls: list, infos: list[UrlInfo]) -> 'UrlTable':
+        "URLs and their statistics come as two parallel lists"
+        estimators = [ui.durations for ui in infos]
+        if all(isinstance(est, (qs.ExactQuantiles, array)) for est in estimators):
+            values = [est.values if isinstance(est, qs.ExactQuantiles) else est for est in estimators]
+            durations = array('l')
+            for vals in values:
+                durations.extend(vals)
+            lengths = array('q', map(len, values))
+        else:
+            durations, lengths = estimators, None
+        counters = array('q')
+        for ui in infos:
+            counters.extend(ui.counters)
+        return cls(urls        = urls,
+                   occurencies = array('q', (ui.occurencies for ui in infos)),
+                   max_latency = array('q', (ui.max_latency for ui in infos)),
+                   sum_latency = array('q', (ui.sum_latency for ui in infos)),
+                   durations   = durations,
+                   lengths     = lengths,
+                   counters    = counters)
+
+    def items(self) -> Iterator[tuple[Any, UrlInfo]]:
+        "URLs with their statistics in the order of the table"
+        if self.lengths is None:
+            estimators = self.durations
+        else:
+            ends = it.accumulate(self.lengths)
+            estimators = (qs.ExactQuantiles(self.durations[end - length:end])
+                          for length, end in zip(self.lengths, ends))
+        if self.counters is None:
+            counters = it.repeat(None)
+        else:
+            counters = (self.counters[start:start + URL_COUNTERS].tolist()
+                        for start in range(0, len(self.counters), URL_COUNTERS))
+        return ((url, UrlInfo(est, occ, max_lat, sum_lat, cnt)) for url, est, occ, max_lat, sum_lat, cnt
+                in zip(self.urls, estimators, self.occurencies, self.max_latency, self.sum_latency, counters))
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+class ChunkResult(NamedTuple):
+    """statistics collected from a file or a part of the file.  Worker processes send it
+    to the parent and checkpoints keep it, so it is pickled with URL statistics as a table"""
+    url_stats:     UrlDict
+    general_stats: GeneralStats
+    good_lines:    int
+    bad_lines:     int
+    series:        Optional[tms.TimeSeries] = None     # time series of the URLs if configured
+
+    def __reduce__(self):
+        if isinstance(self.url_stats, SpilledUrlStats):
+            # the runs stay on disk, only their names are sent
+            return (ChunkResult, tuple(self))
+        return (_chunk_result_from_table,
+                (UrlTable.from_dict(self.url_stats), self.general_stats, self.good_lines, self.bad_lines,
+                 self.series))
+
+def _chunk_result_from_table(table: UrlTable, general_stats: GeneralStats,
+                             good_lines: int, bad_lines: int,
+                             series: Optional[tms.TimeSeries] = None) -> ChunkResult:
+    return ChunkResult(table.to_dict(), general_stats, good_lines, bad_lines, series)
+
+@dataclass
+class Checkpoint:
+    """State of incremental processing of a log file that is still being written:
+    file identity, offset of the first unprocessed byte and the statistics collected so far"""
+    file_name:   str
+    file_id:     tuple[int, int]    # (st_dev, st_ino)
+    offset:      int
+    quantiles:   tuple[str, float]  # estimator settings, the statistics can't be mixed otherwise
+    result:      ChunkResult
+    urls:        tuple = ()         # URL normalization settings and the cap on distinct URLs
+    parsing:     tuple = ()         # parser or log format and the length of time series buckets
+
+@dataclass
+class DailyAggregate:
+    """Statistics of one day kept next to its report (gzipped pickle), the reports for weeks
+    and months are made by merging them.  Request times are kept as sketches even with exact
+    quantiles, so the size doesn't grow with the number of requests"""
+    date:        dt.date
+    quantiles:   tuple[str, float]  # estimator settings, aggregates can't be merged otherwise
+    urls:        tuple              # URL normalization settings and the cap on distinct URLs
+    result:      ChunkResult
+    parsing:     tuple = ()         # parser or log format and the length of time series buckets
+
+@dataclass
+class TailState:
+    """Log file followed by the daemon: its identity, offset of the first unread byte and the
+    statistics of the read part, kept in memory between the polls.  'result' is None for a
+    compressed log, it isn't followed"""
+    file_name:   pl.Path
+    file_id:     tuple[int, int]    # (st_dev, st_ino)
+    offset:      int
+    result:      Optional[ChunkResult]
+    dirty:       bool = False       # lines were read after the last report
+    rendered:    float = 0.0        # time.monotonic() of the last report
+
+# the daemon looks for new lines and rotated logs this often, seconds
+DAEMON_POLL_SECONDS = 1.0
+
+AGGREGATE_SUFFIX = '.stats'
+# the pickled table is mostly arrays of small numbers, fast compression is good enough
+AGGREGATE_COMPRESSION = 1
+PERIODS = ('week', 'month')
+# stage timings and cProfile statistics are written next to the report
+METRICS_SUFFIX = '.metrics.json'
+PROFILE_SUFFIX = '.prof'
+
+def sketch_url_stats(url_stats: UrlDict, relative_error: float) -> dict:
+    "The same URL statistics with exact request times put into LogHistogram sketches"
+    result = {}
+    for url, url_info in url_stats.items():
+        durations = url_info.durations
+        if not isinstance(durations, qs.LogHistogram):
+            sketch = qs.LogHistogram(relative_error)
+            for value in (durations.values if isinstance(durations, qs.ExactQuantiles) else durations):
+                sketch.add(value)
+            durations = sketch
+        result[url] = UrlInfo(durations, url_info.occurencies, url_info.max_latency, url_info.sum_latency,
+                              url_info.counters)
+    return result
+
+class SpillSettings(NamedTuple):
+    "URL statistics above the memory budget are spilled to sorted runs in the directory"
+    budget:    int      # bytes
+    directory: str
+
+# the size of URL statistics is estimated once per this number of lines
+SPILL_CHECK_LINES = 1 << 14
+# rough size of a URL in memory: the key, its UrlInfo with an estimator and counters and the
+# dict entry, plus a value of exact durations or a histogram of a sketch
+URL_ENTRY_BYTES = 540
+DURATION_BYTES = 8
+SKETCH_BYTES = 2048
+# runs are written and read back in slices of this number of URLs
+SPILL_BATCH = 1024
+MEGABYTE = 1 << 20
+SPILL_SUFFIX = '.run'
+
+def estimate_stats_bytes(urls_count: int, values_count: int, exact: bool) -> int:
+    if exact:
+        return urls_count * URL_ENTRY_BYTES + values_count * DURATION_BYTES
+    return urls_count * (URL_ENTRY_BYTES + SKETCH_BYTES)
+
+def write_run(url_stats: UrlDict, directory: str) -> str:
+    """Writes URL statistics sorted by URL to a new file in the directory as a sequence of
+    pickled UrlTable slices, returns the file name.  Undecoded URLs are decoded"""
+    items = sorted(((url.decode('utf-8', errors='replace') if isinstance(url, bytes) else url, url_info)
+                    for url, url_info in url_stats.items()), key=lambda item: item[0])
+    fd, run_fn = tempfile.mkstemp(suffix=SPILL_SUFFIX, dir=directory)
+    with open(fd, 'wb') as f_out:
+        for start in range(0, len(items), SPILL_BATCH):
+            batch = items[start:start + SPILL_BATCH]
+            pickle.dump(UrlTable.from_items([url for url, _ in batch], [ui for _, ui in batch]),
+                        f_out, protocol=pickle.HIGHEST_PROTOCOL)
+    return run_fn
+
+def read_run(run_fn: str) -> Iterator[tuple[str, UrlInfo]]:
+    "URL statistics of a run in the order of URLs, one slice is in memory at a time"
+    with open(run_fn, 'rb') as f_in:
+        while True:
+            try:
+                table = pickle.load(f_in)
+            except EOFError:
+                return
+            yield from table.items()
+
+class SpilledUrlStats:
+    """URL statistics spilled to sorted runs.  items() merges the runs URL by URL, so a slice
+    of every run is in memory, not all the statistics.  There is no random access, the
+    runs are read on every call of items().  Every run is capped on its own, so the cap of
+    'max_urls' distinct URLs is applied again when they are merged: the first URLs in sorted
+    order are kept, the others go to OTHER_URL, which comes last"""
+    __slots__ = ('runs', 'directory', 'max_urls')
+
+    def __init__(self, runs: list[str], directory: str, max_urls: int = 0):
+        self.runs = runs
+        self.directory = directory
+        self.max_urls = max_urls
+
+    def items(self) -> Iterator[tuple[str, UrlInfo]]:
+        merged = heapq.merge(*(read_run(run_fn) for run_fn in self.runs), key=lambda item: item[0])
+        max_urls, distinct, other_info = self.max_urls, 0, None
+        for url, group in it.groupby(merged, key=lambda item: item[0]):
+            _, url_info = next(group)
+            for _, other in group:
+                url_info.merge(other)
+            if max_urls and (url == un.OTHER_URL or distinct >= max_urls):
+                if other_info is None:
+                    other_info = url_info
+                else:
+                    other_info.merge(url_info)
+                continue
+            distinct += 1
+            yield url, url_info
+        if other_info is not None:
+            yield un.OTHER_URL, other_info
+
+    def __repr__(self):
+        return f'SpilledUrlStats({len(self.runs)} runs in {self.directory})'
+
 # -- trying to re-implement Rust Status class
 @dataclass(frozen=True)
 class Err:
@@ -93,47 +416,109 @@ class Ok:
 
 StatusWithData = Union[Err, Ok]
 
+# quantiles of request time in the report: median, p90, p99
+REPORT_QUANTILES = (0.5, 0.9, 0.99)
+# methods with their own columns in the report, the rest are counted together
+REPORT_METHODS = ('GET', 'POST', 'HEAD', 'PUT', 'DELETE')
+
 def compute_output_stats(url: str, url_info: UrlInfo, total_count: int,
-                         total_duration: int) -> OutputUrlStats:
+                         total_duration: int, quantiles: Optional[list[int]] = None) -> OutputUrlStats:
+    "'quantiles' are REPORT_QUANTILES of the URL if they are computed already"
     MS_IN_S = 1000
+    median, perc_90, perc_99 = quantiles or compute_quantiles(url_info, REPORT_QUANTILES)
+    counters = url_info.counters
+    # requests of unknown method are in none of the method columns
+    by_method = counters[:nlp.METHOD_UNKNOWN]
+    methods = nlp.METHOD_CODES
     return OutputUrlStats(
         url        = url,
         count      = url_info.occurencies,
         time_max   = float(url_info.max_latency) / MS_IN_S,
         time_sum   = float(url_info.sum_latency) / MS_IN_S,
-        time_med   = compute_median(url_info) / MS_IN_S,
+        time_med   = median / MS_IN_S,
+        time_p90   = perc_90 / MS_IN_S,
+        time_p99   = perc_99 / MS_IN_S,
         time_perc  = float(100*url_info.sum_latency)/float(total_duration),
         count_perc = float(100*url_info.occurencies)/float(total_count),
         time_avg   = url_info.sum_latency / (url_info.occurencies * MS_IN_S),
+        count_2xx  = counters[METHOD_COUNTERS + 2],
+        count_3xx  = counters[METHOD_COUNTERS + 3],
+        count_4xx  = counters[METHOD_COUNTERS + 4],
+        count_5xx  = counters[METHOD_COUNTERS + 5],
+        count_get  = by_method[methods['GET']],
+        count_post = by_method[methods['POST']],
+        count_head = by_method[methods['HEAD']],
+        count_put  = by_method[methods['PUT']],
+        count_delete = by_method[methods['DELETE']],
+        count_other_methods = sum(by_method) - sum(by_method[methods[m]] for m in REPORT_METHODS),
         )
 
-def compute_median(url_info: UrlInfo) -> int:
+def compute_quantiles(url_info: UrlInfo, fractions: tuple[float, ...]) -> list[int]:
     if url_info.occurencies > 1:
-        sorted_times = sorted(url_info.durations)
-        midele_idx = url_info.occurencies // 2
-        if url_info.occurencies %2 == 0:  # median is an average between two values in the center
-            return (sorted_times[midele_idx] + sorted_times[midele_idx - 1]) // 2
-        else:
-            return sorted_times[midele_idx]
+        durations = url_info.durations
+        if isinstance(durations, array):
+            durations = qs.ExactQuantiles(durations)
+        return durations.quantiles(fractions)
     else:
-        return url_info.max_latency
-
-def select_n_longest_delayd_urls(stats: UrlDict, n: int) -> list[str]:
-    "Selects N URLs with the most sum_latency and returns them as a list"
-    threshold = 1  # milliseconds, XXX better be parametrized
-    url_tuples = [ (u, s.sum_latency) for u,s in stats.items() if s.sum_latency > threshold ]
-    url_tuples.sort(key = lambda x: x[1], reverse=True)
-    urls_selected = [u for u, _ in url_tuples][0:n]
-    return urls_selected
-
-def process_stats(stats: StatsResult, urls_count_to_select) -> list[OutputUrlStats]:
-    """Computes some summary statistics about processing duration/latencies"""
+        return [url_info.max_latency for _ in fractions]
+
+def compute_median(url_info: UrlInfo) -> int:
+    return compute_quantiles(url_info, (0.5,))[0]
+
+def compute_quantiles_of_urls(url_stats: UrlDict, urls: list[str], fractions: tuple[float, ...],
+                              backend: str = 'python') -> list[list[int]]:
+    """Quantiles for every URL of the list.  The 'numpy' backend (see vector_stats) computes
+    them for all the URLs in one pass when the durations are exact, otherwise it's done
+    URL by URL"""
+    if backend == 'numpy' and urls:
+        table = UrlTable.from_items(urls, [url_stats[url] for url in urls])
+        if table.lengths is not None:
+            return vs.segment_quantiles(table.durations, table.lengths, fractions)
+    return [compute_quantiles(url_stats[url], fractions) for url in urls]
+
+# metrics the report can be ranked by
+SORT_KEYS: dict[str, Callable[[UrlInfo], int]] = {
+    'sum':    lambda url_info: url_info.sum_latency,
+    'count':  lambda url_info: url_info.occurencies,
+    'max':    lambda url_info: url_info.max_latency,
+    'median': compute_median,
+    'p99':    lambda url_info: compute_quantiles(url_info, (0.99,))[0],
+}
+# the keys computed for all the candidate URLs at once by vectorized backend
+QUANTILE_SORT_KEYS = {'median': 0.5, 'p99': 0.99}
+DEFAULT_THRESHOLD = 1   # milliseconds
+
+def select_top_url_stats(stats: Union[UrlDict, SpilledUrlStats], n: int, threshold: int = DEFAULT_THRESHOLD,
+                         sort_key: str = 'sum', backend: str = 'python') -> list[tuple[str, UrlInfo]]:
+    """Selects N URLs with the greatest value of 'sort_key' (one of SORT_KEYS) among the URLs
+    with sum_latency above 'threshold', returns them with their statistics.  Only N URLs are
+    kept in a heap, the rest isn't sorted; the order of equal URLs is the same as of a stable
+    sort.  The statistics are iterated once, so spilled ones are merged from disk on the fly"""
+    if backend == 'numpy' and sort_key in QUANTILE_SORT_KEYS and not isinstance(stats, SpilledUrlStats):
+        candidates = [u for u, s in stats.items() if s.sum_latency > threshold]
+        keys = compute_quantiles_of_urls(stats, candidates, (QUANTILE_SORT_KEYS[sort_key],), backend)
+        top = heapq.nlargest(n, zip(candidates, (key for key, in keys)), key=lambda x: x[1])
+        return [(u, stats[u]) for u, _ in top]
+    key_of = SORT_KEYS[sort_key]
+    url_keys = ((u, s, key_of(s)) for u, s in stats.items() if s.sum_latency > threshold)
+    return [(u, s) for u, s, _ in heapq.nlargest(n, url_keys, key=lambda x: x[2])]
+
+def select_n_longest_delayd_urls(stats: UrlDict, n: int, threshold: int = DEFAULT_THRESHOLD,
+                                 sort_key: str = 'sum', backend: str = 'python') -> list[str]:
+    "URLs of select_top_url_stats"
+    return [u for u, _ in select_top_url_stats(stats, n, threshold, sort_key, backend)]
+
+def process_stats(stats: StatsResult, urls_count_to_select, threshold: int = DEFAULT_THRESHOLD,
+                  sort_key: str = 'sum', backend: str = 'python') -> list[OutputUrlStats]:
+    """Computes some summary statistics about processing duration/latencies.
+    'backend' is 'python' or 'numpy' (vector_stats.resolve_backend)"""
     url_stats, totals = stats
-    # sort URL statistics by sum duration and take first N from them
-    urls_s = select_n_longest_delayd_urls(url_stats, urls_count_to_select)
-    # url.stats.take_first(config.ort_size)
-    return ([ compute_output_stats(url, url_stats[url], totals.total_records, totals.sum_latency)
-               for url in urls_s ])
+    # take first N URLs by the sort key
+    selected = dict(select_top_url_stats(url_stats, urls_count_to_select, threshold, sort_key, backend))
+    urls_s = list(selected)
+    quantiles = compute_quantiles_of_urls(selected, urls_s, REPORT_QUANTILES, backend)
+    return ([ compute_output_stats(url, selected[url], totals.total_records, totals.sum_latency, url_quantiles)
+               for url, url_quantiles in zip(urls_s, quantiles) ])
 
 class OutputJSONEncoder(json.JSONEncoder):
     """Helper class for encoding OutputUrlStats to JSON"""
@@ -147,6 +532,340 @@ class OutputJSONEncoder(json.JSONEncoder):
 def output_to_json(stats_list: list[OutputUrlStats]) -> str:
     return json.dumps(stats_list, cls=OutputJSONEncoder, separators=(',', ':')) 
 
+# rows of the report table are encoded to JSON in batches
+JSON_ROWS_BATCH = 1024
+
+# a row of the report is formatted by a precompiled format string, the same way json.dumps
+# does it: URL is escaped to ASCII, numbers are their repr().  repr() of floats takes most
+# of the time, with 'precision' they are formatted with fixed point, that is 3-4 times faster
+_OUTPUT_FIELDS = tuple(f.name for f in fields(OutputUrlStats))
+_NUMBER_FIELDS = operator.attrgetter(*_OUTPUT_FIELDS[1:])
+_ROW_FORMAT = '{"url":%s,' + ','.join(f'"{name}":%r' for name in _OUTPUT_FIELDS[1:]) + '}'
+
+_INT_FIELDS = frozenset(f.name for f in fields(OutputUrlStats) if f.type is int)
+
+@ft.cache
+def rounded_row_format(precision: int) -> str:
+    "Format of a row with the counters as integers and the other numbers rounded"
+    return ('{"url":%s,' + ','.join(f'"{name}":%d' if name in _INT_FIELDS else f'"{name}":%.{precision}f'
+                                    for name in _OUTPUT_FIELDS[1:]) + '}')
+
+def encode_rows_python(rows: list[OutputUrlStats], precision: Optional[int] = None) -> str:
+    "JSON objects of the rows separated by commas, floats are rounded to 'precision' digits if given"
+    row_format = _ROW_FORMAT if precision is None else rounded_row_format(precision)
+    escape, numbers = json.encoder.encode_basestring_ascii, _NUMBER_FIELDS
+    return ','.join([row_format % (escape(rec.url), *numbers(rec)) for rec in rows])
+
+def encode_rows_orjson(rows: list[OutputUrlStats], precision: Optional[int] = None) -> str:
+    """The same with orjson, non-ASCII characters of URLs aren't escaped.  Rounding in Python
+    would cost more than orjson saves, rounded rows are formatted by encode_rows_python"""
+    if precision is not None:
+        return encode_rows_python(rows, precision)
+    return orjson.dumps(rows)[1:-1].decode('utf-8')
+
+def resolve_json_backend(name: str) -> str:
+    "'auto' is 'orjson' when it is installed"
+    if name == 'auto':
+        return 'orjson' if orjson is not None else 'python'
+    return name
+
+JSON_ENCODERS = {
+    'python': encode_rows_python,
+    'orjson': encode_rows_orjson,
+}
+
+def json_rows(stats_list: Iterable[OutputUrlStats], backend: str = 'python',
+              precision: Optional[int] = None) -> Iterator[str]:
+    """JSON array of the report rows in pieces, a batch of rows is encoded at a time.
+    The 'python' backend without 'precision' gives the same JSON as output_to_json"""
+    encode_rows = JSON_ENCODERS[backend]
+    rows = iter(stats_list)
+    separator = ''
+    yield '['
+    while batch := list(it.islice(rows, JSON_ROWS_BATCH)):
+        yield separator + encode_rows(batch, precision)
+        separator = ','
+    yield ']'
+
+TEMPLATE_PLACEHOLDER = '$table_json'
+# the second table of the report, time series of the report URLs ('null' without them)
+SERIES_PLACEHOLDER = '$series_json'
+
+class TemplateParts(NamedTuple):
+    "Report template split at the placeholder, the JSON table goes between the parts"
+    prefix:    str
+    suffix:    str
+    has_table: bool     # a template without the placeholder is the report as it is
+
+def split_template(template: str) -> TemplateParts:
+    prefix, placeholder, suffix = template.partition(TEMPLATE_PLACEHOLDER)
+    return TemplateParts(prefix, suffix, bool(placeholder))
+
+def series_points(series: tms.TimeSeries, urls: Iterable[str]) -> Iterator[dict]:
+    "Rows of the time series table: a row per URL and bucket with requests, times in seconds"
+    MS_IN_S = 1000
+    for url in urls:
+        url_series = series.urls.get(url)
+        if url_series is None:
+            continue
+        for bucket, count, total, (median, perc_90, perc_99) in url_series.points(REPORT_QUANTILES):
+            yield {'url':      url,
+                   'time':     series.bucket_start(bucket).isoformat(timespec='minutes'),
+                   'count':    count,
+                   'time_avg': total / (count * MS_IN_S),
+                   'time_med': median / MS_IN_S,
+                   'time_p90': perc_90 / MS_IN_S,
+                   'time_p99': perc_99 / MS_IN_S}
+
+def series_to_json(series: Optional[tms.TimeSeries], urls: Iterable[str]) -> str:
+    "The time series table of the URLs, 'null' if there are no series"
+    if series is None:
+        return 'null'
+    return json.dumps(list(series_points(series, urls)), separators=(',', ':'))
+
+def aggregate_lines(lines: Iterable[Union[str, bytes]], parse_log_line: Callable, log: logging.Logger,
+                    new_estimator: Callable[[], qs.QuantileEstimator] = qs.ExactQuantiles,
+                    normalize_url: Optional[Callable] = None, max_urls: int = 0,
+                    spill: Optional[SpillSettings] = None, series_interval: int = 0) -> ChunkResult:
+    """Parses the lines and collects statistics from them.  This is the hot loop of the program,
+    so the counters are local variables and URL statistics are updated in place.
+    URLs are passed through 'normalize_url' (if any); when there are 'max_urls' distinct URLs
+    already (0 for no limit), the new ones are accounted under url_normalizer.OTHER_URL.
+    When estimated size of URL statistics exceeds 'spill' budget, they are written to a sorted
+    run and collection starts anew; the result of such a pass has SpilledUrlStats.
+    With 'series_interval' (seconds, whole minutes) time series of every URL are collected
+    too, the timestamps are converted once per distinct minute"""
+    bad_lines_counter = 0
+    good_lines_counter = 0
+    total_records = 0
+    sum_latency = 0
+    url_stats = {}
+    get_url_info = url_stats.get
+    # one comparison per line, the check is never reached without a budget
+    next_check = SPILL_CHECK_LINES if spill is not None else sys.maxsize
+    exact = new_estimator is qs.ExactQuantiles
+    runs, spilled_records = [], 0
+    series = tms.TimeSeries(series_interval) if series_interval else None
+    series_urls = series.urls if series is not None else {}
+    get_url_series = series_urls.get
+    bucket_of = {}
+    status_base = METHOD_COUNTERS
+    for in_line in lines:
+        linedata = parse_log_line(in_line, log)
+        if linedata is None:
+            bad_lines_counter += 1
+            continue
+        ts, url, duration, method, status = linedata
+        # small optimization: don't add zeroes
+        if duration > 0:
+            if normalize_url is not None:
+                url = normalize_url(url)
+            url_info = get_url_info(url)
+            if url_info is None:
+                if max_urls and len(url_stats) >= max_urls:
+                    url = un.OTHER_URL_BYTES if isinstance(url, bytes) else un.OTHER_URL
+                    url_info = get_url_info(url)
+                if url_info is None:
+                    url_info = url_stats[url] = UrlInfo(new_estimator())
+            url_info.add(duration)
+            counters = url_info.counters
+            counters[method] += 1
+            counters[status_base + status // 100] += 1
+            if series is not None:
+                # buckets are whole minutes: '29/Jun/2017:03:50:23 +0300' -> '29/Jun/2017:03:50 +0300'
+                minute = ts[:-9] + ts[-6:]
+                bucket = bucket_of.get(minute, -1)
+                if bucket == -1:
+                    bucket = bucket_of[minute] = series.bucket_of(ts)
+                if bucket is not None:
+                    url_series = get_url_series(url)
+                    if url_series is None:
+                        url_series = series_urls[url] = tms.UrlSeries()
+                    url_series.add(bucket, duration)
+            total_records += 1
+            sum_latency += duration
+        good_lines_counter += 1
+        if good_lines_counter >= next_check:
+            next_check += SPILL_CHECK_LINES
+            if estimate_stats_bytes(len(url_stats), total_records - spilled_records, exact) > spill.budget:
+                log.debug(f'aggregate_lines::spilling {len(url_stats)} URLs to {spill.directory}')
+                runs.append(write_run(url_stats, spill.directory))
+                url_stats = {}
+                get_url_info = url_stats.get
+                spilled_records = total_records
+    if runs:
+        if url_stats:
+            runs.append(write_run(url_stats, spill.directory))
+        url_stats = SpilledUrlStats(runs, spill.directory, max_urls)
+    return ChunkResult(url_stats, GeneralStats(total_records, sum_latency),
+                       good_lines_counter, bad_lines_counter, series)
+
+def empty_chunk_result(series_interval: int = 0) -> ChunkResult:
+    return ChunkResult({}, GeneralStats(0, 0), 0, 0,
+                       tms.TimeSeries(series_interval) if series_interval else None)
+
+def decode_urls(chunk_result: ChunkResult) -> ChunkResult:
+    """The lines read in binary mode are aggregated with URLs as bytes, every distinct URL
+    is decoded once here (spilled URLs are decoded when written).  Invalid UTF-8 is replaced
+    as in decoded lines, so URLs which differ in such bytes only are merged"""
+    if chunk_result.series is not None:
+        chunk_result = chunk_result._replace(series = chunk_result.series.decoded())
+    if isinstance(chunk_result.url_stats, SpilledUrlStats):
+        return chunk_result
+    url_stats = {}
+    for url, url_info in chunk_result.url_stats.items():
+        url = url.decode('utf-8', errors='replace')
+        if url in url_stats:
+            url_stats[url].merge(url_info)
+        else:
+            url_stats[url] = url_info
+    return chunk_result._replace(url_stats = url_stats)
+
+def merge_chunk_results(left: ChunkResult, right: ChunkResult, max_urls: int = 0) -> ChunkResult:
+    """Merges statistics of the right chunk into the left one.  Left url_stats is modified.
+    The URLs above the cap of 'max_urls' distinct ones (0 for no limit) go to OTHER_URL.
+    If any of the chunks is spilled, the result is spilled too: the other one is written
+    as one more run and the runs are merged (and capped) when the report is made.
+    The result has time series only if both chunks have them with the same interval"""
+    series = left.series
+    if series is not None and (right.series is None or right.series.interval != series.interval):
+        series = None
+    elif series is not None and series.utcoffset is None:
+        series.utcoffset = right.series.utcoffset
+    if isinstance(left.url_stats, SpilledUrlStats) or isinstance(right.url_stats, SpilledUrlStats):
+        spilled = [stats for stats in (left.url_stats, right.url_stats) if isinstance(stats, SpilledUrlStats)]
+        directory = spilled[0].directory
+        runs = []
+        for stats in (left.url_stats, right.url_stats):
+            if isinstance(stats, SpilledUrlStats):
+                runs.extend(stats.runs)
+            elif stats:
+                runs.append(write_run(stats, directory))
+        url_stats = SpilledUrlStats(runs, directory, max_urls)
+        if series is not None:
+            for url, url_series in right.series.urls.items():
+                series.merge_url(url, url_series)
+    else:
+        url_stats = left.url_stats
+        right_series = right.series.urls if series is not None else {}
+        for url, url_info in right.url_stats.items():
+            url_series = right_series.get(url)
+            if url not in url_stats and max_urls and len(url_stats) >= max_urls:
+                url = un.OTHER_URL
+            if url in url_stats:
+                url_stats[url].merge(url_info)
+            else:
+                url_stats[url] = url_info
+            if url_series is not None:
+                series.merge_url(url, url_series)
+    return ChunkResult(
+        url_stats     = url_stats,
+        general_stats = GeneralStats(
+            total_records = left.general_stats.total_records + right.general_stats.total_records,
+            sum_latency   = left.general_stats.sum_latency + right.general_stats.sum_latency),
+        good_lines    = left.good_lines + right.good_lines,
+        bad_lines     = left.bad_lines + right.bad_lines,
+        series        = series,
+        )
+
+def period_bounds(day: dt.date, period: str) -> tuple[dt.date, dt.date]:
+    "First and last days of the ISO week (Monday to Sunday) or of the month of the day"
+    if period == 'week':
+        first_day = day - dt.timedelta(days=day.weekday())
+        return first_day, first_day + dt.timedelta(days=6)
+    first_day = day.replace(day=1)
+    next_month = (first_day + dt.timedelta(days=31)).replace(day=1)
+    return first_day, next_month - dt.timedelta(days=1)
+
+def split_file_to_chunks(file_name: pl.Path, chunks_count: int,
+                         start: int = 0, end: Optional[int] = None) -> list[tuple[int, int]]:
+    """Splits the byte range [start, end) of the file (the whole file by default) to smaller
+    ranges of roughly equal size, 'start' must be a beginning of a line, every range
+    begins at the start of a line"""
+    if end is None:
+        end = pl.Path(file_name).stat().st_size
+    boundaries = [start]
+    with open(file_name, 'rb') as f_in:
+        for i in range(1, chunks_count):
+            f_in.seek(start + (end - start) * i // chunks_count)
+            f_in.readline()  # skip to the beginning of the next line
+            pos = f_in.tell()
+            if pos > boundaries[-1] and pos < end:
+                boundaries.append(pos)
+    boundaries.append(end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def find_last_line_end(file_name: pl.Path, block_size: int = 64 * 1024) -> int:
+    "Offset just after the last newline of the file, the incomplete line being written is left out"
+    with open(file_name, 'rb') as f_in:
+        pos = f_in.seek(0, os.SEEK_END)
+        while pos > 0:
+            block_start = max(0, pos - block_size)
+            f_in.seek(block_start)
+            newline_idx = f_in.read(pos - block_start).rfind(b'\n')
+            if newline_idx >= 0:
+                return block_start + newline_idx + 1
+            pos = block_start
+    return 0
+
+def read_blocks_range(file_name: pl.Path, start: int, end: int,
+                      block_size: int = lr.BLOCK_SIZE) -> Iterator[bytes]:
+    "Yields the byte range [start, end) of the file in large blocks"
+    with open(file_name, 'rb') as f_in:
+        f_in.seek(start)
+        pos = start
+        while pos < end:
+            block = f_in.read(min(block_size, end - pos))
+            if not block:
+                break
+            pos += len(block)
+            yield block
+
+def read_lines_range(file_name: pl.Path, start: int, end: int,
+                     progress: Optional[lr.ProgressCallback] = None) -> Iterator[bytes]:
+    """Yields undecoded lines (without separators) of uncompressed file in the byte range
+    [start, end), both ends of the range must be line boundaries"""
+    batches = lr.line_batches(read_blocks_range(file_name, start, end))
+    if progress is not None:
+        batches = lr.reported_batches(batches, start, progress)
+    return it.chain.from_iterable(batches)
+
+def bytes_parser(parser: Union[str, lf.CompiledFormat]) -> Callable:
+    "Parser of undecoded lines: one of nginx_log_parser.BYTES_PARSERS or compiled from a log_format"
+    if isinstance(parser, str):
+        return nlp.BYTES_PARSERS[parser]
+    return lf.make_parser(parser)
+
+def process_file_chunk(file_name: pl.Path, start: int, end: int, parser: Union[str, lf.CompiledFormat],
+                       new_estimator: Callable[[], qs.QuantileEstimator],
+                       log: logging.Logger, reader: str = 'auto',
+                       normalize_url: Optional[Callable] = None, max_urls: int = 0,
+                       progress_interval: float = 0, progress_name: str = '',
+                       spill: Optional[SpillSettings] = None, series_interval: int = 0) -> ChunkResult:
+    """Worker function for parallel processing: statistics of one byte range of the file.
+    'reader' is one of log_readers.READERS, every worker maps or reads its own range.
+    'parser' is a name of a built-in parser or a compiled log_format (see bytes_parser).
+    Progress of the range is logged every 'progress_interval' seconds (0 for no messages)"""
+    progress = (instr.Progress(log, progress_name or pl.Path(file_name).name, end, progress_interval, start)
+                if progress_interval > 0 else None)
+    if reader == 'blocks':
+        lines = read_lines_range(file_name, start, end, progress)
+    else:
+        lines = lr.mmap_lines(file_name, start, end, progress)
+    return decode_urls(aggregate_lines(lines, bytes_parser(parser), log, new_estimator,
+                                       normalize_url, max_urls, spill, series_interval))
+
+class BackfillResult(NamedTuple):
+    file_name: pl.Path
+    status:    StatusWithData
+    seconds:   float
+
+def backfill_one_file(config, input_fn: pl.Path, log: logging.Logger) -> BackfillResult:
+    "Worker function for backfill: makes a report for one input file"
+    started = time.perf_counter()
+    status = setup_functions(config, log)['make_report_for_file'](input_fn)
+    return BackfillResult(input_fn, status, time.perf_counter() - started)
+
 def setup_functions(config, log):
     """
     Defines some functions with pre-defined parameters of 'configuration object'
@@ -180,6 +899,34 @@ def setup_functions(config, log):
         else:
             log.error(f"Report template file {report_tmpl} doesn't exist or isn't a file")
             return False
+        if config.stats_backend == 'numpy' and not vs.available():
+            log.error('NumPy statistics backend is requested, but NumPy is not installed')
+            return False
+        if config.json_backend == 'orjson' and orjson is None:
+            log.error('orjson JSON backend is requested, but orjson is not installed')
+            return False
+        try:
+            url_settings()
+        except (OSError, ValueError) as exc:
+            log.error(f'Cannot read URL rewrite rules: {exc}')
+            return False
+        try:
+            line_parser()
+        except (OSError, ValueError) as exc:
+            log.error(f'Cannot read log format: {exc}')
+            return False
+        if config.memory_budget and config.incremental:
+            log.error('Memory budget is not supported in incremental mode, checkpoints keep all the statistics')
+            return False
+        if config.memory_budget and config.daemon:
+            log.error('Memory budget is not supported in daemon mode, the statistics are kept in memory')
+            return False
+        if config.memory_budget and config.series_interval:
+            log.error('Memory budget is not supported with time series, they are kept in memory')
+            return False
+        if config.spill_dir and not pl.Path(config.spill_dir).is_dir():
+            log.error(f"Spill directory <{config.spill_dir}> doesn't exist or isn't a directory")
+            return False
         return True
 
     def parse_input_date(input_file_name) -> Optional[dt.date]:
@@ -213,20 +960,22 @@ def setup_functions(config, log):
             return 0
 
 
+    def list_input_files() -> Iterator[pl.Path]:
+        "All the files in log directory matching log_glob, with or without allowed extensions"
+        src_dir = pl.Path(config.log_dir)
+        # Here we chain iterators of log_glob per se and with all allowed extensions
+        glob_pattern = cfp.template_to_glob(config.log_glob)
+        return it.chain(src_dir.glob(glob_pattern),
+                        it.chain.from_iterable([
+                            src_dir.glob(glob_pattern + ext)  # extensions in list are with dots (.gz etc)
+                            for ext in config.allow_exts ]))
+
     def select_input_file() -> Optional[pl.Path]:
         log.debug(f'select_input_file called, config.log_dir is <{config.log_dir}>, config.log_glob is <{config.log_glob}>')
-        src_dir = pl.Path(config.log_dir)
         # Date format of YYYYMMDD and alike allows us to sort files lexicographically searching
-        # for the last file. Here we chain iterators of log_glob per se and with all
-        # allowed extensions
-        glob_pattern = cfp.template_to_glob(config.log_glob)
+        # for the last file.
         try:
-            last_src_file = max(it.chain(
-                                src_dir.glob(glob_pattern),
-                                it.chain.from_iterable([
-                                    src_dir.glob(glob_pattern + ext)  # extensions in list are with dots (.gz etc)
-                                    for ext in config.allow_exts ])),
-                                key = _timestamp_from_filename)
+            last_src_file = max(list_input_files(), key = _timestamp_from_filename)
             # check destination directory for report of that date
             log.debug(f'select_input_file: Input file {last_src_file} found, processing')
             return last_src_file
@@ -235,6 +984,20 @@ def setup_functions(config, log):
             log.info(f'No input files matching pattern <{config.log_glob}> found')
             return None
 
+    def select_all_input_files() -> list[pl.Path]:
+        """All the input files sorted by date, one file per date (an uncompressed one
+        when there are both), the files with unparseable dates are skipped"""
+        files_by_date = {}
+        for fn in sorted(list_input_files()):
+            file_date = parse_input_date(fn)
+            if file_date is None:
+                log.info(f'select_all_input_files: skipping file {fn} with invalid date')
+            elif file_date in files_by_date:
+                log.info(f'select_all_input_files: skipping {fn}, {files_by_date[file_date]} has the same date')
+            else:
+                files_by_date[file_date] = fn
+        return [files_by_date[d] for d in sorted(files_by_date)]
+
     def make_report_filename(input_file) -> pl.Path:
         log.debug(f'make_report_filename called with input file: {input_file}')
         # Using the new 3.10 features here, could be done with if/else
@@ -267,63 +1030,169 @@ def setup_functions(config, log):
             log.debug("search_for_report: destination directory doesn't exist")
             return ReportFileState.NODIR
 
-    def add_to_stats(url: str, duration: int, url_stats: UrlDict, gen_stats: GeneralStats):
-        # trying creation of docstrings from list of strings
-        " ".join(["Add current record to statistics in url_stats and gen_stats variables.",
-                  "Both url_stats and gen_stats will be modified by this function"])
-        if url in url_stats:
-            url_state = url_stats[url]
-            dur_array = url_state.durations
-            dur_array.append(duration)
-            url_stats[url] = UrlInfo(
-                durations   = dur_array,
-                occurencies = url_state.occurencies + 1,
-                max_latency = max(duration, url_state.max_latency),
-                sum_latency = url_state.sum_latency + duration,
-            )
+    def make_checkpoint_filename(input_file) -> pl.Path:
+        "Checkpoint of incremental processing is kept next to the report"
+        report_fn = make_report_filename(input_file)
+        return report_fn.with_name(report_fn.name + '.checkpoint')
+
+    def load_checkpoint(in_file_name: pl.Path) -> Optional[Checkpoint]:
+        """Reads the checkpoint for the input file.  Returns None when there is no checkpoint
+        or it belongs to another file (rotated or truncated log, other settings)"""
+        ckpt_fn = make_checkpoint_filename(in_file_name)
+        if not ckpt_fn.is_file():
+            log.debug(f'load_checkpoint::no checkpoint file {ckpt_fn}')
+            return None
+        try:
+            with open(ckpt_fn, 'rb') as f_in:
+                checkpoint = pickle.load(f_in)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            log.error(f'Cannot read checkpoint file <{ckpt_fn}>, processing the log from the beginning')
+            return None
+        file_stat = pl.Path(in_file_name).stat()
+        if (not isinstance(checkpoint, Checkpoint) or
+                checkpoint.file_id != (file_stat.st_dev, file_stat.st_ino) or
+                checkpoint.offset > file_stat.st_size or
+                checkpoint.quantiles != (config.quantiles, config.quantile_error) or
+                checkpoint.urls != (url_settings(), config.max_urls) or
+                checkpoint.parsing != parsing_settings()):
+            log.info(f'Checkpoint <{ckpt_fn}> is stale, processing the log from the beginning')
+            return None
+        return checkpoint
+
+    def make_checkpoint(in_file_name: pl.Path, offset: int, chunk_result: ChunkResult,
+                        file_id: Optional[tuple[int, int]] = None) -> Checkpoint:
+        "'file_id' is of the file read, the file is looked up if it isn't given"
+        if file_id is None:
+            file_stat = pl.Path(in_file_name).stat()
+            file_id = (file_stat.st_dev, file_stat.st_ino)
+        return Checkpoint(
+            file_name = str(in_file_name),
+            file_id   = file_id,
+            offset    = offset,
+            quantiles = (config.quantiles, config.quantile_error),
+            result    = chunk_result,
+            urls      = (url_settings(), config.max_urls),
+            parsing   = parsing_settings())
+
+    def save_checkpoint(checkpoint: Checkpoint) -> bool:
+        "Writes the checkpoint to a temporary file and renames it, so it is never half-written"
+        ckpt_fn = make_checkpoint_filename(checkpoint.file_name)
+        tmp_fn = ckpt_fn.with_name(ckpt_fn.name + '.tmp')
+        try:
+            with open(tmp_fn, 'wb') as f_out:
+                pickle.dump(checkpoint, f_out, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_fn, ckpt_fn)
+            log.debug(f'save_checkpoint::checkpoint at offset {checkpoint.offset} written to {ckpt_fn}')
+            return True
+        except OSError:
+            log.error(f'Cannot write checkpoint file <{ckpt_fn}>')
+            return False
+
+    @ft.cache
+    def url_settings() -> un.UrlSettings:
+        "URL normalization settings, the rewrite rules are read from the file once"
+        return un.UrlSettings(
+            strip_query  = config.strip_query,
+            collapse_ids = config.collapse_ids,
+            rules        = un.load_rules(config.url_rules) if config.url_rules else ())
+
+    @ft.cache
+    def line_parser() -> Union[str, lf.CompiledFormat]:
+        "The built-in parser or the LOG_FORMAT compiled once, workers get it instead of a function"
+        if not config.log_format:
+            return config.parser
+        return lf.load_compiled(lf.read_log_format(config.log_format), lf.default_cache_dir(), log)
+
+    def parsing_settings() -> tuple:
+        "Parser and time series settings, statistics collected with other ones can't be mixed"
+        return (line_parser(), config.series_interval)
+
+    def merge_results(left: ChunkResult, right: ChunkResult) -> ChunkResult:
+        return merge_chunk_results(left, right, config.max_urls)
+
+    def series_interval() -> int:
+        "Length of the time series buckets in seconds, 0 without series"
+        return config.series_interval * 60
+
+    def progress_interval() -> float:
+        "Progress messages are at INFO level, the readers don't report if they aren't logged"
+        return config.progress_interval if log.isEnabledFor(logging.INFO) else 0
+
+    def process_plain_range(in_file_name: pl.Path, start: int, end: int,
+                            spill: Optional[SpillSettings] = None) -> ChunkResult:
+        "Statistics of the lines of uncompressed file in byte range [start, end)"
+        workers = config.workers if config.workers > 0 else (os.cpu_count() or 1)
+        new_estimator = qs.estimator_factory(config.quantiles, config.quantile_error)
+        normalize_url = un.make_normalizer(url_settings())
+        if workers > 1:
+            log.debug(f'process_plain_range::processing {in_file_name} with {workers} workers')
+            chunks = split_file_to_chunks(in_file_name, workers, start, end)
+            # the chunks are of the same size, progress of the first one is progress of all
+            intervals = [progress_interval()] + [0] * (len(chunks) - 1)
+            # the workers share the budget
+            worker_spill = spill._replace(budget=spill.budget // len(chunks)) if spill is not None else None
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = pool.map(process_file_chunk,
+                                   it.repeat(in_file_name), *zip(*chunks),
+                                   it.repeat(line_parser()), it.repeat(new_estimator),
+                                   it.repeat(log), it.repeat(config.reader),
+                                   it.repeat(normalize_url), it.repeat(config.max_urls),
+                                   intervals, it.repeat(f'{pl.Path(in_file_name).name} (first of {len(chunks)} chunks)'),
+                                   it.repeat(worker_spill), it.repeat(series_interval()))
+                return ft.reduce(merge_results, results, empty_chunk_result(series_interval()))
         else:
-            # url_stats[url] = UrlInfo(1, duration, duration, [duration])
-            url_stats[url] = UrlInfo(
-                durations    = array('l',[duration]),
-                occurencies  = 1, 
-                max_latency  = duration, 
-                sum_latency  = duration )
-        gen_stats = GeneralStats(total_records = gen_stats.total_records +1, sum_latency= gen_stats.sum_latency + duration)
-        return url_stats, gen_stats
+            return process_file_chunk(in_file_name, start, end, line_parser(), new_estimator, log,
+                                      config.reader, normalize_url, config.max_urls, progress_interval(),
+                                      spill=spill, series_interval=series_interval())
 
-    def process_one_file(in_file_name: pl.Path) -> Optional[StatsResult]:
-        log.debug(f'process_one_file::called with params {in_file_name}')
-        # iterate over lines of (possibly compressed) file
-        bad_lines_counter = 0
-        good_lines_counter = 0
-        read_lines_counter = 0
-        general_stats = GeneralStats(0, 0)
-        url_stats = {}
+    def collect_file_stats(in_file_name: pl.Path, spill: Optional[SpillSettings] = None) -> Optional[ChunkResult]:
+        "Statistics of the file, with 'spill' settings they may be spilled to disk"
+        log.debug(f'collect_file_stats::called with params {in_file_name}')
         try:
-            with fileinput.input(files=in_file_name, encoding='utf-8',
-                    openhook=fileinput.hook_compressed) as fin:
-                for in_line in fin:
-                    read_lines_counter += 1
-                    linedata = nlp.parse_log_line(in_line, log)
-                    match linedata:
-                        case None:
-                            bad_lines_counter += 1
-                        case nlp.Request(_, url, duration):
-                            # small optimization: don't add zeroes
-                            if duration > 0:
-                                # ignore timestamp for now
-                                url_stats, general_stats = add_to_stats(url, duration,  url_stats, general_stats)
-                            good_lines_counter += 1
-            log.info(f'% of bad lines in file {in_file_name}: ' +
-                    "{:3.1f}".format(bad_lines_counter * 100 / (good_lines_counter + bad_lines_counter)))
-            return (url_stats, general_stats)
+            if lr.is_compressed(in_file_name):
+                if config.incremental:
+                    log.info(f'Compressed file {in_file_name} is processed as a whole, not incrementally')
+                # iterate over lines of compressed file, decompressed in large blocks
+                interval = progress_interval()
+                progress = (instr.Progress(log, pl.Path(in_file_name).name,
+                                           pl.Path(in_file_name).stat().st_size, interval)
+                            if interval > 0 else None)
+                chunk_result = decode_urls(aggregate_lines(
+                        it.chain.from_iterable(lr.compressed_lines(in_file_name, config.decompressor,
+                                                                   progress=progress)),
+                        bytes_parser(line_parser()), log,
+                        qs.estimator_factory(config.quantiles, config.quantile_error),
+                        un.make_normalizer(url_settings()), config.max_urls, spill, series_interval()))
+            elif config.incremental:
+                checkpoint = load_checkpoint(in_file_name)
+                if checkpoint is None:
+                    start, chunk_result = 0, empty_chunk_result(series_interval())
+                else:
+                    start, chunk_result = checkpoint.offset, checkpoint.result
+                    log.info(f'Resuming processing of {in_file_name} from offset {start}')
+                end = find_last_line_end(in_file_name)
+                chunk_result = merge_results(chunk_result, process_plain_range(in_file_name, start, end))
+                save_checkpoint(make_checkpoint(in_file_name, end, chunk_result))
+            else:
+                chunk_result = process_plain_range(in_file_name, 0, pl.Path(in_file_name).stat().st_size, spill)
+            if chunk_result.good_lines + chunk_result.bad_lines > 0:
+                log.info(f'% of bad lines in file {in_file_name}: ' +
+                        "{:3.1f}".format(chunk_result.bad_lines * 100 /
+                                         (chunk_result.good_lines + chunk_result.bad_lines)))
+            return chunk_result
         except PermissionError:
             log.critical('Permission denied reading input file')
             return None
         except OSError:
-            log.critical('Cannot read input file {in_file_name} (OSError)')
+            log.critical(f'Cannot read input file {in_file_name} (OSError)')
             return None
 
+    def process_one_file(in_file_name: pl.Path) -> Optional[StatsResult]:
+        chunk_result = collect_file_stats(in_file_name)
+        if chunk_result is None:
+            return None
+        return (chunk_result.url_stats, chunk_result.general_stats)
+
     def read_report_template() -> Optional[str]:
         """Tries to read report template from file in configuration object,
         returns contents of the file or None when read failed"""
@@ -334,33 +1203,261 @@ def setup_functions(config, log):
             log.critical(f'Error reading report template from file <{config.template_html}>')
             return None
 
-    def make_report(json_data: str) -> Optional[str]:
-        "Mates json data and template to make formatted report"
-        report_template = read_report_template()
-        if report_template is not None:
-            return report_template.replace(r'$table_json', json_data, 1)
-        else:
+    @ft.cache
+    def report_template() -> Optional[TemplateParts]:
+        "The template is read and split at the placeholder once for all the reports"
+        template = read_report_template()
+        return split_template(template) if template is not None else None
+
+    def write_report_chunks(json_chunks: Iterable[str], output_fn: pl.Path,
+                            series_json: str = 'null') -> StatusWithData:
+        """Writes the template with JSON table coming in pieces to a temporary file and renames
+        it, so the whole report is never in memory and is never seen half-written.
+        The table of time series (if the template has a place for it) is much smaller,
+        it comes as a string"""
+        parts = report_template()
+        if parts is None:
             log.critical(f'Error reading HTML template file <{config.template_html}>')
+            return Err('Null HTML output')
+        parts = parts._replace(prefix = parts.prefix.replace(SERIES_PLACEHOLDER, series_json),
+                               suffix = parts.suffix.replace(SERIES_PLACEHOLDER, series_json))
+        tmp_fn = output_fn.with_name(output_fn.name + '.tmp')
+        try:
+            with open(tmp_fn, 'w', encoding='utf8') as out_f:
+                bytes_written = out_f.write(parts.prefix)
+                if parts.has_table:
+                    for chunk in json_chunks:
+                        bytes_written += out_f.write(chunk)
+                    bytes_written += out_f.write(parts.suffix)
+            os.replace(tmp_fn, output_fn)
+            return Ok(data = bytes_written)
+        except OSError:
+            log.critical(f"Error writing to output file <{output_fn}>, disk full?")
+            tmp_fn.unlink(missing_ok=True)
+            return Err(msg = "Error writing to output file")
+
+    def report_stats(stats: StatsResult) -> list[OutputUrlStats]:
+        return process_stats(stats, config.report_size, config.report_threshold, config.report_sort,
+                             vs.resolve_backend(config.stats_backend))
+
+    def write_stats_report(stats: StatsResult, output_fn: pl.Path, instruments: instr.Instruments,
+                           series: Optional[tms.TimeSeries] = None) -> StatusWithData:
+        "Selects the report URLs and writes the report with their time series, both stages are timed"
+        with instruments.stage('stats'):
+            output = report_stats(stats)
+        with instruments.stage('render') as stage:
+            status = write_report_chunks(json_rows(output, resolve_json_backend(config.json_backend),
+                                                   config.report_precision), output_fn,
+                                         series_to_json(series, (out_rec.url for out_rec in output)))
+            if isinstance(status, Ok):
+                stage.bytes = status.data
+        return status
+
+    def report_metrics(instruments: instr.Instruments, output_fn: pl.Path):
+        "Stage timings go to the journal, and to a JSON file next to the report if configured"
+        log.info(f'Processing stages of {output_fn.name}:')
+        for line in instruments.summary():
+            log.info(line)
+        if config.metrics:
+            metrics_fn = output_fn.with_name(output_fn.name + METRICS_SUFFIX)
+            try:
+                with open(metrics_fn, 'w', encoding='utf8') as f_out:
+                    json.dump(instruments.as_dict(), f_out, indent=2)
+            except OSError:
+                log.error(f'Cannot write metrics file <{metrics_fn}>')
+
+    def run_profiled(func: Callable[[], StatusWithData], output_fn: pl.Path) -> StatusWithData:
+        "Runs the function under cProfile if configured, the statistics are written next to the report"
+        if not config.profile:
+            return func()
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func)
+        finally:
+            prof_fn = output_fn.with_name(output_fn.name + PROFILE_SUFFIX)
+            try:
+                profiler.dump_stats(prof_fn)
+                log.info(f'Profile statistics written to {prof_fn}')
+            except OSError:
+                log.error(f'Cannot write profile statistics file <{prof_fn}>')
+
+    def make_aggregate_filename(report_fn: pl.Path) -> pl.Path:
+        "Daily aggregates are kept next to the report"
+        return report_fn.with_name(report_fn.name + AGGREGATE_SUFFIX)
+
+    def save_aggregate(input_fn: pl.Path, chunk_result: ChunkResult) -> bool:
+        "Writes daily aggregates to a temporary file and renames it, so it is never half-written"
+        aggr_fn = make_aggregate_filename(make_report_filename(input_fn))
+        tmp_fn = aggr_fn.with_name(aggr_fn.name + '.tmp')
+        aggregate = DailyAggregate(
+            date      = parse_input_date(input_fn) or dt.date.today(),
+            quantiles = (config.quantiles, config.quantile_error),
+            urls      = (url_settings(), config.max_urls),
+            result    = chunk_result._replace(
+                            url_stats = sketch_url_stats(chunk_result.url_stats, config.quantile_error)),
+            parsing   = parsing_settings())
+        try:
+            with gzip.open(tmp_fn, 'wb', compresslevel=AGGREGATE_COMPRESSION) as f_out:
+                pickle.dump(aggregate, f_out, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_fn, aggr_fn)
+            log.debug(f'save_aggregate::aggregates of {input_fn} written to {aggr_fn}')
+            return True
+        except OSError:
+            log.error(f'Cannot write aggregates file <{aggr_fn}>')
+            return False
+
+    def load_aggregate(aggr_fn: pl.Path) -> Optional[DailyAggregate]:
+        "Reads daily aggregates, None if the file is unreadable or made with other settings"
+        try:
+            with gzip.open(aggr_fn, 'rb') as f_in:
+                aggregate = pickle.load(f_in)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+            log.error(f'Cannot read aggregates file <{aggr_fn}>, skipping it')
+            return None
+        if (not isinstance(aggregate, DailyAggregate) or
+                aggregate.quantiles != (config.quantiles, config.quantile_error) or
+                aggregate.urls != (url_settings(), config.max_urls) or
+                aggregate.parsing != parsing_settings()):
+            log.warning(f'Aggregates file <{aggr_fn}> is made with other settings, skipping it')
             return None
+        return aggregate
 
-    def write_json_to_output_file(json_data: str, input_fn: pl.Path) -> StatusWithData:
-        if input_fn is None:
-            # I know, at this point input_fn will definitely not be None, but...
-            log.critical("No input file given, cannot construct output file")
-            return Err(msg = "No input file name given, cannot create output")
-        else:
-            output_fn = make_report_filename(input_fn)
-            report_html = make_report(json_data)
-            if report_html is None:
-                return Err('Null HTML output')
+    def list_aggregates() -> list[tuple[dt.date, pl.Path]]:
+        "Daily aggregate files in the report directory with their dates, sorted by date"
+        glob_pattern = cfp.template_to_glob(config.report_glob) + AGGREGATE_SUFFIX
+        # strptime doesn't know %F, strftime does
+        date_format = config.report_glob.replace('%F', '%Y-%m-%d')
+        result = []
+        for aggr_fn in pl.Path(config.report_dir).glob(glob_pattern):
+            try:
+                report_name = aggr_fn.name[:-len(AGGREGATE_SUFFIX)]
+                result.append((dt.datetime.strptime(report_name, date_format).date(), aggr_fn))
+            except ValueError:
+                log.debug(f'list_aggregates::no date in file name {aggr_fn}')
+        return sorted(result)
+
+    def make_period_report_filename(first_day: dt.date, period: str) -> pl.Path:
+        "Report for the period is named as the report of its first day with the period suffix"
+        day_report = pl.Path(first_day.strftime(config.report_glob))
+        return pl.Path(config.report_dir) / pl.Path(f'{day_report.stem}-{period}{day_report.suffix}')
+
+    def merge_period_reports() -> StatusWithData:
+        """Makes the report for the week or month (config.merge) of the latest daily aggregates
+        by merging the aggregates of its days, the logs aren't read"""
+        log.debug(f'merge_period_reports called for period {config.merge}')
+        aggregates = list_aggregates()
+        if not aggregates:
+            return Err(msg = f'No daily aggregates found in {config.report_dir}')
+        first_day, last_day = period_bounds(aggregates[-1][0], config.merge)
+        output_fn = make_period_report_filename(first_day, config.merge)
+
+        def merge_and_report() -> StatusWithData:
+            instruments = instr.Instruments()
+            with instruments.stage('merge'):
+                merged, days = empty_chunk_result(series_interval()), []
+                for day, aggr_fn in aggregates:
+                    if first_day <= day <= last_day:
+                        aggregate = load_aggregate(aggr_fn)
+                        if aggregate is not None:
+                            merged = merge_results(merged, aggregate.result)
+                            days.append(day)
+            if not days:
+                return Err(msg = f'No usable daily aggregates for {config.merge} from {first_day}')
+            log.info(f'Merging {len(days)} days of {config.merge} from {first_day} to {last_day}')
+            instruments.counters['distinct_urls'] = len(merged.url_stats)
+            status = write_stats_report((merged.url_stats, merged.general_stats), output_fn, instruments,
+                                        merged.series)
+            report_metrics(instruments, output_fn)
+            return status
+
+        return run_profiled(merge_and_report, output_fn)
+
+    def make_report_for_file(input_fn: pl.Path) -> StatusWithData:
+        "Processes the input file and writes its report, returns number of bytes written"
+        output_fn = make_report_filename(input_fn)
+
+        def collect_and_report(spill: Optional[SpillSettings]) -> StatusWithData:
+            instruments = instr.Instruments()
+            # reading, parsing and aggregation are fused into one pass over the file
+            with instruments.stage('collect') as stage:
+                chunk_result = collect_file_stats(input_fn, spill)
+                if chunk_result is not None:
+                    stage.lines = chunk_result.good_lines + chunk_result.bad_lines
+                    stage.bytes = pl.Path(input_fn).stat().st_size
+            if chunk_result is None:
+                return Err(msg = f'Cannot collect statistics from file {input_fn}')
+            spilled = isinstance(chunk_result.url_stats, SpilledUrlStats)
+            if spilled:
+                instruments.counters['spilled_runs'] = len(chunk_result.url_stats.runs)
+                log.info(f'URL statistics of {input_fn} exceeded the memory budget, '
+                         f'merging {len(chunk_result.url_stats.runs)} runs from disk')
             else:
-                try:
-                    with open(output_fn, 'w', encoding='utf8') as out_f:
-                        bytes_written = out_f.write(report_html)
-                        return Ok(data = bytes_written)
-                except OSError:
-                    log.critical(f"Error writing to output file <{output_fn}>, disk full?")
-                    return Err(msg = "Error writing to output file")
+                instruments.counters['distinct_urls'] = len(chunk_result.url_stats)
+            status = write_stats_report((chunk_result.url_stats, chunk_result.general_stats),
+                                        output_fn, instruments, chunk_result.series)
+            if config.save_aggregates and isinstance(status, Ok):
+                if spilled:
+                    log.warning(f'Daily aggregates of {input_fn} are not saved, the statistics were spilled to disk')
+                else:
+                    with instruments.stage('save aggregates'):
+                        save_aggregate(input_fn, chunk_result)
+            report_metrics(instruments, output_fn)
+            return status
+
+        def collect_with_budget() -> StatusWithData:
+            if not config.memory_budget:
+                return collect_and_report(None)
+            # the runs live until the report is written
+            spill_dir = tempfile.mkdtemp(prefix='log_analyzer-', dir=config.spill_dir or None)
+            try:
+                return collect_and_report(SpillSettings(config.memory_budget * MEGABYTE, spill_dir))
+            finally:
+                shutil.rmtree(spill_dir, ignore_errors=True)
+
+        return run_profiled(collect_with_budget, output_fn)
+
+    def backfill_files():
+        """Makes reports for all the input files without them, some files are processed
+        concurrently.  Prints a summary with processing time of every file"""
+        log.debug('backfill_files called')
+        input_files = [fn for fn in select_all_input_files()
+                       if not isinstance(search_for_report(fn), pl.Path)]
+        if not input_files:
+            log.info(f'No input files without reports found in {config.log_dir}, nothing to do')
+            return
+        try:
+            pl.Path(config.report_dir).mkdir(parents=True, exist_ok=True)
+        except PermissionError:
+            log.error(f'Permission denied creating report directory: {config.report_dir}')
+            return
+        jobs = config.backfill_jobs if config.backfill_jobs > 0 else (os.cpu_count() or 1)
+        jobs = min(jobs, len(input_files))
+        log.info(f'Backfill: {len(input_files)} files to process, {jobs} at a time')
+        started = time.perf_counter()
+        if jobs > 1:
+            # every file is processed by one process, no nested pools
+            job_config = config._replace(workers=1)
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = {pool.submit(backfill_one_file, job_config, fn, log): fn for fn in input_files}
+                results = []
+                for future in as_completed(futures):
+                    try:
+                        results.append(future.result())
+                    except Exception as exc:
+                        log.exception(f'Error processing file {futures[future]}')
+                        results.append(BackfillResult(futures[future], Err(msg=repr(exc)), 0.0))
+        else:
+            results = [backfill_one_file(config, fn, log) for fn in input_files]
+        log.info('Backfill summary:')
+        for result in sorted(results, key=lambda r: r.file_name):
+            match result.status:
+                case Ok(data=bytes_written):
+                    log.info(f'  {result.file_name}: {result.seconds:.1f} s, {bytes_written} bytes written')
+                case Err(msg=message):
+                    log.error(f'  {result.file_name}: {result.seconds:.1f} s, FAILED: {message}')
+        failed_count = sum(1 for r in results if isinstance(r.status, Err))
+        log.info(f'Backfill finished in {time.perf_counter() - started:.1f} s, ' +
+                 f'{len(results) - failed_count} reports written, {failed_count} failed')
 
     def process_files():
         log.debug(f'process_files called')
@@ -370,6 +1467,9 @@ def setup_functions(config, log):
             log.info(f'No input files matching {config.log_glob} found in {config.log_dir}, nothing to do')
             return
         report_search_result = search_for_report(input_fn)
+        if config.incremental and isinstance(report_search_result, pl.Path):
+            log.info(f'Incremental mode: report {report_search_result} will be updated')
+            report_search_result = ReportFileState.NOFILE
         match report_search_result:
             case ReportFileState.NODIR:
                 try:
@@ -380,25 +1480,147 @@ def setup_functions(config, log):
             case pl.Path:
                 log.info(f"Existing report file {report_search_result} found, no work to do")
             case ReportFileState.NOFILE:
-                stats = process_one_file(input_fn)
-                if stats is not None:
-                    match write_json_to_output_file(
-                                output_to_json(process_stats(stats, config.report_size)),
-                                input_fn):
-                        case Ok(data=bytes_written):
-                            log.info(f'Finished, {bytes_written} bytes written to output file')
-                        case Err(msg=message):
-                            log.critical(message)
-                else:
-                    log.info('process_files: bad return from process_one_file')
+                match make_report_for_file(input_fn):
+                    case Ok(data=bytes_written):
+                        log.info(f'Finished, {bytes_written} bytes written to output file')
+                    case Err(msg=message):
+                        log.critical(message)
         return
 
+    def start_tailing(input_fn: pl.Path) -> TailState:
+        """State of a log the daemon starts to follow: from the checkpoint in incremental mode,
+        from the beginning otherwise.  A compressed log isn't followed, its report is made once"""
+        file_stat = pl.Path(input_fn).stat()
+        file_id = (file_stat.st_dev, file_stat.st_ino)
+        if lr.is_compressed(input_fn):
+            if not isinstance(search_for_report(input_fn), pl.Path):
+                match make_report_for_file(input_fn):
+                    case Err(msg=message):
+                        log.error(message)
+            return TailState(input_fn, file_id, file_stat.st_size, None)
+        checkpoint = load_checkpoint(input_fn) if config.incremental else None
+        if checkpoint is not None:
+            log.info(f'Resuming processing of {input_fn} from offset {checkpoint.offset}')
+            return TailState(input_fn, file_id, checkpoint.offset, checkpoint.result, dirty=True)
+        return TailState(input_fn, file_id, 0, empty_chunk_result(series_interval()))
+
+    def read_appended_lines(state: TailState):
+        "Adds the lines appended to the log since the previous poll to the statistics in memory"
+        file_stat = pl.Path(state.file_name).stat()
+        if (file_stat.st_dev, file_stat.st_ino) != state.file_id or file_stat.st_size < state.offset:
+            log.info(f'Log {state.file_name} was truncated or replaced, reading it from the beginning')
+            state.file_id = (file_stat.st_dev, file_stat.st_ino)
+            state.offset, state.result = 0, empty_chunk_result(series_interval())
+        end = find_last_line_end(state.file_name)
+        if end > state.offset:
+            state.result = merge_results(state.result, process_plain_range(state.file_name, state.offset, end))
+            state.offset, state.dirty = end, True
+
+    def render_tailed(state: TailState) -> StatusWithData:
+        "Writes the report of the followed log from the statistics in memory"
+        output_fn = make_report_filename(state.file_name)
+        instruments = instr.Instruments()
+        instruments.counters['distinct_urls'] = len(state.result.url_stats)
+        status = write_stats_report((state.result.url_stats, state.result.general_stats),
+                                    output_fn, instruments, state.result.series)
+        state.dirty, state.rendered = False, time.monotonic()
+        match status:
+            case Ok(data=bytes_written):
+                log.info(f'Report {output_fn} updated, {bytes_written} bytes written')
+                if config.save_aggregates:
+                    save_aggregate(state.file_name, state.result)
+                if config.incremental:
+                    # the followed log may be renamed or removed by the rotation already
+                    save_checkpoint(make_checkpoint(state.file_name, state.offset, state.result, state.file_id))
+            case Err(msg=message):
+                log.error(message)
+        # a report is written every DAEMON_INTERVAL, the stage timings only when asked for
+        if config.metrics:
+            report_metrics(instruments, output_fn)
+        return status
+
+    def finish_tailing(state: TailState):
+        """The final report of a log after rotation.  If the log was renamed or removed, the
+        report is made of the lines read before"""
+        if state.result is None:
+            return
+        try:
+            read_appended_lines(state)
+        except OSError as exc:
+            log.warning(f'Cannot read the rest of {state.file_name}: {exc}, reporting the lines read before')
+        if state.dirty:
+            render_tailed(state)
+
+    def tail_once(state: Optional[TailState]) -> Optional[TailState]:
+        """One poll of the daemon: switches to a new log after rotation (the old one gets its
+        final report), reads the appended lines and renders the report every DAEMON_INTERVAL"""
+        try:
+            input_fn = select_input_file()
+            if input_fn is None:
+                return state
+            if state is not None and input_fn != state.file_name:
+                log.info(f'Log rotated: {state.file_name} -> {input_fn}')
+                # the new log is followed whatever happens to the old one
+                rotated, state = state, None
+                finish_tailing(rotated)
+            if state is None:
+                state = start_tailing(input_fn)
+            if state.result is not None:
+                read_appended_lines(state)
+                if state.dirty and time.monotonic() - state.rendered >= config.daemon_interval:
+                    render_tailed(state)
+        except OSError as exc:
+            log.error(f'Cannot read logs: {exc}')
+        return state
+
+    async def watch_logs(stop: asyncio.Event, poll_interval: float = DAEMON_POLL_SECONDS):
+        """Daemon mode: follows the newest log of LOG_DIR until 'stop' is set, keeping its
+        statistics in memory.  The polls run in a thread, the loop only waits for them and
+        for the stop; the pending lines are reported before the return"""
+        log.info(f'Daemon: watching {config.log_dir}, the report is updated every {config.daemon_interval} s')
+        loop = asyncio.get_running_loop()
+        state = None
+        while not stop.is_set():
+            state = await loop.run_in_executor(None, tail_once, state)
+            try:
+                await asyncio.wait_for(stop.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+        if state is not None and state.dirty:
+            await loop.run_in_executor(None, render_tailed, state)
+        log.info('Daemon stopped')
+
+    def run_daemon():
+        "Runs watch_logs until SIGINT or SIGTERM"
+        try:
+            pl.Path(config.report_dir).mkdir(parents=True, exist_ok=True)
+        except PermissionError:
+            log.error(f'Permission denied creating report directory: {config.report_dir}')
+            return
+
+        async def run():
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signum, stop.set)
+            await watch_logs(stop)
+
+        asyncio.run(run())
+
     return {
             'check_config': check_config,
             'select_input_file': select_input_file,
             'parse_input_date': parse_input_date,
             'make_report_filename': make_report_filename,
+            'select_all_input_files': select_all_input_files,
+            'process_one_file': process_one_file,
+            'make_report_for_file': make_report_for_file,
             'process_files': process_files,
+            'backfill_files': backfill_files,
+            'merge_period_reports': merge_period_reports,
+            'tail_once': tail_once,
+            'watch_logs': watch_logs,
+            'run_daemon': run_daemon,
         }
 
 def parametrize_loggers(fmt, datefmt) -> tuple[logging.Logger,
@@ -462,7 +1684,18 @@ def main() :
             add_logfile(config.journal)
         funs = setup_functions(config, log)
         if funs['check_config']():
-            funs['process_files']()
+            if config.merge:
+                match funs['merge_period_reports']():
+                    case Ok(data=bytes_written):
+                        log.info(f'Finished, {bytes_written} bytes written to output file')
+                    case Err(msg=message):
+                        log.critical(message)
+            elif config.backfill:
+                funs['backfill_files']()
+            elif config.daemon:
+                funs['run_daemon']()
+            else:
+                funs['process_files']()
         else:
             log.critical('Invalid configuration')
             sys.exit(RetCodes.InvalidConfig)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Parsers of logs in other formats: an nginx 'log_format' definition is compiled into a regular
+expression for undecoded lines which captures only the fields the analyzer needs (timestamp,
+method, URL, status and request time), the other variables are skipped without a group.
+
+A literal text of the format must be in the line as is (whitespace matches any whitespace),
+a skipped variable takes the characters up to the literal text which follows it.  The
+translation is cached on disk, a file per format named by the hash of the format string, so
+a worker or the next run only compiles the expression.
+"""
+import hashlib
+import json
+import logging
+import operator
+import os
+import re
+import pathlib as pl
+import functools as ft
+from math import floor
+from typing import Callable, NamedTuple, Optional
+
+import nginx_log_parser as nlp
+
+# the format the built-in parsers of nginx_log_parser expect
+UI_SHORT = ('$remote_addr  $remote_user $http_x_real_ip [$time_local] "$request" '
+            '$status $body_bytes_sent "$http_referer" '
+            '"$http_user_agent" "$http_x_forwarded_for" "$http_X_REQUEST_ID" "$http_X_RB_USER" '
+            '$request_time')
+# cached translations of other versions are compiled anew
+CACHE_VERSION = 1
+
+_VARIABLE = re.compile(r'\$(?:\{(\w+)\}|(\w+))')
+_DIRECTIVE = re.compile(r'^\s*log_format\s+\S+\s+(?:escape=\S+\s+)?', re.M)
+# an argument of the directive (quoted with escapes or bare) or the ';' ending it, after
+# whitespace and comments
+_ARGUMENT = re.compile(r"""(?:\s|#[^\n]*)*(?:'((?:[^'\\]|\\.)*)'|"((?:[^"\\]|\\.)*)"|([^\s'";]+)|(;))""", re.S)
+_ESCAPED = re.compile(r"""\\(["'\\])""")
+
+_METHOD = '|'.join(nlp.METHODS)
+_URL = r'[^\s"]+'
+# groups of the variables with the fields of Request, the first variable with a field captures it
+VARIABLE_FIELDS = {
+    'time_local':     (('ts', r'\d{1,2}/[A-Z][a-z]{2}/\d{4}:\d\d:\d\d:\d\d [+-]\d{4}'),),
+    'request':        (('method', _METHOD), (None, r'\s+'), ('url', _URL), (None, r'(?:\s+HTTP/[0-9.]+)?')),
+    'request_method': (('method', _METHOD),),
+    'request_uri':    (('url', _URL),),
+    'uri':            (('url', _URL),),
+    'status':         (('status', '[0-9]{3}'),),
+    'request_time':   (('duration', r'\d+\.\d*|\.\d+|\d+'),),
+}
+REQUIRED_FIELDS = ('url', 'duration')
+# a format without them gives METHOD_UNKNOWN and status 0, as Request defaults
+OPTIONAL_FIELDS = ('ts', 'method', 'status')
+
+class CompiledFormat(NamedTuple):
+    "The format and its expression, hashable and small: workers get it instead of a parser"
+    log_format: str
+    pattern:    str
+
+def read_log_format(file_name) -> str:
+    """Reads the format from a file: an nginx 'log_format' directive (its arguments are
+    joined, a ';' in quotes is a part of the format) or the format string itself.
+    Raises OSError if the file can't be read and ValueError if the directive has no end"""
+    text = pl.Path(file_name).read_text(encoding='utf-8')
+    directive = _DIRECTIVE.search(text)
+    if directive is None:
+        return text.strip('\r\n')
+    parts, pos = [], directive.end()
+    while (argument := _ARGUMENT.match(text, pos)) is not None:
+        single, double, bare, end = argument.groups()
+        if end:
+            return ''.join(parts)
+        parts.append(_ESCAPED.sub(r'\1', single if single is not None else double if double is not None else bare))
+        pos = argument.end()
+    raise ValueError(f'{file_name}: log_format directive without the ending ";"')
+
+def _skip_pattern(following: str) -> str:
+    "Expression of a skipped variable: everything up to the literal text after it"
+    if not following:
+        return '.*?'
+    if following[0].isspace():
+        return r'\S*'
+    return '[^' + re.escape(following[0]) + ']*'
+
+def compile_format(log_format: str) -> CompiledFormat:
+    """Translates the format to an expression with a named group for every field of Request.
+    Raises ValueError if the format has no variable for some of REQUIRED_FIELDS"""
+    literals = _VARIABLE.split(log_format)
+    # split() gives literal, braced name, bare name, literal...
+    parts, captured = [], set()
+    for idx in range(0, len(literals) - 1, 3):
+        literal, name = literals[idx], literals[idx + 1] or literals[idx + 2]
+        parts.append(r'\s+'.join(map(re.escape, re.split(r'\s+', literal))))
+        following = literals[idx + 3]
+        for field, expr in VARIABLE_FIELDS.get(name, ((None, _skip_pattern(following)),)):
+            if field is None:
+                parts.append(expr)
+            elif field in captured:
+                parts.append(f'(?:{expr})')
+            else:
+                captured.add(field)
+                parts.append(f'(?P<{field}>{expr})')
+    parts.append(r'\s+'.join(map(re.escape, re.split(r'\s+', literals[-1]))))
+    missing = [field for field in REQUIRED_FIELDS if field not in captured]
+    if missing:
+        raise ValueError(f'log_format has no variables for {", ".join(missing)}: {log_format}')
+    # timestamps are needed by time series only, an empty one is an invalid date;
+    # empty method and status are unknown ones
+    empty_groups = ''.join(f'(?P<{field}>)' for field in OPTIONAL_FIELDS if field not in captured)
+    return CompiledFormat(log_format, '^' + empty_groups + ''.join(parts) + r'\s*$')
+
+def cache_file_name(log_format: str, cache_dir) -> pl.Path:
+    return pl.Path(cache_dir, hashlib.sha256(log_format.encode('utf-8')).hexdigest()[:32] + '.json')
+
+def load_compiled(log_format: str, cache_dir, log: logging.Logger) -> CompiledFormat:
+    """The translation of the format from the cache, compiled and written there if it isn't.
+    The cache is an optimization: a file which can't be read or written is logged and ignored"""
+    cache_fn = cache_file_name(log_format, cache_dir)
+    try:
+        with open(cache_fn, 'r', encoding='utf-8') as f_in:
+            cached = json.load(f_in)
+        if cached.get('version') == CACHE_VERSION and cached.get('log_format') == log_format:
+            log.debug(f'load_compiled::log_format expression read from {cache_fn}')
+            return CompiledFormat(log_format, cached['pattern'])
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, AttributeError) as exc:
+        log.info(f'Cannot read cached log_format expression <{cache_fn}>: {exc}')
+    compiled = compile_format(log_format)
+    tmp_fn = cache_fn.with_name(f'{cache_fn.name}.{os.getpid()}.tmp')
+    try:
+        cache_fn.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_fn, 'w', encoding='utf-8') as f_out:
+            json.dump({'version': CACHE_VERSION, 'log_format': log_format, 'pattern': compiled.pattern}, f_out)
+        os.replace(tmp_fn, cache_fn)
+    except OSError as exc:
+        log.info(f'Cannot write cached log_format expression <{cache_fn}>: {exc}')
+    return compiled
+
+def default_cache_dir() -> pl.Path:
+    return pl.Path(os.environ.get('XDG_CACHE_HOME') or pl.Path.home() / '.cache', 'log_analyzer', 'formats')
+
+_new_tuple = tuple.__new__
+
+@ft.lru_cache(maxsize=16)
+def make_parser(compiled: CompiledFormat) -> Callable[[bytes, logging.Logger], Optional[nlp.Request]]:
+    """Parser of undecoded lines in the format, the same as nginx_log_parser.BYTES_PARSERS.
+    A line that doesn't match is logged at DEBUG level and skipped, there is no full grammar
+    to fall back to.  Built once per process for a format"""
+    expression = re.compile(compiled.pattern.encode('utf-8'))
+    match = expression.match
+    # the groups in the order of Request fields, whatever their order in the line is
+    pick = operator.itemgetter(*(expression.groupindex[field] - 1
+                                 for field in ('ts', 'method', 'url', 'status', 'duration')))
+    method_codes = {**nlp.METHOD_CODES_BYTES, b'': nlp.METHOD_UNKNOWN}
+    status_codes = {**nlp.STATUS_CODES_BYTES, b'': 0}
+
+    def parse_log_line_compiled(log_line: bytes, log: logging.Logger) -> Optional[nlp.Request]:
+        m = match(log_line)
+        if m is None:
+            log.debug('Error parsing the line ' + str(log_line, 'utf-8', errors='replace'))
+            return None
+        ts, method, url, status, duration = pick(m.groups())
+        return _new_tuple(nlp.Request, (ts, url, floor(float(duration) * 1000),
+                                        method_codes[method], status_codes[status]))
+
+    return parse_log_line_compiled
+
+
+if __name__ == "__main__":
+    print("This is a library, not a program")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Readers of log files.  A compressed file is decompressed in large blocks (by an external
+program like 'pigz' through a pipe, or by Python's gzip/bz2 modules in a background thread)
+and the lines are handed out in batches, one batch per block.  An uncompressed file can be
+memory-mapped, its lines are handed out as views of the map without copying.
+The lines aren't decoded.
+
+Readers take an optional progress callback, it is called once per block of lines (never per
+line) with the number of lines since the previous call and the position in the file.  For
+compressed files it is the position in the compressed file: the file is opened here and
+shared with the decompressor, so its descriptor shows how far the decompressor has read.
+"""
+import bz2
+import gzip
+import mmap
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import sys
+import pathlib as pl
+from typing import Iterator, Optional, Callable, BinaryIO
+
+BLOCK_SIZE = 1 << 20
+# decompressed blocks waiting for the consumer: enough to keep both threads busy, little memory
+QUEUE_SIZE = 8
+
+# external decompressors by file extension, the first one found in PATH is used
+EXTERNAL_TOOLS = {
+    '.gz':  [['pigz', '-dc'], ['gzip', '-dc'], ['zcat']],
+    '.bz2': [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']],
+}
+# in 'auto' mode only multithreaded tools are used, single-threaded ones are not faster than
+# Python's decompression in a thread
+PARALLEL_TOOLS = ('pigz', 'lbzip2', 'pbzip2')
+PYTHON_OPENERS: dict[str, Callable[[str], BinaryIO]] = {
+    '.gz':  lambda fn: gzip.open(fn, 'rb'),
+    '.bz2': lambda fn: bz2.open(fn, 'rb'),
+}
+DECOMPRESSORS = ('auto', 'python', 'external')
+# readers of uncompressed files: 'auto' maps the files, 'blocks' reads them in large blocks
+READERS = ('auto', 'mmap', 'blocks')
+# progress callback: lines since the previous call, position in the file
+ProgressCallback = Callable[[int, int], None]
+
+def is_compressed(file_name) -> bool:
+    return pl.Path(file_name).suffix in PYTHON_OPENERS
+
+def find_external_tool(file_name, parallel_only: bool = False) -> Optional[list[str]]:
+    "Command line of external decompressor for the file or None if there is no one"
+    for cmd in EXTERNAL_TOOLS.get(pl.Path(file_name).suffix, []):
+        if parallel_only and cmd[0] not in PARALLEL_TOOLS:
+            continue
+        if shutil.which(cmd[0]) is not None:
+            return cmd
+    return None
+
+def external_blocks(file_name, cmd: list[str], block_size: int = BLOCK_SIZE,
+                    raw: Optional[BinaryIO] = None) -> Iterator[bytes]:
+    """Decompressed blocks from the pipe of external program.  The program reads the file
+    by name or the already opened 'raw' file from its standard input"""
+    args = cmd if raw is not None else cmd + [str(file_name)]
+    with subprocess.Popen(args, stdin=raw, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, bufsize=block_size) as proc:
+        while block := proc.stdout.read(block_size):
+            yield block
+        err_output = proc.stderr.read()
+        if proc.wait() != 0:
+            raise OSError(f'{cmd[0]} failed on {file_name}: {err_output.decode(errors="replace").strip()}')
+
+def threaded_blocks(file_name, block_size: int = BLOCK_SIZE,
+                    raw: Optional[BinaryIO] = None) -> Iterator[bytes]:
+    """Decompressed blocks, the file (or the already opened 'raw' file) is decompressed by
+    Python in a background thread.  zlib and bz2 release GIL, so decompression runs
+    in parallel with parsing"""
+    blocks = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+
+    def producer():
+        try:
+            with PYTHON_OPENERS[pl.Path(file_name).suffix](raw or file_name) as f_in:
+                while not stop.is_set():
+                    block = f_in.read(block_size)
+                    blocks.put(block)
+                    if not block:
+                        return
+        except Exception as exc:
+            blocks.put(exc)
+
+    thread = threading.Thread(target=producer, name=f'decompress {file_name}', daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                return
+            yield block
+    finally:
+        # the consumer can stop early: let the producer finish
+        stop.set()
+        while thread.is_alive():
+            try:
+                blocks.get_nowait()
+            except queue.Empty:
+                thread.join(0.01)
+
+def decompressed_blocks(file_name, decompressor: str = 'auto', block_size: int = BLOCK_SIZE,
+                        raw: Optional[BinaryIO] = None) -> Iterator[bytes]:
+    "Decompressed blocks of the file, 'decompressor' is one of DECOMPRESSORS"
+    cmd = find_external_tool(file_name, decompressor == 'auto') if decompressor != 'python' else None
+    if cmd is None:
+        if decompressor == 'external':
+            raise OSError(f'No external decompressor found for {file_name}')
+        return threaded_blocks(file_name, block_size, raw)
+    return external_blocks(file_name, cmd, block_size, raw)
+
+def line_batches(blocks: Iterator[bytes]) -> Iterator[list[bytes]]:
+    """Splits the blocks to lines.  Line separators are removed, the last line may have
+    no separator"""
+    rest = b''
+    for block in blocks:
+        complete, separator, tail = block.rpartition(b'\n')
+        if separator:
+            yield (rest + complete).split(b'\n')
+            rest = tail
+        else:
+            rest += block
+    if rest:
+        yield [rest]
+
+def compressed_lines(file_name, decompressor: str = 'auto', block_size: int = BLOCK_SIZE,
+                     progress: Optional[ProgressCallback] = None) -> Iterator[list[bytes]]:
+    "Batches of lines of compressed log file"
+    if progress is None:
+        return line_batches(decompressed_blocks(file_name, decompressor, block_size))
+    return _reported_compressed_lines(file_name, decompressor, block_size, progress)
+
+def _reported_compressed_lines(file_name, decompressor: str, block_size: int,
+                               progress: ProgressCallback) -> Iterator[list[bytes]]:
+    with open(file_name, 'rb') as raw:
+        fd = raw.fileno()
+        for batch in line_batches(decompressed_blocks(file_name, decompressor, block_size, raw)):
+            # the decompressor shares the file offset, it is ahead by its buffers only
+            progress(len(batch), os.lseek(fd, 0, os.SEEK_CUR))
+            yield batch
+
+def reported_batches(batches: Iterator[list[bytes]], start: int,
+                     progress: ProgressCallback) -> Iterator[list[bytes]]:
+    "Batches of lines of uncompressed file from offset 'start', the position is counted by lines"
+    position = start
+    for batch in batches:
+        position += sum(map(len, batch)) + len(batch)
+        progress(len(batch), position)
+        yield batch
+
+def mmap_lines(file_name, start: int = 0, end: Optional[int] = None,
+               progress: Optional[ProgressCallback] = None) -> Iterator[memoryview]:
+    """Zero-copy views of the lines (without separators) of uncompressed file in the byte
+    range [start, end), both ends of the range must be line boundaries.  Only the range
+    is mapped, so parallel workers map their own parts of the file.  'progress' is called
+    after every BLOCK_SIZE bytes"""
+    with open(file_name, 'rb') as f_in:
+        if end is None:
+            end = os.fstat(f_in.fileno()).st_size
+        if start >= end:
+            return
+        # offset of the map must be a multiple of allocation granularity
+        map_start = start - start % mmap.ALLOCATIONGRANULARITY
+        mapped = mmap.mmap(f_in.fileno(), end - map_start, access=mmap.ACCESS_READ, offset=map_start)
+    if hasattr(mapped, 'madvise'):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    # The map isn't closed explicitly: a consumer can keep the last view after the end of
+    # iteration, the map is unmapped when the last view is released.
+    view = memoryview(mapped)
+    find = mapped.find
+    pos = start - map_start
+    map_end = end - map_start
+    # one comparison per line, the mark is never reached without the callback
+    mark = pos + BLOCK_SIZE if progress is not None else sys.maxsize
+    mark_pos = pos
+    while pos < map_end:
+        newline = find(b'\n', pos, map_end)
+        if newline < 0:
+            newline = map_end
+        yield view[pos:newline]
+        pos = newline + 1
+        if pos >= mark:
+            progress(mapped[mark_pos:pos].count(b'\n'), map_start + min(pos, map_end))
+            mark_pos, mark = pos, pos + BLOCK_SIZE
+
+
+if __name__ == "__main__":
+    print("This is a library, not a program")
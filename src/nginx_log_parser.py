@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 # https://pyparsing-docs.readthedocs.io/en/latest/HowToUsePyparsing.html#classes-in-the-pyparsing-module
 import pyparsing as pp
-import time
+import re
 import locale
+import datetime as dt
+import functools as ft
 from collections import namedtuple
 import logging
-from typing import Optional
+from typing import Optional, Union
 from math import floor
 
 locale.setlocale(locale.LC_TIME,"C")
@@ -28,11 +30,24 @@ def validate_real_number(parse_result):
     except ValueError:
         raise pp.ParseException(f"Invalid number: {trynum}")
 
+# Timestamps are kept in requests as they are in the log, parse_timestamp converts them
+# when they are needed.  A log has many lines per second sharing the same timestamp string,
+# conversions are memoized, so strptime runs once per distinct second of the log.
+TIMESTAMP_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+TIMESTAMP_CACHE_SIZE = 4096
+
+@ft.lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_timestamp(ts: Union[str, bytes]) -> dt.datetime:
+    "Timezone aware datetime of a log timestamp (str or bytes), raises ValueError for a bad one"
+    if isinstance(ts, bytes):
+        ts = ts.decode('ascii')
+    return dt.datetime.strptime(ts, TIMESTAMP_FORMAT)
+
 def validate_date(parse_result):
     "Checks that a string is really a good date"
     candi_date = parse_result[0]
     try:
-        time.strptime(candi_date, '%d/%b/%Y:%H:%M:%S %z')
+        parse_timestamp(candi_date)
     except ValueError:
         raise pp.ParseException(f"Invalid string for date/time: {candi_date}")
 
@@ -66,8 +81,8 @@ timeStamp = pp.Combine(dateStr + ':' + timeStr + ' ' + tzStr).set_results_name('
 timeStamp.set_parse_action(validate_date)
 
 # -- request record ("GET url HTTP/1.x")
-requestType   = pp.MatchFirst([pp.Literal(s) for s in
-                       "GET POST CONNECT DELETE HEAD OPTIONS PATCH PUT TRACE".split()]).set_results_name('request')
+METHODS = ('GET', 'POST', 'CONNECT', 'DELETE', 'HEAD', 'OPTIONS', 'PATCH', 'PUT', 'TRACE')
+requestType   = pp.MatchFirst([pp.Literal(s) for s in METHODS]).set_results_name('method')
 httpVersion   = pp.MatchFirst([pp.Literal('HTTP/1.0'), pp.Literal('HTTP/1.1')])
 urlSchemas = ['http', 'https', 'ftp', 'gopher', 'file']
 urlSchemas = [pp.CaselessKeyword(s) for s in urlSchemas]
@@ -79,7 +94,7 @@ httpRequestData = skipQuote + requestType + urlString + pp.Suppress(httpVersion)
 # remote user, remote IP
 remoteUser = pp.Suppress(pp.MatchFirst([pp.Literal('-'), pp.Word(pp.alphanums)]))
 realIP = pp.Suppress(pp.MatchFirst([pp.Literal('-'), ipAddrV4]))
-statusCode   = pp.Word(pp.nums, exact=3)
+statusCode   = pp.Word(pp.nums, exact=3).set_results_name('status')
 bytesTransferred = pp.Word(pp.nums)
 refererUrl   = pp.Combine(skipQuote + pp.MatchFirst([pp.Literal('-'), urlString]) + skipQuote)
 userAgent    = skipQuote + ... + skipQuote
@@ -93,7 +108,15 @@ logLine = ( pp.LineStart() + pp.Suppress(ipAddrV4) +  remoteUser + realIP + pp.S
 # ---------- end of log file parsing ---------
 
 # dureation in milliseconds, ingeger
-Request = namedtuple('Request', ['ts', 'url', 'duration'])
+# method is its index in METHODS (METHOD_UNKNOWN if the log has none), status is the HTTP
+# status code (0 if unknown)
+METHOD_UNKNOWN = len(METHODS)
+Request = namedtuple('Request', ['ts', 'url', 'duration', 'method', 'status'], defaults=(METHOD_UNKNOWN, 0))
+METHOD_CODES = {method: code for code, method in enumerate(METHODS)}
+METHOD_CODES_BYTES = {method.encode('ascii'): code for code, method in enumerate(METHODS)}
+# every three-digit status the grammar takes: a lookup is much cheaper than int() per line
+STATUS_CODES = {'%03d' % code: code for code in range(1000)}
+STATUS_CODES_BYTES = {b'%03d' % code: code for code in range(1000)}
 
 def parse_log_line(log_line: str, log: logging.Logger) -> Optional[Request]:
     try:
@@ -101,11 +124,65 @@ def parse_log_line(log_line: str, log: logging.Logger) -> Optional[Request]:
         # small optimization: multiply durations to 1000, drop fractional part. 
         # This express time in milliseconds.
         int_duration = floor(float(pll.duration) * 1000)
-        return Request(pll.ts, pll.url, int_duration)
+        return Request(pll.ts, pll.url, int_duration, METHOD_CODES[pll.method], STATUS_CODES[pll.status])
     except pp.ParseException:
         log.debug('Error parsing the line ' + log_line)
         return None
 
+# ---------- fast path parser ----------
+# A precompiled regular expression over the known 'ui_short' layout.  It is less strict than
+# the grammar above (doesn't check IP address bytes and calendar dates, accepts only local
+# URLs starting with '/'), the lines it rejects are passed to the pyparsing grammar.
+_ipv4 = r'\d{1,3}(?:\.\d{1,3}){3}'
+fastLogLine = re.compile(
+    r'^' + _ipv4 + r'\s+(?:-|[A-Za-z0-9]+)\s+(?:-|' + _ipv4 + r')\s+'
+    r'\[(?P<ts>\d{1,2}/[A-Z][a-z]{2}/\d{4}:\d\d:\d\d:\d\d [+-]\d{4})\]\s+'
+    r'"(?P<method>' + '|'.join(METHODS) + r')\s+'
+    r'(?P<url>/[A-Za-z0-9/.?&=_#%-]*)\s+HTTP/1\.[01]"\s+'
+    r'(?P<status>[0-9]{3})\s+\d+\s+"[^"]*"\s+"[^"]*"\s+"[^"]*"\s+"[^"]*"\s+"[^"]*"\s+'
+    r'(?P<duration>\d+\.\d*|\.\d+|\d+)\s*$')
+
+def parse_log_line_fast(log_line: str, log: logging.Logger) -> Optional[Request]:
+    "Parses the line with a precompiled regex, falls back to the full grammar on mismatch"
+    m = fastLogLine.match(log_line)
+    if m is None:
+        return parse_log_line(log_line, log)
+    return Request(m['ts'], m['url'], floor(float(m['duration']) * 1000),
+                   METHOD_CODES[m['method']], STATUS_CODES[m['status']])
+
+# the same expression for undecoded lines, timestamp and URL are left undecoded
+fastLogLineBytes = re.compile(fastLogLine.pattern.encode('ascii'))
+
+# namedtuple's __new__ is a Python function, calling tuple.__new__ directly is twice as fast
+_new_tuple = tuple.__new__
+
+def parse_log_line_bytes(log_line: bytes, log: logging.Logger) -> Optional[Request]:
+    """Parses the line without decoding it, returns timestamp and URL as bytes.
+    The lines rejected by the regex are decoded and passed to the full grammar"""
+    m = fastLogLineBytes.match(log_line)
+    if m is None:
+        return parse_log_line_strict_bytes(log_line, log)
+    ts, method, url, status, duration = m.groups()
+    return _new_tuple(Request, (ts, url, floor(float(duration) * 1000), METHOD_CODES_BYTES[method], STATUS_CODES_BYTES[status]))
+
+def parse_log_line_strict_bytes(log_line: bytes, log: logging.Logger) -> Optional[Request]:
+    "Full grammar for undecoded lines, a line may be a memoryview as well"
+    req = parse_log_line(str(log_line, 'utf-8', errors='replace'), log)
+    if req is None:
+        return None
+    return req._replace(ts = req.ts.encode('utf-8'), url = req.url.encode('utf-8'))
+
+# parser engines selectable by configuration
+PARSERS = {
+    'fast':   parse_log_line_fast,
+    'strict': parse_log_line,
+}
+# the same for the lines read in binary mode
+BYTES_PARSERS = {
+    'fast':   parse_log_line_bytes,
+    'strict': parse_log_line_strict_bytes,
+}
+
 
 if __name__ == "__main__":
     print("This is a library, not a program")
@@ -17,6 +17,35 @@ class ConfigObj(NamedTuple):
     allow_exts: list[str]
     journal: str
     template_html: str
+    parser: str = 'fast'
+    workers: int = 1
+    quantiles: str = 'exact'
+    quantile_error: float = 0.01
+    incremental: bool = False
+    backfill: bool = False
+    backfill_jobs: int = 1
+    decompressor: str = 'auto'
+    reader: str = 'auto'
+    report_threshold: int = 1
+    report_sort: str = 'sum'
+    strip_query: bool = False
+    collapse_ids: bool = False
+    url_rules: str = ''
+    max_urls: int = 0
+    stats_backend: str = 'auto'
+    save_aggregates: bool = True
+    merge: str = ''
+    metrics: bool = False
+    profile: bool = False
+    progress_interval: float = 10.0
+    memory_budget: int = 0
+    spill_dir: str = ''
+    json_backend: str = 'auto'
+    report_precision: Optional[int] = None
+    series_interval: int = 0
+    log_format: str = ''
+    daemon: bool = False
+    daemon_interval: float = 60.0
 
 def parse_cli(args, default_config) -> ap.Namespace:
     p = ap.ArgumentParser(
@@ -48,8 +77,82 @@ def parse_cli(args, default_config) -> ap.Namespace:
     p.add_argument('--allow-extension', required=False, dest='allow_exts',
             help='Possible compressed log file extension like gz or bz2')
     p.add_argument('--template', required=False, default='', help='HTML template for the report')
+    p.add_argument('--parser', required=False, dest='parser', choices=['fast', 'strict'],
+            help="Log line parser: precompiled regex with fallback (fast) or full grammar (strict)")
+    p.add_argument('-w', '--workers', required=False, dest='workers', type=int,
+            help='Number of processes parsing an uncompressed log in parallel (0 for CPU count)')
+    p.add_argument('--quantiles', required=False, dest='quantiles', choices=['exact', 'sketch'],
+            help='Keep all request times for exact quantiles or use a constant-memory histogram')
+    p.add_argument('--quantile-error', required=False, dest='quantile_error', type=float,
+            help='Relative error of quantiles for the histogram (sketch), 0.01 by default')
+    p.add_argument('--incremental', required=False, dest='incremental', action='store_true', default=None,
+            help='Process only the lines appended since the previous run and update the report')
+    p.add_argument('--backfill', required=False, dest='backfill', action='store_true', default=None,
+            help='Make reports for all the log files without them, not only for the last one')
+    p.add_argument('--backfill-jobs', required=False, dest='backfill_jobs', type=int,
+            help='Number of log files processed concurrently in backfill mode (0 for CPU count)')
+    p.add_argument('--decompressor', required=False, dest='decompressor',
+            choices=['auto', 'python', 'external'],
+            help='Decompress logs with external program (pigz, zcat, bzip2) or in a Python thread')
+    p.add_argument('--reader', required=False, dest='reader',
+            choices=['auto', 'mmap', 'blocks'],
+            help='Read uncompressed logs through memory map (auto, mmap) or in large blocks')
+    p.add_argument('--report-threshold', required=False, dest='report_threshold', type=int,
+            help='URLs with total request time not above this number of milliseconds are left out of the report')
+    p.add_argument('--report-sort', required=False, dest='report_sort',
+            choices=['sum', 'count', 'max', 'median', 'p99'],
+            help='Metric the report URLs are ranked by, total request time (sum) by default')
+    p.add_argument('--strip-query', required=False, dest='strip_query', action='store_true', default=None,
+            help='Remove query strings from URLs before aggregation')
+    p.add_argument('--collapse-ids', required=False, dest='collapse_ids', action='store_true', default=None,
+            help='Replace numeric, UUID and hex token path segments of URLs by placeholders')
+    p.add_argument('--url-rules', required=False, dest='url_rules',
+            help='File with URL rewrite rules, a line is a regular expression and a replacement')
+    p.add_argument('--max-urls', required=False, dest='max_urls', type=int,
+            help='Cap on distinct URLs, the rest are accounted as "(other)" (0 for no limit)')
+    p.add_argument('--stats-backend', required=False, dest='stats_backend',
+            choices=['auto', 'numpy', 'python'],
+            help='Compute report statistics with NumPy (auto: if it is installed) or in pure Python')
+    p.add_argument('--no-aggregates', required=False, dest='save_aggregates', action='store_false', default=None,
+            help="Don't keep daily aggregates next to the report (they are needed for --merge)")
+    p.add_argument('--merge', required=False, dest='merge', choices=['week', 'month'],
+            help='Make the report for the week or month of the latest daily report from daily aggregates')
+    p.add_argument('--metrics', required=False, dest='metrics', action='store_true', default=None,
+            help='Write timings of the processing stages as JSON next to the report')
+    p.add_argument('--profile', required=False, dest='profile', action='store_true', default=None,
+            help='Run under cProfile and write the statistics (.prof) next to the report')
+    p.add_argument('--progress-interval', required=False, dest='progress_interval', type=float,
+            help='Seconds between progress messages while a log is read (0 for no messages)')
+    p.add_argument('--memory-budget', required=False, dest='memory_budget', type=int,
+            help='Megabytes for URL statistics, above it they are spilled to disk (0 for no limit)')
+    p.add_argument('--spill-dir', required=False, dest='spill_dir',
+            help='Directory for statistics spilled to disk (system temporary directory by default)')
+    p.add_argument('--json-backend', required=False, dest='json_backend',
+            choices=['auto', 'orjson', 'python'],
+            help='Encode the report table with orjson (auto: if it is installed) or in pure Python')
+    p.add_argument('--report-precision', required=False, dest='report_precision', type=int,
+            help='Round the numbers of the report to this number of decimal digits')
+    p.add_argument('--series-interval', required=False, dest='series_interval', type=int,
+            help='Minutes per bucket of time series of the report URLs (0 for no series)')
+    p.add_argument('--log-format', required=False, dest='log_format',
+            help='File with nginx log_format of the logs, compiled into the parser instead of the built-in one')
+    p.add_argument('--daemon', required=False, dest='daemon', action='store_true', default=None,
+            help='Keep running: follow the newest log and update its report, until SIGTERM or Ctrl-C')
+    p.add_argument('--daemon-interval', required=False, dest='daemon_interval', type=float,
+            help='Seconds between report updates in daemon mode, 60 by default')
     return p.parse_args(args)
 
+def int_or_default(value, default: int) -> int:
+    "Missing config values are None (not given in CLI) or empty strings (not given in config file)"
+    if value is None or value == '':
+        return default
+    return int(value)
+
+def float_or_default(value, default: float) -> float:
+    if value is None or value == '':
+        return default
+    return float(value)
+
 def config_from_cli(cli_params: ap.Namespace, default_cfg: str, log: logging.Logger) -> Optional[ConfigObj]:
     "Initialize from parsed CLI parameters"
     # first, use config file or a CLI config string
@@ -95,6 +198,64 @@ def config_from_cli(cli_params: ap.Namespace, default_cfg: str, log: logging.Log
         cfg['journal'] = cli_params.journal
     if cli_params.template != '':
         cfg['template_html'] = cli_params.template
+    if cli_params.parser is not None:
+        cfg['log_parser'] = cli_params.parser
+    if cli_params.workers is not None:
+        cfg['workers'] = cli_params.workers
+    if cli_params.quantiles is not None:
+        cfg['quantiles'] = cli_params.quantiles
+    if cli_params.quantile_error is not None:
+        cfg['quantile_error'] = cli_params.quantile_error
+    if cli_params.incremental is not None:
+        cfg['incremental'] = cli_params.incremental
+    if cli_params.backfill is not None:
+        cfg['backfill'] = cli_params.backfill
+    if cli_params.backfill_jobs is not None:
+        cfg['backfill_jobs'] = cli_params.backfill_jobs
+    if cli_params.decompressor is not None:
+        cfg['decompressor'] = cli_params.decompressor
+    if cli_params.reader is not None:
+        cfg['reader'] = cli_params.reader
+    if cli_params.report_threshold is not None:
+        cfg['report_threshold'] = cli_params.report_threshold
+    if cli_params.report_sort is not None:
+        cfg['report_sort'] = cli_params.report_sort
+    if cli_params.strip_query is not None:
+        cfg['strip_query'] = cli_params.strip_query
+    if cli_params.collapse_ids is not None:
+        cfg['collapse_ids'] = cli_params.collapse_ids
+    if cli_params.url_rules is not None:
+        cfg['url_rules'] = cli_params.url_rules
+    if cli_params.max_urls is not None:
+        cfg['max_urls'] = cli_params.max_urls
+    if cli_params.stats_backend is not None:
+        cfg['stats_backend'] = cli_params.stats_backend
+    if cli_params.save_aggregates is not None:
+        cfg['save_aggregates'] = cli_params.save_aggregates
+    if cli_params.merge is not None:
+        cfg['merge'] = cli_params.merge
+    if cli_params.metrics is not None:
+        cfg['metrics'] = cli_params.metrics
+    if cli_params.profile is not None:
+        cfg['profile'] = cli_params.profile
+    if cli_params.progress_interval is not None:
+        cfg['progress_interval'] = cli_params.progress_interval
+    if cli_params.memory_budget is not None:
+        cfg['memory_budget'] = cli_params.memory_budget
+    if cli_params.spill_dir is not None:
+        cfg['spill_dir'] = cli_params.spill_dir
+    if cli_params.json_backend is not None:
+        cfg['json_backend'] = cli_params.json_backend
+    if cli_params.report_precision is not None:
+        cfg['report_precision'] = cli_params.report_precision
+    if cli_params.series_interval is not None:
+        cfg['series_interval'] = cli_params.series_interval
+    if cli_params.log_format is not None:
+        cfg['log_format'] = cli_params.log_format
+    if cli_params.daemon is not None:
+        cfg['daemon'] = cli_params.daemon
+    if cli_params.daemon_interval is not None:
+        cfg['daemon_interval'] = cli_params.daemon_interval
     if cli_params.allow_exts is not None:
         cfg['allow_exts'] = list(cfp.ext_list.parse_string(cli_params.allow_exts))
 
@@ -112,7 +273,38 @@ def config_from_cli(cli_params: ap.Namespace, default_cfg: str, log: logging.Log
             report_glob = cfg['report_glob'],
             allow_exts  = cfg['allow_exts'],
             journal     = cfg['journal'],
-            template_html = cfg['template_html']
+            template_html = cfg['template_html'],
+            parser      = cfg.get('log_parser') or 'fast',
+            workers     = int_or_default(cfg.get('workers'), 1),
+            quantiles   = cfg.get('quantiles') or 'exact',
+            quantile_error = float(cfg.get('quantile_error') or 0.01),
+            incremental = bool(cfg.get('incremental')),
+            backfill    = bool(cfg.get('backfill')),
+            backfill_jobs = int_or_default(cfg.get('backfill_jobs'), 1),
+            decompressor = cfg.get('decompressor') or 'auto',
+            reader      = cfg.get('reader') or 'auto',
+            report_threshold = int_or_default(cfg.get('report_threshold'), 1),
+            report_sort = cfg.get('report_sort') or 'sum',
+            strip_query = bool(cfg.get('strip_query')),
+            collapse_ids = bool(cfg.get('collapse_ids')),
+            url_rules   = cfg.get('url_rules') or '',
+            max_urls    = int_or_default(cfg.get('max_urls'), 0),
+            stats_backend = cfg.get('stats_backend') or 'auto',
+            # on by default: only an explicit 'off' in config or --no-aggregates turns it off
+            save_aggregates = cfg.get('save_aggregates') is not False,
+            merge       = '' if cfg.get('merge') in (None, '', 'off') else cfg['merge'],
+            metrics     = bool(cfg.get('metrics')),
+            profile     = bool(cfg.get('profile')),
+            progress_interval = float_or_default(cfg.get('progress_interval'), 10.0),
+            memory_budget = int_or_default(cfg.get('memory_budget'), 0),
+            spill_dir   = cfg.get('spill_dir') or '',
+            json_backend = cfg.get('json_backend') or 'auto',
+            # full precision when not given
+            report_precision = int_or_default(cfg.get('report_precision'), None),
+            series_interval = int_or_default(cfg.get('series_interval'), 0),
+            log_format  = cfg.get('log_format') or '',
+            daemon      = bool(cfg.get('daemon')),
+            daemon_interval = float_or_default(cfg.get('daemon_interval'), 60.0),
         )
         
 def configure(argv: list[str], log: logging.Logger, default_config :str):
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Per-URL estimators of request time quantiles (median, p90, p99).
+
+Every estimator has the same small interface:
+    add(value)          -- account one duration (integer milliseconds)
+    merge(other)        -- add all the values of the other estimator of the same kind
+    quantiles(qs)       -- list of estimated quantiles for the fractions in 'qs'
+    count               -- number of values added
+
+ExactQuantiles keeps every value in an array, so the results are exact, but the memory
+grows with the number of requests.  LogHistogram is a log-linear histogram (like DDSketch):
+a value x goes to the bucket k = ceil(log(x) / log(gamma)), gamma = (1 + e) / (1 - e), so any
+quantile is returned with the relative error not more than 'e'.  Number of buckets depends
+only on the range of values, not on their count (about 800 buckets for 1 ms .. 3 hours with
+e = 0.01), and the histograms are mergeable.
+"""
+import math
+import functools as ft
+from array import array
+from typing import Callable, Iterable, Protocol
+
+DEFAULT_RELATIVE_ERROR = 0.01
+# values below this limit get their bucket number from a precomputed table, not from math.log
+INDEX_TABLE_SIZE = 1 << 16
+
+class QuantileEstimator(Protocol):
+    count: int
+    def add(self, value: int) -> None: ...
+    def merge(self, other) -> None: ...
+    def quantiles(self, qs: Iterable[float]) -> list[int]: ...
+
+class ExactQuantiles:
+    "Keeps all the values, quantiles are computed by sorting"
+    __slots__ = ('values',)
+
+    def __init__(self, values: array = None):
+        self.values = values if values is not None else array('l')
+
+    @property
+    def count(self) -> int:
+        return len(self.values)
+
+    def add(self, value: int):
+        self.values.append(value)
+
+    def merge(self, other: 'ExactQuantiles'):
+        self.values.extend(other.values)
+
+    def quantiles(self, qs: Iterable[float]) -> list[int]:
+        "Linear interpolation between the closest ranks, for the median it's a classic one"
+        if not self.values:
+            return [0 for _ in qs]
+        sorted_values = sorted(self.values)
+        result = []
+        for q in qs:
+            pos = q * (len(sorted_values) - 1)
+            low_idx = math.floor(pos)
+            high_idx = math.ceil(pos)
+            low, high = sorted_values[low_idx], sorted_values[high_idx]
+            result.append(low + math.floor((high - low) * (pos - low_idx)))
+        return result
+
+class _HistogramParams:
+    "Constants shared by all the histograms with the same relative error"
+    def __init__(self, relative_error: float):
+        if not 0 < relative_error < 1:
+            raise ValueError(f'Relative error must be between 0 and 1, got {relative_error}')
+        self.gamma = (1 + relative_error) / (1 - relative_error)
+        self.inv_log_gamma = 1 / math.log(self.gamma)
+        self.index_table = array('l', [0]) + array('l', (self.index_of(v) for v in range(1, INDEX_TABLE_SIZE)))
+
+    def index_of(self, value: int) -> int:
+        return math.ceil(math.log(value) * self.inv_log_gamma)
+
+    def value_of(self, index: int) -> float:
+        "The value in the bucket with the least relative error"
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+@ft.lru_cache(maxsize=None)
+def _params_for(relative_error: float) -> _HistogramParams:
+    return _HistogramParams(relative_error)
+
+class LogHistogram:
+    "Log-linear histogram of positive integer values with bounded relative error of quantiles"
+    __slots__ = ('relative_error', 'count', 'zeros', 'buckets', '_params')
+
+    def __init__(self, relative_error: float = DEFAULT_RELATIVE_ERROR):
+        self.relative_error = relative_error
+        self.count = 0
+        self.zeros = 0          # values <= 0 can't be placed to log buckets
+        self.buckets = {}       # bucket index -> values count
+        self._params = _params_for(relative_error)
+
+    def add(self, value: int):
+        self.count += 1
+        if value <= 0:
+            self.zeros += 1
+            return
+        params = self._params
+        idx = params.index_table[value] if value < INDEX_TABLE_SIZE else params.index_of(value)
+        buckets = self.buckets
+        buckets[idx] = buckets.get(idx, 0) + 1
+
+    def merge(self, other: 'LogHistogram'):
+        if other.relative_error != self.relative_error:
+            raise ValueError('Cannot merge histograms with different relative errors')
+        self.count += other.count
+        self.zeros += other.zeros
+        buckets = self.buckets
+        for idx, cnt in other.buckets.items():
+            buckets[idx] = buckets.get(idx, 0) + cnt
+
+    def quantiles(self, qs: Iterable[float]) -> list[int]:
+        if self.count == 0:
+            return [0 for _ in qs]
+        sorted_buckets = sorted(self.buckets.items())
+        result = []
+        for q in qs:
+            rank = q * (self.count - 1)
+            seen = self.zeros
+            value = 0
+            if rank >= seen:
+                for idx, cnt in sorted_buckets:
+                    seen += cnt
+                    if seen > rank:
+                        value = round(self._params.value_of(idx))
+                        break
+            result.append(value)
+        return result
+
+    # the shared parameters aren't pickled, they are looked up on unpickling
+    def __getstate__(self):
+        return (self.relative_error, self.count, self.zeros, self.buckets)
+
+    def __setstate__(self, state):
+        self.relative_error, self.count, self.zeros, self.buckets = state
+        self._params = _params_for(self.relative_error)
+
+ESTIMATORS = {
+    'exact':  ExactQuantiles,
+    'sketch': LogHistogram,
+}
+
+def estimator_factory(kind: str, relative_error: float = DEFAULT_RELATIVE_ERROR) -> Callable[[], QuantileEstimator]:
+    "Returns a picklable callable making new empty estimators of the given kind"
+    if kind == 'sketch':
+        return ft.partial(LogHistogram, relative_error)
+    return ESTIMATORS[kind]
+
+
+if __name__ == "__main__":
+    print("This is a library, not a program")
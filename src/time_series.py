@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Time series of request time per URL: the log is cut into buckets of fixed length (a minute,
+an hour...) and for every URL and bucket the count of requests, their total time and a
+coarse histogram of the times are kept, so the report can show when latency goes up.
+
+Buckets are numbered from the Unix epoch (bucket = timestamp // interval), so series of
+different parts of a log, of different workers and of different days are merged by adding
+the buckets with the same number.  A URL keeps its buckets in flat arrays, a slot per bucket
+it was seen in, so a rare URL takes a few slots, not the whole range of the day.  The
+histogram has half-octave bins: a time of d milliseconds goes to the bin (d * d).bit_length(),
+that is about 2 * log2(d), computed without logarithms; quantiles are estimated with relative error below 20%.
+"""
+import datetime as dt
+from array import array
+from typing import Iterable, Iterator, Optional, Union
+
+import nginx_log_parser as nlp
+
+# bins of the histogram: 0 for zero times, the last one takes everything above 2 ** 16 ms
+SERIES_BINS = 34
+# representative values of the bins: geometric middle of [2 ** ((k - 1) / 2), 2 ** (k / 2))
+BIN_VALUES = [0] + [round(2 ** ((2 * k - 1) / 4)) for k in range(1, SERIES_BINS)]
+_EMPTY_BINS = bytes(4 * SERIES_BINS)    # of an 'I' array
+
+class UrlSeries:
+    """Counts, total times and histograms of the buckets of a URL.  'slots' maps a bucket
+    number to its index in the arrays, a new bucket is appended to them"""
+    __slots__ = ('slots', 'counts', 'sums', 'bins')
+
+    def __init__(self, slots: Optional[dict] = None, counts: Optional[array] = None,
+                 sums: Optional[array] = None, bins: Optional[array] = None):
+        self.slots  = slots if slots is not None else {}
+        self.counts = counts if counts is not None else array('q')
+        self.sums   = sums if sums is not None else array('q')
+        self.bins   = bins if bins is not None else array('I')
+
+    def _new_slot(self, bucket: int) -> int:
+        idx = self.slots[bucket] = len(self.counts)
+        self.counts.append(0)
+        self.sums.append(0)
+        self.bins.frombytes(_EMPTY_BINS)
+        return idx
+
+    def add(self, bucket: int, duration: int):
+        idx = self.slots.get(bucket)
+        if idx is None:
+            idx = self._new_slot(bucket)
+        self.counts[idx] += 1
+        self.sums[idx] += duration
+        bin_idx = (duration * duration).bit_length()
+        self.bins[idx * SERIES_BINS + (bin_idx if bin_idx < SERIES_BINS else SERIES_BINS - 1)] += 1
+
+    def merge(self, other: 'UrlSeries'):
+        slots, counts, sums, bins = self.slots, self.counts, self.sums, self.bins
+        for bucket, other_idx in other.slots.items():
+            idx = slots.get(bucket)
+            if idx is None:
+                idx = self._new_slot(bucket)
+            counts[idx] += other.counts[other_idx]
+            sums[idx] += other.sums[other_idx]
+            base, other_base = idx * SERIES_BINS, other_idx * SERIES_BINS
+            for k in range(SERIES_BINS):
+                bins[base + k] += other.bins[other_base + k]
+
+    def quantiles(self, idx: int, fractions: Iterable[float]) -> list[int]:
+        "Estimated quantiles of the bucket in the slot, the same ranks as LogHistogram"
+        base, count = idx * SERIES_BINS, self.counts[idx]
+        bins = self.bins[base:base + SERIES_BINS]
+        result = []
+        for q in fractions:
+            rank, seen = q * (count - 1), 0
+            for k, cnt in enumerate(bins):
+                seen += cnt
+                if seen > rank:
+                    result.append(BIN_VALUES[k])
+                    break
+            else:
+                result.append(0)
+        return result
+
+    def points(self, fractions: Iterable[float]) -> Iterator[tuple[int, int, int, list[int]]]:
+        "(bucket, count, total time, quantiles) of the buckets in their order"
+        fractions = tuple(fractions)
+        for bucket, idx in sorted(self.slots.items()):
+            yield bucket, self.counts[idx], self.sums[idx], self.quantiles(idx, fractions)
+
+class TimeSeries:
+    """Series of all the URLs with the same bucket length.  'utcoffset' is the time zone of
+    the log (of its first timestamp), the buckets are shown in it"""
+    __slots__ = ('interval', 'utcoffset', 'urls')
+
+    def __init__(self, interval: int, utcoffset: Optional[int] = None, urls: Optional[dict] = None):
+        self.interval  = interval   # seconds
+        self.utcoffset = utcoffset  # seconds east of UTC
+        self.urls      = urls if urls is not None else {}
+
+    def bucket_of(self, ts: Union[str, bytes]) -> Optional[int]:
+        "Bucket number of a log timestamp, None for an invalid one"
+        try:
+            moment = nlp.parse_timestamp(ts)
+        except ValueError:
+            return None
+        if self.utcoffset is None:
+            self.utcoffset = int(moment.utcoffset().total_seconds())
+        return int(moment.timestamp()) // self.interval
+
+    def bucket_start(self, bucket: int) -> dt.datetime:
+        return dt.datetime.fromtimestamp(bucket * self.interval,
+                                         dt.timezone(dt.timedelta(seconds=self.utcoffset or 0)))
+
+    def merge_url(self, url, other: 'UrlSeries'):
+        "Adds the series of the other part of the log to the URL"
+        if url in self.urls:
+            self.urls[url].merge(other)
+        else:
+            self.urls[url] = other
+
+    def decoded(self) -> 'TimeSeries':
+        "The same series with URLs read as bytes decoded, the URLs decoded alike are merged"
+        result = TimeSeries(self.interval, self.utcoffset)
+        for url, url_series in self.urls.items():
+            result.merge_url(url.decode('utf-8', errors='replace') if isinstance(url, bytes) else url, url_series)
+        return result
+
+    def __repr__(self):
+        return f'TimeSeries(interval={self.interval}, {len(self.urls)} URLs)'
+
+
+if __name__ == "__main__":
+    print("This is a library, not a program")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Normalization of URLs before aggregation: every distinct query string, numeric ID or session
+token would make its own line of the report (and its own entry in memory) otherwise.
+
+The steps are applied in this order, each one is optional:
+    strip_query   -- the query string and the fragment ('?...', '#...') are removed
+    rules         -- user rewrite rules (regex, replacement), applied one after another
+    collapse_ids  -- path segments that are UUIDs, long hex tokens or numbers are replaced
+                     by placeholders '{uuid}', '{hex}', '{id}'
+
+The same raw URLs repeat in a log many times, so the results are memoized.  URLs may be
+str or bytes (lines read in binary mode), the result has the type of the argument.
+"""
+import re
+from typing import NamedTuple, Union
+
+# the memo is cleared when it grows to this number of raw URLs
+CACHE_SIZE = 1 << 16
+# statistics of the URLs above the cap on distinct URLs are collected under this key
+OTHER_URL = '(other)'
+OTHER_URL_BYTES = OTHER_URL.encode('ascii')
+
+# a path segment ends at a slash, at the query string or at the end of URL
+_SEGMENT_END = r'(?=[/?#]|$)'
+ID_RULES = [
+    (r'(?<=/)[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12}' + _SEGMENT_END, '{uuid}'),
+    (r'(?<=/)(?=[0-9A-Fa-f]*[A-Fa-f])(?=[0-9A-Fa-f]*[0-9])[0-9A-Fa-f]{16,}' + _SEGMENT_END, '{hex}'),
+    (r'(?<=/)[0-9]+' + _SEGMENT_END, '{id}'),
+]
+_QUERY_RE = r'[?#].*'
+
+Url = Union[str, bytes]
+
+class UrlSettings(NamedTuple):
+    "Everything that changes the normalized URLs, statistics can't be mixed if it differs"
+    strip_query:  bool = False
+    collapse_ids: bool = False
+    rules:        tuple[tuple[str, str], ...] = ()
+
+def load_rules(file_name) -> tuple[tuple[str, str], ...]:
+    """Reads rewrite rules from a file: a line is a regular expression and a replacement
+    separated by whitespace (the replacement may be empty), '#' starts a comment line.
+    Raises OSError if the file can't be read and ValueError on a bad expression"""
+    rules = []
+    with open(file_name, 'r', encoding='utf-8') as f_in:
+        for line_no, line in enumerate(f_in, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            pattern, *replacement = line.split(None, 1)
+            try:
+                re.compile(pattern)
+            except re.error as exc:
+                raise ValueError(f'{file_name}:{line_no}: bad regular expression {pattern}: {exc}')
+            rules.append((pattern, replacement[0] if replacement else ''))
+    return tuple(rules)
+
+def _compile(rules: list[tuple[str, str]], as_bytes: bool) -> list[tuple[re.Pattern, Url]]:
+    if as_bytes:
+        return [(re.compile(p.encode('utf-8')), r.encode('utf-8')) for p, r in rules]
+    return [(re.compile(p), r) for p, r in rules]
+
+class UrlNormalizer:
+    "Callable normalizing a URL by the settings, with memoization of the results"
+    __slots__ = ('settings', 'cache', '_str_rules', '_bytes_rules')
+
+    def __init__(self, settings: UrlSettings):
+        self.settings = settings
+        self.cache = {}
+        rules = []
+        if settings.strip_query:
+            rules.append((_QUERY_RE, ''))
+        # user rules go before the generic ones, they can rewrite IDs their own way
+        rules.extend(settings.rules)
+        if settings.collapse_ids:
+            rules.extend(ID_RULES)
+        self._str_rules = _compile(rules, False)
+        self._bytes_rules = _compile(rules, True)
+
+    def normalize(self, url: Url) -> Url:
+        "Normalization without the memo"
+        for pattern, replacement in (self._bytes_rules if isinstance(url, bytes) else self._str_rules):
+            url = pattern.sub(replacement, url)
+        return url
+
+    def __call__(self, url: Url) -> Url:
+        result = self.cache.get(url)
+        if result is None:
+            result = self.normalize(url)
+            if len(self.cache) >= CACHE_SIZE:
+                self.cache.clear()
+            self.cache[url] = result
+        return result
+
+def make_normalizer(settings: UrlSettings):
+    "None if the settings don't change URLs, so the aggregation can skip the stage"
+    if settings == UrlSettings():
+        return None
+    return UrlNormalizer(settings)
+
+
+if __name__ == "__main__":
+    print("This is a library, not a program")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Optional NumPy backend of the report statistics.  Exact durations of all the URLs come as
+one flat array split to segments by their lengths (see log_analyzer.UrlTable), quantiles
+of every segment are computed in one pass: the values are sorted once by (segment, value)
+and the closest ranks are picked by index arithmetic.  The interpolation is the same as in
+quantile_sketch.ExactQuantiles, so the results are identical to the pure Python ones.
+
+NumPy isn't required, available() tells if the backend can be used.
+"""
+from array import array
+from typing import Iterable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BACKENDS = ('auto', 'numpy', 'python')
+# values are packed with segment numbers into int64 when they fit into 32 bits
+SEGMENT_SHIFT_LIMIT = 1 << 32
+
+def available() -> bool:
+    return np is not None
+
+def resolve_backend(name: str) -> str:
+    "'auto' is 'numpy' when NumPy is installed"
+    if name == 'auto':
+        return 'numpy' if available() else 'python'
+    return name
+
+def segment_quantiles(values: array, lengths: array, fractions: Iterable[float]) -> list[list[int]]:
+    """Quantiles for the 'fractions' of every segment of 'values', a list of quantiles per
+    segment.  Empty segments get zeroes"""
+    fractions = np.asarray(tuple(fractions), dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    flat = np.asarray(values, dtype=np.int64)
+    segment_ids = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    if len(flat) == 0 or (flat.min() >= 0 and flat.max() < SEGMENT_SHIFT_LIMIT):
+        # one sort for all the segments: segment number in high bits, the value in low ones
+        sorted_values = np.sort((segment_ids << 32) | flat) & (SEGMENT_SHIFT_LIMIT - 1)
+    else:
+        sorted_values = flat[np.lexsort((flat, segment_ids))]
+    # a sentinel, so the indices of empty segments are valid too
+    sorted_values = np.append(sorted_values, 0)
+    starts = (np.cumsum(lengths) - lengths)[:, np.newaxis]
+    # the same arithmetic as in ExactQuantiles.quantiles, row per segment, column per fraction
+    pos = fractions[np.newaxis, :] * (lengths[:, np.newaxis] - 1)
+    low_idx = np.floor(pos)
+    high_idx = np.ceil(pos)
+    not_empty = (lengths > 0)[:, np.newaxis]
+    low = sorted_values[np.where(not_empty, starts + low_idx.astype(np.int64), -1)]
+    high = sorted_values[np.where(not_empty, starts + high_idx.astype(np.int64), -1)]
+    return (low + np.floor((high - low) * (pos - low_idx)).astype(np.int64)).tolist()
+
+
+if __name__ == "__main__":
+    print("This is a library, not a program")
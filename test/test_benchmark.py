@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import unittest as ut
+import pathlib as pl
+import logging
+import gzip
+import io
+import contextlib
+import benchmark as bm
+import nginx_log_parser as nlp
+
+TEMPDIR = '/tmp'
+
+class TestSyntheticLog(ut.TestCase):
+    "Synthetic logs must be parsable, broken lines must be rejected"
+
+    @classmethod
+    def setUpClass(cls):
+        cls._dir = pl.Path(TEMPDIR, 'TestBenchmark')
+        cls._dir.mkdir()
+        cls.log = logging.getLogger('test_benchmark')
+
+    @classmethod
+    def tearDownClass(cls):
+        for fn in cls._dir.glob('*'):
+            fn.unlink()
+        cls._dir.rmdir()
+
+    def test_lines(self):
+        spec = bm.SyntheticLogSpec(lines=2000, urls=50, bad_ratio=0.05)
+        lines = [line for batch in bm.synthetic_lines(spec) for line in batch]
+        self.assertEqual(len(lines), 2000)
+        parsed = [nlp.parse_log_line_fast(line, self.log) for line in lines]
+        bad_count = sum(1 for req in parsed if req is None)
+        self.assertEqual(bad_count, sum(1 for line in lines if line in bm.BAD_LINES))
+        self.assertTrue(50 < bad_count < 150)
+        urls = {req.url for req in parsed if req is not None}
+        self.assertLessEqual(len(urls), 50)
+        # the most popular URL is requested more often than the least popular one
+        counts = [sum(1 for req in parsed if req is not None and req.url == url)
+                  for url in ('/api/v2/banner/0', '/api/v2/banner/48')]
+        self.assertGreater(counts[0], counts[1])
+
+    def test_same_seed_same_log(self):
+        spec = bm.SyntheticLogSpec(lines=100, urls=10)
+        self.assertEqual(list(bm.synthetic_lines(spec)), list(bm.synthetic_lines(spec)))
+
+    def test_stages_gz(self):
+        log_fn = bm.generate_log(bm.SyntheticLogSpec(lines=1000, urls=20, compress='gz'), self._dir)
+        with gzip.open(log_fn, 'rt') as f_in:
+            self.assertEqual(sum(1 for _ in f_in), 1000)
+        results = bm.run_stages(log_fn, report_size=10)
+        self.assertEqual([r.stage for r in results],
+                         ['read', 'parse', 'aggregate', 'stats', 'render', 'streaming total'])
+        self.assertTrue(all(r.seconds >= 0 for r in results))
+
+    def test_keep_new_directory(self):
+        keep_dir = self._dir / pl.Path('kept')
+        with contextlib.redirect_stdout(io.StringIO()):
+            bm.main(['--lines', '200', '--urls', '10', '--keep', str(keep_dir)])
+        self.assertEqual([fn.name for fn in keep_dir.iterdir()], ['nginx-access-ui.log-20170630'])
+        for fn in keep_dir.iterdir():
+            fn.unlink()
+        keep_dir.rmdir()
+
+if __name__ == "__main__":
+    ut.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import unittest as ut
+import json
+import time
+import logging
+import instrumentation as instr
+
+class TestInstruments(ut.TestCase):
+    "Stages are timed in order, their counts and the counters get to the summary and JSON"
+
+    def test_stages(self):
+        instruments = instr.Instruments()
+        with instruments.stage('busy') as stage:
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                pass
+            stage.lines, stage.bytes = 1000, 2_000_000
+        with instruments.stage('idle'):
+            time.sleep(0.05)
+        instruments.counters['distinct_urls'] = 7
+        busy, idle = instruments.stages
+        self.assertEqual((busy.name, idle.name), ('busy', 'idle'))
+        self.assertGreaterEqual(busy.wall_s, 0.05)
+        self.assertGreater(busy.cpu_s, 0.02)
+        self.assertLess(idle.cpu_s, idle.wall_s)
+        self.assertIn('lines/s', busy.rates())
+        self.assertIn('MB/s', busy.rates())
+        self.assertEqual(idle.rates(), '')
+        summary = '\n'.join(instruments.summary())
+        self.assertIn('busy:', summary)
+        self.assertIn('distinct_urls: 7', summary)
+        dumped = json.loads(json.dumps(instruments.as_dict()))
+        self.assertEqual(dumped['stages'][0]['lines'], 1000)
+        self.assertEqual(dumped['counters'], {'distinct_urls': 7})
+
+    def test_stage_recorded_on_error(self):
+        instruments = instr.Instruments()
+        with self.assertRaises(ValueError):
+            with instruments.stage('failing'):
+                raise ValueError
+        self.assertEqual([st.name for st in instruments.stages], ['failing'])
+
+class TestProgress(ut.TestCase):
+    "Progress is logged at most once per interval, with percentage of the range and ETA"
+
+    def test_messages(self):
+        log = logging.getLogger('test_progress')
+        progress = instr.Progress(log, 'log-file', 2000, 0.05, start=1000)
+        with self.assertLogs(log, logging.INFO) as logged:
+            progress(10, 1100)                  # too early
+            time.sleep(0.06)
+            progress(10, 1250)
+            progress(10, 1300)                  # too early again
+        self.assertEqual(len(logged.output), 1)
+        self.assertIn('log-file: 25.0%', logged.output[0])
+        self.assertIn('ETA 0:00:00', logged.output[0])
+        self.assertEqual(progress.lines, 30)
+
+    def test_nothing_done(self):
+        progress = instr.Progress(logging.getLogger('test_progress'), 'log-file', 100, 1)
+        self.assertIn('ETA unknown', progress.message(0, time.monotonic()))
+
+if __name__ == "__main__":
+    ut.main()
@@ -2,6 +2,7 @@
 
 import log_analyzer as la
 import program_config as pconf
+import quantile_sketch as qs
 
 import unittest as ut
 import pathlib as pl
@@ -9,6 +10,12 @@ import itertools as it
 import datetime
 import logging
 import json
+import gzip
+import pickle
+import pstats
+import asyncio
+import time
+from unittest import mock
 from array import array
 
 TEMPDIR = '/tmp'
@@ -29,6 +36,9 @@ CONFIG = """
 """
 
 log = logging.getLogger('test-log-analyzer')
+# the counters of methods and statuses in JSON of OutputUrlStats made without them
+ZERO_COUNTERS = ''.join(f',"{name}":0' for name in ('count_2xx', 'count_3xx', 'count_4xx', 'count_5xx', 'count_get',
+                        'count_post', 'count_head', 'count_put', 'count_delete', 'count_other_methods'))
 
 class TestFilesSelection(ut.TestCase):
     "Testing selection if input/output files"
@@ -199,11 +209,275 @@ class TestOutputData(ut.TestCase):
         # select only a first element, but wrap in a list
         js = json.dumps(recs, cls=la.OutputJSONEncoder, separators=(',', ':'))
         self.assertEqual(js, '[' + ','.join([
-            '{"url":"/1","count":2,"time_avg":0.0,"time_max":0.2,"time_sum":0.3,"time_med":0.0,"time_perc":60,"count_perc":33.33}',
-            '{"url":"/2","count":1,"time_avg":0.0,"time_max":0.1,"time_sum":0.2,"time_med":0.0,"time_perc":20,"count_perc":33.34}',
-            '{"url":"/3","count":1,"time_avg":0.0,"time_max":0.15,"time_sum":0.2,"time_med":0.0,"time_perc":20,"count_perc":33.33}',
+            '{"url":"/1","count":2,"time_avg":0.0,"time_max":0.2,"time_sum":0.3,"time_med":0.0,"time_perc":60,"count_perc":33.33,"time_p90":0.0,"time_p99":0.0' + ZERO_COUNTERS + '}',
+            '{"url":"/2","count":1,"time_avg":0.0,"time_max":0.1,"time_sum":0.2,"time_med":0.0,"time_perc":20,"count_perc":33.34,"time_p90":0.0,"time_p99":0.0' + ZERO_COUNTERS + '}',
+            '{"url":"/3","count":1,"time_avg":0.0,"time_max":0.15,"time_sum":0.2,"time_med":0.0,"time_perc":20,"count_perc":33.33,"time_p90":0.0,"time_p99":0.0' + ZERO_COUNTERS + '}',
             ]) + ']')
 
+    def test_json_rows(self):
+        recs = [
+            la.OutputUrlStats('/1', 2, 0.0, 0.2,  0.3, 0.0, 60, 33.33),
+            la.OutputUrlStats('/страница', 1, 0.0, 0.1,  0.2, 0.0, 20, 33.34),
+            la.OutputUrlStats('/"q"\\x\t', 1, 1/3, 2.5e-7, 1e22, 0.0, 20, 33.33),
+            ]
+        for batch in (1, 2, la.JSON_ROWS_BATCH):
+            with mock.patch.object(la, 'JSON_ROWS_BATCH', batch):
+                for records in ([], recs[:1], recs):
+                    self.assertEqual(''.join(la.json_rows(records)), la.output_to_json(records))
+
+    def test_json_rows_rounded(self):
+        recs = [la.OutputUrlStats('/1', 2, 1/3, 0.2, 0.30000000000000004, 0.0, 60, 33.333333, 0.1234, 2)]
+        js = ''.join(la.json_rows(recs, 'python', 3))
+        self.assertEqual(js, '[{"url":"/1","count":2,"time_avg":0.333,"time_max":0.200,"time_sum":0.300,'
+                             '"time_med":0.000,"time_perc":60.000,"count_perc":33.333,"time_p90":0.123,'
+                             '"time_p99":2.000' + ZERO_COUNTERS + '}]')
+        self.assertEqual(json.loads(js)[0]['count_perc'], 33.333)
+
+    @ut.skipUnless(la.orjson is not None, 'orjson is not installed')
+    def test_json_rows_orjson(self):
+        recs = [
+            la.OutputUrlStats('/страница', 1, 1/3, 0.1,  0.2, 0.0, 20, 33.34),
+            la.OutputUrlStats('/"q"\\x\t', 1, 0.0, 2.5e-7, 1e22, 0.0, 20, 33.33),
+            ]
+        with mock.patch.object(la, 'JSON_ROWS_BATCH', 1):
+            self.assertEqual(json.loads(''.join(la.json_rows(recs, 'orjson'))),
+                             json.loads(la.output_to_json(recs)))
+            self.assertEqual(''.join(la.json_rows(recs, 'orjson', 2)), ''.join(la.json_rows(recs, 'python', 2)))
+
+    def test_split_template(self):
+        self.assertEqual(la.split_template('<p>$table_json</p>$table_json'),
+                         la.TemplateParts('<p>', '</p>$table_json', True))
+        self.assertEqual(la.split_template('<p></p>'), la.TemplateParts('<p></p>', '', False))
+
+class TestUrlInfo(ut.TestCase):
+    "URL statistics accumulator is updated in place"
+
+    def test_add(self):
+        ui = la.UrlInfo(qs.ExactQuantiles())
+        for v in (5, 17, 3):
+            ui.add(v)
+        self.assertEqual((ui.occurencies, ui.max_latency, ui.sum_latency), (3, 17, 25))
+        self.assertEqual(la.compute_median(ui), 5)
+
+    def test_merge(self):
+        left, right = la.UrlInfo(qs.ExactQuantiles()), la.UrlInfo(qs.ExactQuantiles())
+        left.add(10)
+        right.add(30)
+        right.add(20)
+        left.merge(right)
+        self.assertEqual((left.occurencies, left.max_latency, left.sum_latency), (3, 30, 60))
+        self.assertEqual(la.compute_median(left), 20)
+
+    def test_aggregate_lines(self):
+        requests = [la.nlp.Request('', '/a', 10), la.nlp.Request('', '/b', 0),
+                    None, la.nlp.Request('', '/a', 30)]
+        result = la.aggregate_lines(requests, lambda rec, _: rec, log)
+        self.assertEqual(result.general_stats, la.GeneralStats(2, 40))
+        self.assertEqual((result.good_lines, result.bad_lines), (3, 1))
+        self.assertEqual(list(result.url_stats.keys()), ['/a'])
+        self.assertEqual(result.url_stats['/a'].sum_latency, 40)
+
+    def test_url_cap(self):
+        requests = [la.nlp.Request('', url, 10) for url in ('/a?x=1', '/b', '/a?x=2', '/c', '/d', '/b')]
+        normalize = la.un.UrlNormalizer(la.un.UrlSettings(strip_query=True))
+        result = la.aggregate_lines(requests, lambda rec, _: rec, log, normalize_url=normalize, max_urls=2)
+        self.assertEqual({url: ui.occurencies for url, ui in result.url_stats.items()},
+                         {'/a': 2, '/b': 2, la.un.OTHER_URL: 2})
+        self.assertEqual(result.general_stats, la.GeneralStats(6, 60))
+
+    def test_merge_cap(self):
+        left = la.aggregate_lines([la.nlp.Request('', '/a', 10)], lambda rec, _: rec, log)
+        right = la.aggregate_lines([la.nlp.Request('', url, 10) for url in ('/a', '/b', '/c')],
+                                   lambda rec, _: rec, log)
+        merged = la.merge_chunk_results(left, right, max_urls=2)
+        self.assertEqual({url: ui.occurencies for url, ui in merged.url_stats.items()},
+                         {'/a': 2, '/b': 1, la.un.OTHER_URL: 1})
+
+    def test_decode_invalid_utf8(self):
+        "URLs differing in invalid UTF-8 bytes only are decoded alike and merged"
+        ts = b'29/Jun/2017:03:50:23 +0300'
+        requests = [la.nlp.Request(ts, url, 10) for url in (b'/a\xff', b'/a\xfe', b'/b', b'/a\xff')]
+        result = la.decode_urls(la.aggregate_lines(requests, lambda rec, _: rec, log, series_interval=60))
+        self.assertEqual({url: ui.occurencies for url, ui in result.url_stats.items()}, {'/a\ufffd': 3, '/b': 1})
+        self.assertEqual({url: sum(result.series.urls[url].counts) for url in result.series.urls},
+                         {'/a\ufffd': 3, '/b': 1})
+
+    def test_method_and_status_counters(self):
+        GET, POST, PATCH = (la.nlp.METHOD_CODES[m] for m in ('GET', 'POST', 'PATCH'))
+        requests = [la.nlp.Request('', '/a', 10, GET, 200), la.nlp.Request('', '/a', 20, POST, 502),
+                    la.nlp.Request('', '/a', 30, PATCH, 404), la.nlp.Request('', '/b', 10, GET, 301),
+                    la.nlp.Request('', '/b', 10)]
+        halves = [la.aggregate_lines(part, lambda rec, _: rec, log) for part in (requests[:2], requests[2:])]
+        # through the worker table and the merge
+        merged = la.merge_chunk_results(*(pickle.loads(pickle.dumps(half)) for half in halves))
+        out = {rec.url: rec for rec in la.process_stats((merged.url_stats, merged.general_stats), 10)}
+        self.assertEqual((out['/a'].count_2xx, out['/a'].count_3xx, out['/a'].count_4xx, out['/a'].count_5xx),
+                         (1, 0, 1, 1))
+        self.assertEqual((out['/a'].count_get, out['/a'].count_post, out['/a'].count_other_methods), (1, 1, 1))
+        # the method and status of the last request are unknown
+        self.assertEqual((out['/b'].count, out['/b'].count_3xx, out['/b'].count_get, out['/b'].count_other_methods),
+                         (2, 1, 1, 0))
+
+class TestUrlTable(ut.TestCase):
+    "Chunk results are pickled through the columnar URL table"
+
+    def make_result(self, new_estimator):
+        requests = [la.nlp.Request('', url, d) for url, d in
+                    (('/b', 10), ('/a', 30), ('/b', 20), ('/c', 5), ('/a', 1))]
+        return la.aggregate_lines(requests, lambda rec, _: rec, log, new_estimator)
+
+    def assert_same(self, restored, original):
+        self.assertIsInstance(restored, la.ChunkResult)
+        self.assertEqual(list(restored.url_stats), list(original.url_stats))
+        self.assertEqual(restored[1:], original[1:])
+        for url, ui in original.url_stats.items():
+            restored_ui = restored.url_stats[url]
+            self.assertEqual((restored_ui.occurencies, restored_ui.max_latency, restored_ui.sum_latency),
+                             (ui.occurencies, ui.max_latency, ui.sum_latency))
+            self.assertEqual(la.compute_quantiles(restored_ui, (0.5, 0.99)), la.compute_quantiles(ui, (0.5, 0.99)))
+
+    def test_exact_round_trip(self):
+        result = self.make_result(qs.ExactQuantiles)
+        table = la.UrlTable.from_dict(result.url_stats)
+        self.assertEqual(table.urls, ['/b', '/a', '/c'])
+        self.assertEqual(list(table.lengths), [2, 2, 1])
+        self.assert_same(pickle.loads(pickle.dumps(result)), result)
+
+    def test_sketch_round_trip(self):
+        result = self.make_result(qs.LogHistogram)
+        self.assertIsNone(la.UrlTable.from_dict(result.url_stats).lengths)
+        self.assert_same(pickle.loads(pickle.dumps(result)), result)
+
+    def test_empty(self):
+        result = la.empty_chunk_result()
+        self.assertEqual(pickle.loads(pickle.dumps(result)), result)
+
+class TestTopN(ut.TestCase):
+    "Selection of N URLs for the report"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.stats = {}
+        for url, durations in (('/few_long', [900, 800]), ('/many_short', [60] * 20),
+                               ('/one_max', [1000]), ('/tiny', [1]), ('/tie', [60] * 20)):
+            ui = la.UrlInfo(qs.ExactQuantiles())
+            for d in durations:
+                ui.add(d)
+            cls.stats[url] = ui
+
+    def full_sort(self, n, key):
+        "Reference selection: full stable sort"
+        urls = [u for u, s in self.stats.items() if s.sum_latency > la.DEFAULT_THRESHOLD]
+        urls.sort(key=lambda u: la.SORT_KEYS[key](self.stats[u]), reverse=True)
+        return urls[:n]
+
+    def test_same_as_full_sort(self):
+        for key in la.SORT_KEYS:
+            for n in (0, 1, 2, 3, 10):
+                self.assertEqual(la.select_n_longest_delayd_urls(self.stats, n, sort_key=key),
+                                 self.full_sort(n, key), f'key {key}, n {n}')
+
+    def test_sort_keys(self):
+        self.assertEqual(la.select_n_longest_delayd_urls(self.stats, 1, sort_key='sum'), ['/few_long'])
+        self.assertEqual(la.select_n_longest_delayd_urls(self.stats, 2, sort_key='count'), ['/many_short', '/tie'])
+        self.assertEqual(la.select_n_longest_delayd_urls(self.stats, 1, sort_key='max'), ['/one_max'])
+        self.assertEqual(la.select_n_longest_delayd_urls(self.stats, 1, sort_key='median'), ['/one_max'])
+
+    def test_threshold(self):
+        self.assertEqual(len(la.select_n_longest_delayd_urls(self.stats, 10, threshold=0)), 5)
+        self.assertEqual(la.select_n_longest_delayd_urls(self.stats, 10, threshold=1500), ['/few_long'])
+
+    @ut.skipUnless(la.vs.available(), 'NumPy is not installed')
+    def test_numpy_backend(self):
+        stats = (self.stats, la.GeneralStats(sum(s.occurencies for s in self.stats.values()),
+                                             sum(s.sum_latency for s in self.stats.values())))
+        for key in la.SORT_KEYS:
+            self.assertEqual(la.process_stats(stats, 3, sort_key=key, backend='numpy'),
+                             la.process_stats(stats, 3, sort_key=key, backend='python'))
+
+class TestSpill(ut.TestCase):
+    "URL statistics above the memory budget are spilled to sorted runs and merged for the report"
+
+    def setUp(self):
+        self._dir = pl.Path(TEMPDIR, 'TestSpill')
+        self._dir.mkdir()
+        # distinct sums, so the order of the report doesn't depend on the order of URLs
+        self.requests = [la.nlp.Request('', f'/url/{i % 37}', i % 37 * 10 + i % 5 + 1) for i in range(500)]
+
+    def tearDown(self):
+        for fn in self._dir.glob('*'):
+            fn.unlink()
+        self._dir.rmdir()
+
+    def aggregate(self, requests, spill=None):
+        with mock.patch.object(la, 'SPILL_CHECK_LINES', 50):
+            return la.aggregate_lines(requests, lambda rec, _: rec, log, spill=spill)
+
+    def totals(self, result):
+        return (result.url_stats, result.general_stats)
+
+    def test_same_report(self):
+        in_memory = self.aggregate(self.requests)
+        spilled = self.aggregate(self.requests, la.SpillSettings(1, str(self._dir)))
+        self.assertIsInstance(spilled.url_stats, la.SpilledUrlStats)
+        self.assertEqual(len(spilled.url_stats.runs), 10)
+        self.assertEqual(spilled[1:], in_memory[1:])
+        self.assertEqual(la.process_stats(self.totals(spilled), 10), la.process_stats(self.totals(in_memory), 10))
+        # equal keys may be ordered otherwise, the selected values must be the same
+        for key, key_of in la.SORT_KEYS.items():
+            self.assertEqual([key_of(ui) for _, ui in la.select_top_url_stats(spilled.url_stats, 5, sort_key=key)],
+                             [key_of(ui) for _, ui in la.select_top_url_stats(in_memory.url_stats, 5, sort_key=key)])
+
+    def test_under_budget(self):
+        result = self.aggregate(self.requests, la.SpillSettings(1 << 30, str(self._dir)))
+        self.assertIsInstance(result.url_stats, dict)
+        self.assertEqual(list(self._dir.glob('*')), [])
+
+    def test_merge_with_dict(self):
+        spilled = self.aggregate(self.requests[:300], la.SpillSettings(1, str(self._dir)))
+        # a worker sends the runs by name
+        spilled = pickle.loads(pickle.dumps(spilled))
+        merged = la.merge_chunk_results(self.aggregate(self.requests[300:]), spilled)
+        self.assertIsInstance(merged.url_stats, la.SpilledUrlStats)
+        self.assertEqual(la.process_stats(self.totals(merged), 10),
+                         la.process_stats(self.totals(self.aggregate(self.requests)), 10))
+
+    def test_url_cap(self):
+        spilled = self.aggregate(self.requests, la.SpillSettings(1, str(self._dir)))
+        merged = la.merge_chunk_results(self.aggregate(self.requests[:200], la.SpillSettings(1, str(self._dir))),
+                                        spilled, max_urls=10)
+        for result in (spilled._replace(url_stats=la.SpilledUrlStats(spilled.url_stats.runs, str(self._dir), 10)),
+                       merged):
+            url_stats = dict(result.url_stats.items())
+            self.assertEqual(len(url_stats), 11)
+            self.assertEqual(list(url_stats)[-1], la.un.OTHER_URL)
+            self.assertEqual(sum(ui.occurencies for ui in url_stats.values()), result.general_stats.total_records)
+
+    def test_report_with_budget(self):
+        log_fn = self._dir / pl.Path('nginx-test-acc_20210310.log')
+        log_fn.write_text(''.join(LOG_LINES[i % len(LOG_LINES)] for i in range(300)), encoding='utf-8')
+        template = self._dir / pl.Path('report.html')
+        template.write_text('$table_json', encoding='utf-8')
+        spill_dir = self._dir / pl.Path('spill')
+        spill_dir.mkdir()
+        config = pconf.ConfigObj(log_dir=str(self._dir), report_dir=str(self._dir), report_size=10,
+                                 verbose=True, log_glob='nginx-test-acc_%Y%m%d.log',
+                                 report_glob='report_%F.html', allow_exts=['.gz'],
+                                 template_html=str(template), debug=False, journal='',
+                                 save_aggregates=False)
+        report_fn = self._dir / pl.Path('report_2021-03-10.html')
+        la.setup_functions(config, log)['make_report_for_file'](log_fn)
+        expected = json.loads(report_fn.read_text(encoding='utf-8'))
+        with mock.patch.object(la, 'SPILL_CHECK_LINES', 50), mock.patch.object(la, 'URL_ENTRY_BYTES', 1 << 20):
+            status = la.setup_functions(config._replace(memory_budget=1, spill_dir=str(spill_dir)),
+                                        log)['make_report_for_file'](log_fn)
+        self.assertIsInstance(status, la.Ok)
+        self.assertEqual(sorted(map(json.dumps, json.loads(report_fn.read_text(encoding='utf-8')))),
+                         sorted(map(json.dumps, expected)))
+        # the runs are removed with their directory
+        self.assertEqual(list(spill_dir.glob('*')), [])
+        spill_dir.rmdir()
+
 class TestMedian(ut.TestCase):
     "testing of median computing function"
 
@@ -239,5 +513,446 @@ class TestMedian(ut.TestCase):
         m = la.compute_median(ui)
         self.assertEqual(m, 14)
 
+    def test_median_of_sketch(self):
+        sketch = qs.LogHistogram(0.01)
+        for v in range(1, 1001):
+            sketch.add(v)
+        ui = la.UrlInfo(sketch, occurencies=1000, max_latency=1000, sum_latency=sum(range(1, 1001)))
+        m = la.compute_median(ui)
+        self.assertAlmostEqual(m, 500, delta=5)
+
+    def test_output_percentiles(self):
+        ui = la.UrlInfo(qs.ExactQuantiles(array('l', range(1, 101))), occurencies=100,
+                        max_latency=100, sum_latency=sum(range(1, 101)))
+        out = la.compute_output_stats('/1', ui, 100, sum(range(1, 101)))
+        self.assertEqual(out.time_p90, 0.09)
+        self.assertEqual(out.time_p99, 0.099)
+
+LOG_LINES = [
+    '1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] "GET /api/v2/banner/25013431 HTTP/1.1" 200 948 "-" "Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" "1498697422-2190034393-4708-9752758" "dc7161be3" 0.917\n',
+    '1.168.65.96 -  - [29/Jun/2017:03:50:23 +0300] "GET /api/v2/internal/banner/24288647/info HTTP/1.1" 200 351 "-" "-" "-" "1498697423-2539198130-4708-9752780" "89f7f1be37d" 0.072\n',
+    '1.169.137.128 -  - [29/Jun/2017:03:50:23 +0300] "GET /api/v2/banner/21456892 HTTP/1.1" 200 70795 "-" "Slotovod" "-" "1498697423-2118016444-4708-9752779" "712e90144abee9" 0.158\n',
+    '1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] "-" 200 983 "-" "Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" "1498697422-2190034393-4708-9752755" "dc7161be3" 1.403\n',
+    ]
+
+class TestParallelProcessing(ut.TestCase):
+    "Processing of the log file in chunks must give the same result as the serial processing"
+
+    @classmethod
+    def setUpClass(cls):
+        cls._dir = pl.Path(TEMPDIR, 'TestChunks')
+        cls._dir.mkdir()
+        cls.log_fn = cls._dir / pl.Path('nginx-test-acc_20210310.log')
+        with open(cls.log_fn, 'w', encoding='utf-8') as f_out:
+            for i in range(250):
+                f_out.write(LOG_LINES[i % len(LOG_LINES)])
+        cls.logger = logging.getLogger('test_log_analyzer')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.log_fn.unlink()
+        cls._dir.rmdir()
+
+    def make_config(self, workers):
+        return pconf.ConfigObj(log_dir=str(self._dir), report_dir=str(self._dir),
+                               report_size=10, verbose=True,
+                               log_glob='nginx-test-acc_%Y%m%d.log',
+                               report_glob='report_%F.html',
+                               allow_exts=['.gz'], template_html='report.html',
+                               debug=False, journal='', workers=workers)
+
+    def test_chunks_aligned_to_lines(self):
+        chunks = la.split_file_to_chunks(self.log_fn, 7)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], self.log_fn.stat().st_size)
+        lines = list(it.chain.from_iterable(la.read_lines_range(self.log_fn, start, end)
+                                            for start, end in chunks))
+        self.assertEqual(lines, [LOG_LINES[i % len(LOG_LINES)].rstrip('\n').encode('utf-8')
+                                 for i in range(250)])
+
+    def test_more_chunks_than_lines(self):
+        chunks = la.split_file_to_chunks(self.log_fn, 1000)
+        self.assertEqual(len(chunks), 250)
+
+    def test_parallel_sketch_merge(self):
+        cfg = self.make_config(1)._replace(quantiles='sketch')
+        serial_stats = la.setup_functions(cfg, self.logger)['process_one_file'](self.log_fn)
+        parallel_stats = la.setup_functions(cfg._replace(workers=4), self.logger)['process_one_file'](self.log_fn)
+        self.assertEqual(la.process_stats(serial_stats, 10), la.process_stats(parallel_stats, 10))
+
+    def test_parallel_equals_serial(self):
+        serial_stats = la.setup_functions(self.make_config(1), self.logger)['process_one_file'](self.log_fn)
+        parallel_stats = la.setup_functions(self.make_config(3), self.logger)['process_one_file'](self.log_fn)
+        self.assertEqual(serial_stats[1], parallel_stats[1])
+        self.assertEqual(la.process_stats(serial_stats, 10), la.process_stats(parallel_stats, 10))
+
+    def test_mmap_equals_blocks(self):
+        cfg = self.make_config(2)
+        mmap_stats = la.setup_functions(cfg._replace(reader='mmap'), self.logger)['process_one_file'](self.log_fn)
+        blocks_stats = la.setup_functions(cfg._replace(reader='blocks'), self.logger)['process_one_file'](self.log_fn)
+        self.assertEqual(mmap_stats[1], blocks_stats[1])
+        self.assertEqual(la.process_stats(mmap_stats, 10), la.process_stats(blocks_stats, 10))
+
+    def test_log_format_equals_builtin(self):
+        "The same format given as LOG_FORMAT is compiled, the workers get the compiled one"
+        format_fn = self._dir / pl.Path('ui_short.conf')
+        format_fn.write_text(f"log_format ui_short '{la.lf.UI_SHORT}';\n")
+        cache_dir = self._dir / pl.Path('cache')
+        try:
+            with mock.patch.dict('os.environ', {'XDG_CACHE_HOME': str(cache_dir)}):
+                builtin_stats = la.setup_functions(self.make_config(2), self.logger)['process_one_file'](self.log_fn)
+                cfg = self.make_config(2)._replace(log_format=str(format_fn))
+                compiled_stats = la.setup_functions(cfg, self.logger)['process_one_file'](self.log_fn)
+                self.assertEqual(len(list(cache_dir.rglob('*.json'))), 1)
+        finally:
+            format_fn.unlink()
+            for fn in sorted(cache_dir.rglob('*'), reverse=True):
+                fn.rmdir() if fn.is_dir() else fn.unlink()
+            cache_dir.rmdir()
+        self.assertEqual(builtin_stats[1], compiled_stats[1])
+        self.assertEqual(la.process_stats(builtin_stats, 10), la.process_stats(compiled_stats, 10))
+
+class TestIncrementalProcessing(ut.TestCase):
+    "Incremental processing must resume from the checkpoint and give the same result as full one"
+
+    def setUp(self):
+        self._dir = pl.Path(TEMPDIR, 'TestIncremental')
+        self._dir.mkdir()
+        self.log_fn = self._dir / pl.Path('nginx-test-acc_20210310.log')
+        self.logger = logging.getLogger('test_log_analyzer')
+        self.cfg = pconf.ConfigObj(log_dir=str(self._dir), report_dir=str(self._dir),
+                                   report_size=10, verbose=True,
+                                   log_glob='nginx-test-acc_%Y%m%d.log',
+                                   report_glob='report_%F.html',
+                                   allow_exts=['.gz'], template_html='report.html',
+                                   debug=False, journal='', incremental=True)
+
+    def tearDown(self):
+        for fn in self._dir.glob('*'):
+            fn.unlink()
+        self._dir.rmdir()
+
+    def write_lines(self, first, last, tail=''):
+        with open(self.log_fn, 'a', encoding='utf-8') as f_out:
+            for i in range(first, last):
+                f_out.write(LOG_LINES[i % len(LOG_LINES)])
+            f_out.write(tail)
+
+    def test_resume_from_checkpoint(self):
+        funcs = la.setup_functions(self.cfg, self.logger)
+        self.write_lines(0, 100)
+        first_stats = funcs['process_one_file'](self.log_fn)
+        self.assertEqual(first_stats[1].total_records, 75)
+        ckpt_fn = self._dir / pl.Path('report_2021-03-10.html.checkpoint')
+        self.assertTrue(ckpt_fn.is_file())
+        # an incomplete line being written must wait for the next run
+        self.write_lines(100, 250, tail=LOG_LINES[0][:40])
+        second_stats = funcs['process_one_file'](self.log_fn)
+        full_cfg = self.cfg._replace(incremental=False)
+        with open(self.log_fn, 'r+', encoding='utf-8') as f_log:
+            f_log.truncate(la.find_last_line_end(self.log_fn))
+        full_stats = la.setup_functions(full_cfg, self.logger)['process_one_file'](self.log_fn)
+        self.assertEqual(second_stats[1], full_stats[1])
+        self.assertEqual(la.process_stats(second_stats, 10), la.process_stats(full_stats, 10))
+
+    def test_stale_checkpoint(self):
+        funcs = la.setup_functions(self.cfg, self.logger)
+        self.write_lines(0, 100)
+        funcs['process_one_file'](self.log_fn)
+        # log rotation: a new file with the same name
+        self.log_fn.unlink()
+        self.write_lines(0, 8)
+        stats = funcs['process_one_file'](self.log_fn)
+        self.assertEqual(stats[1].total_records, 6)
+        # the checkpoint without time series can't be resumed with them
+        self.write_lines(8, 16)
+        stats = la.setup_functions(self.cfg._replace(series_interval=60), self.logger)['process_one_file'](self.log_fn)
+        self.assertEqual(stats[1].total_records, 12)
+        with open(self._dir / pl.Path('report_2021-03-10.html.checkpoint'), 'rb') as f_in:
+            self.assertIsNotNone(pickle.load(f_in).result.series)
+
+class TestDaemon(ut.TestCase):
+    "Daemon mode follows the newest log, its reports are the same as the ones made at once"
+
+    def setUp(self):
+        self._dir = pl.Path(TEMPDIR, 'TestDaemon')
+        self.out_dir = self._dir / pl.Path('report')
+        self.out_dir.mkdir(parents=True)
+        (self._dir / pl.Path('batch')).mkdir()
+        template = self._dir / pl.Path('report.html')
+        template.write_text('<html>$table_json</html>', encoding='utf-8')
+        self.log_fn = self._dir / pl.Path('nginx-test-acc_20210310.log')
+        self.logger = logging.getLogger('test_log_analyzer')
+        self.cfg = pconf.ConfigObj(log_dir=str(self._dir), report_dir=str(self.out_dir),
+                                   report_size=10, verbose=True,
+                                   log_glob='nginx-test-acc_%Y%m%d.log',
+                                   report_glob='report_%F.html',
+                                   allow_exts=['.gz'], template_html=str(template),
+                                   debug=False, journal='', daemon=True, daemon_interval=0,
+                                   save_aggregates=False)
+
+    def tearDown(self):
+        for fn in sorted(self._dir.rglob('*'), reverse=True):
+            fn.rmdir() if fn.is_dir() else fn.unlink()
+        self._dir.rmdir()
+
+    @staticmethod
+    def write_lines(log_fn, first, last, tail=''):
+        with open(log_fn, 'a', encoding='utf-8') as f_out:
+            for i in range(first, last):
+                f_out.write(LOG_LINES[i % len(LOG_LINES)])
+            f_out.write(tail)
+
+    async def wait_for(self, condition, timeout=20):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, 'the daemon did not update the report')
+            await asyncio.sleep(0.01)
+
+    def batch_report(self, log_fn) -> str:
+        "The report of the whole log made the usual way"
+        batch_cfg = self.cfg._replace(daemon=False, report_dir=str(self._dir / pl.Path('batch')))
+        la.setup_functions(batch_cfg, self.logger)['make_report_for_file'](log_fn)
+        return la.setup_functions(batch_cfg, self.logger)['make_report_filename'](log_fn).read_text()
+
+    def test_follow_and_rotate(self):
+        funcs = la.setup_functions(self.cfg, self.logger)
+        report_fn = self.out_dir / pl.Path('report_2021-03-10.html')
+        next_fn = self._dir / pl.Path('nginx-test-acc_20210311.log')
+        self.write_lines(self.log_fn, 0, 100)
+
+        async def scenario():
+            stop = asyncio.Event()
+            daemon = asyncio.create_task(funcs['watch_logs'](stop, 0.01))
+            await self.wait_for(report_fn.is_file)
+            first_report = report_fn.read_text()
+            # an incomplete line being written waits for its end
+            self.write_lines(self.log_fn, 100, 250, tail=LOG_LINES[0][:40])
+            await self.wait_for(lambda: report_fn.read_text() != first_report)
+            # the last lines of the old log go to its report after the rotation
+            self.write_lines(self.log_fn, 1, 20, tail=LOG_LINES[0][40:])
+            self.write_lines(next_fn, 0, 10)
+            await self.wait_for((self.out_dir / pl.Path('report_2021-03-11.html')).is_file)
+            stop.set()
+            await daemon
+
+        asyncio.run(scenario())
+        self.assertEqual(report_fn.read_text(), self.batch_report(self.log_fn))
+        self.assertEqual((self.out_dir / pl.Path('report_2021-03-11.html')).read_text(), self.batch_report(next_fn))
+
+    def test_rotated_log_gone(self):
+        "A log renamed or removed by the rotation gets the report of the lines read before"
+        next_fn = self._dir / pl.Path('nginx-test-acc_20210311.log')
+        third_fn = self._dir / pl.Path('nginx-test-acc_20210312.log')
+        self.write_lines(self.log_fn, 0, 100)
+        expected = self.batch_report(self.log_fn)
+        tail_once = la.setup_functions(self.cfg._replace(incremental=True), self.logger)['tail_once']
+        state = tail_once(None)
+        with self.assertLogs(self.logger, logging.WARNING):
+            # compressed by logrotate: the old name is gone
+            self.log_fn.rename(self.log_fn.with_name(self.log_fn.name + '-old'))
+            self.write_lines(next_fn, 0, 10)
+            state = tail_once(state)
+        self.assertEqual(state.file_name, next_fn)
+        self.assertEqual((self.out_dir / pl.Path('report_2021-03-10.html')).read_text(), expected)
+        self.assertEqual((self.out_dir / pl.Path('report_2021-03-11.html')).read_text(), self.batch_report(next_fn))
+        next_fn.unlink()
+        self.write_lines(third_fn, 0, 20)
+        self.assertEqual(tail_once(state).file_name, third_fn)
+
+class TestBackfill(ut.TestCase):
+    "Backfill mode makes reports for all the log files without them"
+
+    def setUp(self):
+        self._dir = pl.Path(TEMPDIR, 'TestBackfill')
+        self.in_dir = self._dir / pl.Path('log')
+        self.out_dir = self._dir / pl.Path('report')
+        for p in (self._dir, self.in_dir, self.out_dir):
+            p.mkdir()
+        self.template = self._dir / pl.Path('report.html')
+        self.template.write_text('<html>$table_json</html>', encoding='utf-8')
+        for day in range(10, 15):
+            fn = self.in_dir / pl.Path(f'nginx-test-acc_202103{day}.log')
+            with open(fn, 'w', encoding='utf-8') as f_out:
+                f_out.writelines(LOG_LINES * day)
+        # the same date, compressed: must be skipped
+        with gzip.open(self.in_dir / pl.Path('nginx-test-acc_20210310.log.gz'), 'wt', encoding='utf-8') as f_out:
+            f_out.writelines(LOG_LINES)
+        # report for this date exists already
+        (self.out_dir / pl.Path('report_2021-03-11.html')).write_text('old report', encoding='utf-8')
+        self.logger = logging.getLogger('test_log_analyzer')
+
+    def tearDown(self):
+        for fn in it.chain(self.in_dir.glob('*'), self.out_dir.glob('*')):
+            fn.unlink()
+        self.template.unlink()
+        for p in (self.in_dir, self.out_dir, self._dir):
+            p.rmdir()
+
+    def make_config(self, jobs):
+        return pconf.ConfigObj(log_dir=str(self.in_dir), report_dir=str(self.out_dir),
+                               report_size=10, verbose=True,
+                               log_glob='nginx-test-acc_%Y%m%d.log',
+                               report_glob='report_%F.html',
+                               allow_exts=['.gz'], template_html=str(self.template),
+                               debug=False, journal='', backfill=True, backfill_jobs=jobs)
+
+    def test_select_all_input_files(self):
+        files = la.setup_functions(self.make_config(1), self.logger)['select_all_input_files']()
+        self.assertEqual([fn.name for fn in files],
+                         [f'nginx-test-acc_202103{day}.log' for day in range(10, 15)])
+
+    def check_reports(self):
+        reports = sorted(fn.name for fn in self.out_dir.glob('*.html'))
+        self.assertEqual(reports, [f'report_2021-03-{day}.html' for day in range(10, 15)])
+        self.assertEqual((self.out_dir / pl.Path('report_2021-03-11.html')).read_text(encoding='utf-8'),
+                         'old report')
+        report = (self.out_dir / pl.Path('report_2021-03-13.html')).read_text(encoding='utf-8')
+        table = json.loads(report[len('<html>'):-len('</html>')])
+        self.assertEqual(sum(row['count'] for row in table), 3 * 13)
+
+    def test_backfill_serial(self):
+        la.setup_functions(self.make_config(1), self.logger)['backfill_files']()
+        self.check_reports()
+
+    def test_backfill_concurrent(self):
+        la.setup_functions(self.make_config(3), self.logger)['backfill_files']()
+        self.check_reports()
+
+class TestPeriodReports(ut.TestCase):
+    "Weekly and monthly reports are merged from daily aggregates"
+
+    def setUp(self):
+        self._dir = pl.Path(TEMPDIR, 'TestPeriodReports')
+        self.in_dir = self._dir / pl.Path('log')
+        self.out_dir = self._dir / pl.Path('report')
+        self.whole_dir = self._dir / pl.Path('whole')
+        for p in (self._dir, self.in_dir, self.out_dir, self.whole_dir):
+            p.mkdir()
+        self.template = self._dir / pl.Path('report.html')
+        self.template.write_text('<html>$table_json</html>', encoding='utf-8')
+        # 2021-03-07 is Sunday of the previous week, the week of 03-10..03-14 starts on 03-08
+        self.day_lines = {}
+        for day in (7, 10, 11, 12, 13, 14):
+            lines = [LOG_LINES[(day + i) % len(LOG_LINES)] for i in range(day * 3)]
+            (self.in_dir / pl.Path(f'nginx-test-acc_202103{day:02}.log')).write_text(''.join(lines), encoding='utf-8')
+            self.day_lines[day] = lines
+        self.logger = logging.getLogger('test_log_analyzer')
+
+    def tearDown(self):
+        for fn in it.chain(self.in_dir.glob('*'), self.out_dir.glob('*'), self.whole_dir.glob('*')):
+            fn.unlink()
+        self.template.unlink()
+        for p in (self.in_dir, self.out_dir, self.whole_dir, self._dir):
+            p.rmdir()
+
+    def make_config(self, report_dir=None, **kwargs):
+        return pconf.ConfigObj(log_dir=str(self.in_dir), report_dir=str(report_dir or self.out_dir),
+                               report_size=100, verbose=True,
+                               log_glob='nginx-test-acc_%Y%m%d.log',
+                               report_glob='report_%F.html',
+                               allow_exts=['.gz'], template_html=str(self.template),
+                               debug=False, journal='', **kwargs)
+
+    def read_table(self, report_fn):
+        report = report_fn.read_text(encoding='utf-8')
+        return json.loads(report[len('<html>'):-len('</html>')])
+
+    def whole_log_table(self, days):
+        "Report of one log with all the lines of the days, the merged report must be the same"
+        whole_fn = self.whole_dir / pl.Path('nginx-test-acc_20210301.log')
+        whole_fn.write_text(''.join(it.chain.from_iterable(self.day_lines[day] for day in days)), encoding='utf-8')
+        # aggregates keep request times as sketches
+        la.setup_functions(self.make_config(self.whole_dir, save_aggregates=False, quantiles='sketch'),
+                           self.logger)['make_report_for_file'](whole_fn)
+        return self.read_table(self.whole_dir / pl.Path('report_2021-03-01.html'))
+
+    def merge(self, period, **kwargs):
+        la.setup_functions(self.make_config(backfill=True), self.logger)['backfill_files']()
+        return la.setup_functions(self.make_config(merge=period, **kwargs), self.logger)['merge_period_reports']()
+
+    def test_week(self):
+        self.assertIsInstance(self.merge('week'), la.Ok)
+        self.assertEqual(len(list(self.out_dir.glob('*.stats'))), 6)
+        with gzip.open(self.out_dir / pl.Path('report_2021-03-10.html.stats'), 'rb') as f_in:
+            aggregate = pickle.load(f_in)
+        self.assertEqual(aggregate.quantiles, ('exact', 0.01))
+        self.assertTrue(all(isinstance(url_info.durations, qs.LogHistogram)
+                            for url_info in aggregate.result.url_stats.values()))
+        self.assertEqual(self.read_table(self.out_dir / pl.Path('report_2021-03-08-week.html')),
+                         self.whole_log_table((10, 11, 12, 13, 14)))
+
+    def test_month(self):
+        self.assertIsInstance(self.merge('month'), la.Ok)
+        self.assertEqual(self.read_table(self.out_dir / pl.Path('report_2021-03-01-month.html')),
+                         self.whole_log_table((7, 10, 11, 12, 13, 14)))
+
+    def test_other_settings_skipped(self):
+        self.assertIsInstance(self.merge('week', quantiles='sketch'), la.Err)
+
+    def test_series(self):
+        self.template.write_text('<html>$table_json</html>\n$series_json', encoding='utf-8')
+        input_fn = self.in_dir / pl.Path('nginx-test-acc_20210310.log')
+        reports = {}
+        for workers in (1, 2):
+            report_fn = self.out_dir / pl.Path('report_2021-03-10.html')
+            status = la.setup_functions(self.make_config(series_interval=60, workers=workers, save_aggregates=False),
+                                        self.logger)['make_report_for_file'](input_fn)
+            self.assertIsInstance(status, la.Ok)
+            reports[workers] = report_fn.read_text(encoding='utf-8')
+            report_fn.unlink()
+        self.assertEqual(reports[1], reports[2])
+        table, series = reports[1].split('\n')
+        table = json.loads(table[len('<html>'):-len('</html>')])
+        series = json.loads(series)
+        # all the lines are of the same hour
+        self.assertEqual({point['time'] for point in series}, {'2017-06-29T03:00+03:00'})
+        self.assertEqual({point['url']: point['count'] for point in series},
+                         {row['url']: row['count'] for row in table})
+        self.assertEqual([point['time_avg'] for point in series], [row['time_avg'] for row in table])
+        # a week of daily aggregates keeps the series, without them it's null
+        la.setup_functions(self.make_config(backfill=True, series_interval=60), self.logger)['backfill_files']()
+        self.assertIsInstance(la.setup_functions(self.make_config(merge='week', series_interval=60),
+                                                 self.logger)['merge_period_reports'](), la.Ok)
+        week_table, week_series = (self.out_dir / pl.Path('report_2021-03-08-week.html')).read_text(encoding='utf-8').split('\n')
+        self.assertEqual(sum(point['count'] for point in json.loads(week_series)),
+                         sum(row['count'] for row in json.loads(week_table[len('<html>'):-len('</html>')])))
+        # aggregates with other time series settings are skipped
+        self.assertIsInstance(self.merge('week'), la.Err)
+
+    def test_metrics_and_profile(self):
+        input_fn = self.in_dir / pl.Path('nginx-test-acc_20210310.log')
+        status = la.setup_functions(self.make_config(metrics=True, profile=True),
+                                    self.logger)['make_report_for_file'](input_fn)
+        self.assertIsInstance(status, la.Ok)
+        report_fn = self.out_dir / pl.Path('report_2021-03-10.html')
+        metrics = json.loads(report_fn.with_name(report_fn.name + la.METRICS_SUFFIX).read_text(encoding='utf-8'))
+        stages = {st['name']: st for st in metrics['stages']}
+        self.assertEqual(list(stages), ['collect', 'stats', 'render', 'save aggregates'])
+        self.assertEqual(stages['collect']['lines'], len(self.day_lines[10]))
+        self.assertEqual(stages['collect']['bytes'], input_fn.stat().st_size)
+        self.assertEqual(stages['render']['bytes'], status.data)
+        self.assertGreater(metrics['counters']['distinct_urls'], 0)
+        profile = pstats.Stats(str(report_fn.with_name(report_fn.name + la.PROFILE_SUFFIX)))
+        self.assertGreater(profile.total_calls, 0)
+
+    def test_template_read_once(self):
+        funs = la.setup_functions(self.make_config(save_aggregates=False), self.logger)
+        for day in (10, 11):
+            self.assertIsInstance(funs['make_report_for_file'](self.in_dir / pl.Path(f'nginx-test-acc_202103{day}.log')),
+                                  la.Ok)
+            self.template.write_text('changed $table_json', encoding='utf-8')
+        self.assertTrue((self.out_dir / pl.Path('report_2021-03-11.html')).read_text(encoding='utf-8').startswith('<html>'))
+        self.assertEqual(sorted(fn.name for fn in self.out_dir.glob('*')),
+                         ['report_2021-03-10.html', 'report_2021-03-11.html'])
+
+    def test_period_bounds(self):
+        self.assertEqual(la.period_bounds(datetime.date(2021, 3, 10), 'week'),
+                         (datetime.date(2021, 3, 8), datetime.date(2021, 3, 14)))
+        self.assertEqual(la.period_bounds(datetime.date(2020, 2, 10), 'month'),
+                         (datetime.date(2020, 2, 1), datetime.date(2020, 2, 29)))
+        self.assertEqual(la.period_bounds(datetime.date(2021, 12, 31), 'month'),
+                         (datetime.date(2021, 12, 1), datetime.date(2021, 12, 31)))
+
 if __name__ == "__main__":
     ut.main()
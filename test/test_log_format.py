@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import unittest as ut
+import pathlib as pl
+import logging
+import pickle
+import json
+import log_format as lf
+import nginx_log_parser as nlp
+
+TEMPDIR = '/tmp'
+
+log = logging.getLogger('test-log-format')
+
+UI_SHORT_LINES = [
+    b'1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] "GET /api/v2/banner/25013431 HTTP/1.1" 200 948 "-" "Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" "1498697422-2190034393-4708-9752758" "dc7161be3" 0.917',
+    b'1.166.249.64 2a828197ae235b0b3cb  - [29/Jun/2017:04:00:12 +0300] "POST / HTTP/1.1" 302 5 "-" "Lynx/2.8.8dev.9" "-" "1498698012-1082475993-4708-9758092" "-" 0.122',
+    b'1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] "HEAD /export/?x=1 HTTP/1.0" 404 948 "-" "-" "-" "-" "-" 2',
+    ]
+
+COMBINED_TIMED = ('$remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent '
+                  '"$http_referer" "$http_user_agent" rt=$request_time')
+
+class TestCompileFormat(ut.TestCase):
+    "Formats are translated to expressions capturing the fields of Request only"
+
+    def test_ui_short_same_as_builtin(self):
+        parse = lf.make_parser(lf.compile_format(lf.UI_SHORT))
+        for line in UI_SHORT_LINES:
+            self.assertEqual(parse(line, log), nlp.parse_log_line_bytes(line, log))
+        self.assertEqual(parse(memoryview(UI_SHORT_LINES[0]), log), nlp.parse_log_line_bytes(UI_SHORT_LINES[0], log))
+        self.assertIsNone(parse(b'1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] "-" 200 983', log))
+
+    def test_other_format(self):
+        compiled = lf.compile_format(COMBINED_TIMED)
+        self.assertEqual(compiled.pattern.count('(?P<'), 5)
+        parse = lf.make_parser(compiled)
+        req = parse(b'10.0.0.1 - alice [01/Jul/2017:10:00:00 +0000] "DELETE /api/item/7 HTTP/2.0" 503 0 '
+                    b'"https://example.com/a b" "curl/8.0" rt=0.250\n', log)
+        self.assertEqual(req, nlp.Request(b'01/Jul/2017:10:00:00 +0000', b'/api/item/7', 250,
+                                          nlp.METHOD_CODES['DELETE'], 503))
+
+    def test_fields_in_any_order(self):
+        "Separate method and URI variables, braces, no timestamp"
+        parse = lf.make_parser(lf.compile_format('${request_time}|$status|$request_method $request_uri|$host'))
+        self.assertEqual(parse(b'1.5|200|PUT /upload|example.com', log),
+                         nlp.Request(b'', b'/upload', 1500, nlp.METHOD_CODES['PUT'], 200))
+
+    def test_missing_fields(self):
+        with self.assertRaisesRegex(ValueError, 'duration'):
+            lf.compile_format('$remote_addr "$request" $status')
+        # method and status are unknown
+        parse = lf.make_parser(lf.compile_format('$remote_addr $request_uri $request_time'))
+        self.assertEqual(parse(b'10.0.0.1 /upload 0.5', log), nlp.Request(b'', b'/upload', 500))
+        self.assertEqual(parse(b'10.0.0.1 /upload 0.5', log)[3:], (nlp.METHOD_UNKNOWN, 0))
+
+    def test_pickle(self):
+        compiled = lf.compile_format(lf.UI_SHORT)
+        self.assertEqual(pickle.loads(pickle.dumps(compiled)), compiled)
+
+class TestFormatFiles(ut.TestCase):
+    "Format files and the cache of translations"
+
+    def setUp(self):
+        self._dir = pl.Path(TEMPDIR, 'TestLogFormat')
+        self._dir.mkdir()
+
+    def tearDown(self):
+        for fn in self._dir.iterdir():
+            fn.unlink()
+        self._dir.rmdir()
+
+    def test_read_directive(self):
+        format_fn = self._dir / 'nginx.conf'
+        format_fn.write_text("# access log\nlog_format timed escape=json '$remote_addr [$time_local] '\n"
+                             "                              '\"$request\" $status $request_time';\n")
+        self.assertEqual(lf.read_log_format(format_fn), '$remote_addr [$time_local] "$request" $status $request_time')
+        format_fn.write_text('$remote_addr "$request" $status $request_time\n')
+        self.assertEqual(lf.read_log_format(format_fn), '$remote_addr "$request" $status $request_time')
+        # ';' and escaped quotes in quoted strings, comments between them
+        format_fn.write_text("log_format cookie '\"$request\" $status $request_time '\n"
+                             "    # the cookie is quoted\n"
+                             "    \"\\\"$http_cookie;\\\"\";  # end\n")
+        self.assertEqual(lf.read_log_format(format_fn), '"$request" $status $request_time "$http_cookie;"')
+        format_fn.write_text("log_format cookie '$request $status $request_time'\n")
+        with self.assertRaisesRegex(ValueError, 'ending'):
+            lf.read_log_format(format_fn)
+
+    def test_cache(self):
+        compiled = lf.load_compiled(COMBINED_TIMED, self._dir, log)
+        cache_fn = lf.cache_file_name(COMBINED_TIMED, self._dir)
+        self.assertEqual(list(self._dir.iterdir()), [cache_fn])
+        # the cached expression is used as is
+        cached = json.loads(cache_fn.read_text())
+        cache_fn.write_text(json.dumps(dict(cached, pattern=cached['pattern'].replace('rt=', 'time='))))
+        self.assertNotEqual(lf.load_compiled(COMBINED_TIMED, self._dir, log), compiled)
+        # a broken file is replaced
+        cache_fn.write_text('{')
+        self.assertEqual(lf.load_compiled(COMBINED_TIMED, self._dir, log), compiled)
+        self.assertEqual(lf.load_compiled(COMBINED_TIMED, self._dir, log), compiled)
+
+if __name__ == "__main__":
+    ut.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import unittest as ut
+import pathlib as pl
+import itertools as it
+import gzip
+import bz2
+from unittest import mock
+import log_readers as lr
+
+TEMPDIR = '/tmp'
+
+class TestLineBatches(ut.TestCase):
+    "Splitting of decompressed blocks to lines"
+
+    def test_lines_across_blocks(self):
+        blocks = [b'first li', b'ne\nsecond line\nthi', b'rd', b' line\n', b'last']
+        lines = list(it.chain.from_iterable(lr.line_batches(iter(blocks))))
+        self.assertEqual(lines, [b'first line', b'second line', b'third line', b'last'])
+
+    def test_trailing_newline(self):
+        lines = list(it.chain.from_iterable(lr.line_batches(iter([b'one\ntwo\n']))))
+        self.assertEqual(lines, [b'one', b'two'])
+
+    def test_multibyte_char_on_block_border(self):
+        data = 'строка\nещё строка\n'.encode('utf-8')
+        blocks = [data[i:i+3] for i in range(0, len(data), 3)]
+        lines = list(it.chain.from_iterable(lr.line_batches(iter(blocks))))
+        self.assertEqual([line.decode('utf-8') for line in lines], ['строка', 'ещё строка'])
+
+class TestCompressedReaders(ut.TestCase):
+    "All the decompressors must give the same lines"
+
+    @classmethod
+    def setUpClass(cls):
+        cls._dir = pl.Path(TEMPDIR, 'TestReaders')
+        cls._dir.mkdir()
+        cls.lines = [f'line number {i} '.encode('ascii') + b'x' * (i % 50) for i in range(20000)]
+        data = b'\n'.join(cls.lines) + b'\n'
+        cls.gz_fn = cls._dir / pl.Path('log.gz')
+        cls.bz2_fn = cls._dir / pl.Path('log.bz2')
+        cls.gz_fn.write_bytes(gzip.compress(data))
+        cls.bz2_fn.write_bytes(bz2.compress(data))
+
+    @classmethod
+    def tearDownClass(cls):
+        for fn in cls._dir.glob('*'):
+            fn.unlink()
+        cls._dir.rmdir()
+
+    def read_all(self, fn, decompressor):
+        return list(it.chain.from_iterable(lr.compressed_lines(fn, decompressor, block_size=4096)))
+
+    def test_python_gz(self):
+        self.assertEqual(self.read_all(self.gz_fn, 'python'), self.lines)
+
+    def test_python_bz2(self):
+        self.assertEqual(self.read_all(self.bz2_fn, 'python'), self.lines)
+
+    def test_external_gz(self):
+        if lr.find_external_tool(self.gz_fn) is None:
+            self.skipTest('no external gzip decompressor')
+        self.assertEqual(self.read_all(self.gz_fn, 'external'), self.lines)
+
+    def test_external_bz2(self):
+        if lr.find_external_tool(self.bz2_fn) is None:
+            self.skipTest('no external bzip2 decompressor')
+        self.assertEqual(self.read_all(self.bz2_fn, 'external'), self.lines)
+
+    def test_early_stop(self):
+        batches = lr.compressed_lines(self.gz_fn, 'python', block_size=1024)
+        first = next(batches)
+        batches.close()
+        self.assertEqual(first[0], self.lines[0])
+
+    def test_progress(self):
+        calls = []
+        lines = list(it.chain.from_iterable(lr.compressed_lines(self.gz_fn, 'python', block_size=4096,
+                                                                progress=lambda n, pos: calls.append((n, pos)))))
+        self.assertEqual(lines, self.lines)
+        self.assertEqual(sum(n for n, _ in calls), len(self.lines))
+        positions = [pos for _, pos in calls]
+        self.assertEqual(positions, sorted(positions))
+        self.assertLessEqual(positions[-1], self.gz_fn.stat().st_size)
+
+    def test_broken_file(self):
+        broken_fn = self._dir / pl.Path('broken.gz')
+        broken_fn.write_bytes(self.gz_fn.read_bytes()[:1000])
+        with self.assertRaises(EOFError):
+            self.read_all(broken_fn, 'python')
+        if lr.find_external_tool(broken_fn) is not None:
+            with self.assertRaises(OSError):
+                self.read_all(broken_fn, 'external')
+
+class TestMmapReader(ut.TestCase):
+    "Memory-mapped uncompressed file must give the same lines as the block reader"
+
+    @classmethod
+    def setUpClass(cls):
+        cls._dir = pl.Path(TEMPDIR, 'TestMmapReader')
+        cls._dir.mkdir()
+        # long enough for the ranges to start beyond the allocation granularity
+        cls.lines = [f'line number {i} '.encode('ascii') + b'x' * (i % 50) for i in range(20000)]
+        cls.log_fn = cls._dir / pl.Path('log')
+        cls.log_fn.write_bytes(b'\n'.join(cls.lines) + b'\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        for fn in cls._dir.glob('*'):
+            fn.unlink()
+        cls._dir.rmdir()
+
+    def test_whole_file(self):
+        self.assertEqual([bytes(line) for line in lr.mmap_lines(self.log_fn)], self.lines)
+
+    def test_ranges(self):
+        data = self.log_fn.read_bytes()
+        middle = data.index(b'\n', len(data) // 2) + 1
+        lines = [bytes(line) for line in it.chain(lr.mmap_lines(self.log_fn, 0, middle),
+                                                  lr.mmap_lines(self.log_fn, middle, len(data)))]
+        self.assertEqual(lines, self.lines)
+
+    def test_progress(self):
+        data = self.log_fn.read_bytes()
+        calls = []
+        with mock.patch.object(lr, 'BLOCK_SIZE', 4096):
+            lines = [bytes(line) for line in lr.mmap_lines(self.log_fn, progress=lambda n, pos: calls.append((n, pos)))]
+        self.assertEqual(lines, self.lines)
+        # a call at the first line end after every block, the lines of the tail aren't reported
+        self.assertGreater(len(calls), len(data) // 4096 // 2)
+        for (_, previous), (n, pos) in zip([(0, 0)] + calls, calls):
+            self.assertEqual(data[pos - 1], ord('\n'))
+            self.assertGreaterEqual(pos - previous, 4096)
+            self.assertEqual(n, data[previous:pos].count(b'\n'))
+
+    def test_no_trailing_newline(self):
+        fn = self._dir / pl.Path('no_newline')
+        fn.write_bytes(b'one\ntwo')
+        self.assertEqual([bytes(line) for line in lr.mmap_lines(fn)], [b'one', b'two'])
+
+    def test_empty_file(self):
+        fn = self._dir / pl.Path('empty')
+        fn.write_bytes(b'')
+        self.assertEqual(list(lr.mmap_lines(fn)), [])
+
+
+if __name__ == "__main__":
+    ut.main()
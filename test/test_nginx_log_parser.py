@@ -1,8 +1,24 @@
 #!/usr/bin/env python3
 
 import unittest as ut
+import logging
 import nginx_log_parser as nlp
 
+log = logging.getLogger('test-nginx-log-parser')
+
+GOOD_LINES = [
+    '1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] "GET /api/v2/banner/25013431 HTTP/1.1" 200 948 "-" "Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" "1498697422-2190034393-4708-9752758" "dc7161be3" 0.917\n',
+    '1.194.135.240 -  - [29/Jun/2017:03:50:23 +0300] "GET /api/v2/group/7786683/statistic/sites/?date_type=day&date_from=2017-06-28&date_to=2017-06-28 HTTP/1.1" 200 22 "-" "python-requests/2.13.0" "-" "1498697423-3979856266-4708-9752782" "8a7741a54297568b" 0.061\n',
+    '1.166.249.64 2a828197ae235b0b3cb  - [29/Jun/2017:04:00:12 +0300] "GET / HTTP/1.1" 302 5 "-" "Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" "1498698012-1082475993-4708-9758092" "-" 0.122\n',
+    '1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] "HEAD https://docs.python.org/3/library/re.html HTTP/1.0" 200 948 "-" "-" "-" "-" "-" 2\n',
+    ]
+
+BAD_LINES = [
+    '1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] "-" 200 983 "-" "Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" "1498697422-2190034393-4708-9752755" "dc7161be3" 1.403\n',
+    '1.138.198.128 -  - [29/Jun/2017:18:00:19 +0300] "GET //;@169.254.169.254/latest/meta-data/iam/security-credentials/Ec2LeastPrivileged HTTP/1.1" 302 5 "-" "Mozilla/4.0 (compatible; Win32; WinHttp.WinHttpRequest.5)" "-" "1498748419-3305784397-4709-10417084" "-" 0.008\n',
+    '1.196.116.32 -  - [29/Jun/2017:03:50:23 +0300] "GET /api/v2/banner/24913311 HTTP/1.1" 200 897 "-" "-" "-" "-" "-" 1.2.3\n',
+    ]
+
 class TestLogParser(ut.TestCase):
     """Testing of different elements of log parsing"""
 
@@ -94,6 +110,18 @@ class TestLogParser(ut.TestCase):
             ''', failure_tests=True, print_results=False)
         self.assertTrue(t[0], 'The string that is formally valid, but invalid as date parsed successfully!')
 
+    def test_parse_timestamp(self):
+        nlp.parse_timestamp.cache_clear()
+        ts = nlp.parse_timestamp('29/Jun/2017:03:50:23 +0300')
+        self.assertEqual(ts.isoformat(), '2017-06-29T03:50:23+03:00')
+        self.assertEqual(nlp.parse_timestamp(b'29/Jun/2017:03:50:23 +0300'), ts)
+        # every line of a second shares the conversion
+        for line in GOOD_LINES[:2] * 10:
+            nlp.parse_log_line(line, log)
+        self.assertEqual(nlp.parse_timestamp.cache_info().misses, 2)
+        with self.assertRaises(ValueError):
+            nlp.parse_timestamp(b'31/Jun/2017:03:28:22 +0300')
+
     def test_url_parse(self):
         t1 = nlp.urlProto.run_tests('''
             # good protocol selectors
@@ -188,5 +216,43 @@ class TestLogParser(ut.TestCase):
             ''', failure_tests=True, print_results=False)
         self.assertTrue(t2[0], 'Invalid log line passed parsing')
 
+class TestFastParser(ut.TestCase):
+    """The fast (regex) parser must give the same results as the pyparsing grammar"""
+
+    def test_same_results_on_good_lines(self):
+        for line in GOOD_LINES:
+            self.assertEqual(nlp.parse_log_line_fast(line, log), nlp.parse_log_line(line, log))
+
+    def test_fast_path_values(self):
+        req = nlp.parse_log_line_fast(GOOD_LINES[0], log)
+        self.assertEqual(req, nlp.Request('29/Jun/2017:03:50:23 +0300', '/api/v2/banner/25013431', 917,
+                                          nlp.METHOD_CODES['GET'], 200))
+
+    def test_method_and_status(self):
+        line = GOOD_LINES[2].replace('"GET', '"DELETE')
+        for parse in (nlp.parse_log_line, nlp.parse_log_line_fast):
+            req = parse(line, log)
+            self.assertEqual((nlp.METHODS[req.method], req.status), ('DELETE', 302))
+        req = nlp.parse_log_line_bytes(GOOD_LINES[3].encode('utf-8'), log)
+        self.assertEqual((nlp.METHODS[req.method], req.status), ('HEAD', 200))
+
+    def test_bad_lines_rejected(self):
+        for line in BAD_LINES:
+            self.assertIsNone(nlp.parse_log_line_fast(line, log))
+
+    def test_bytes_parser(self):
+        for line in GOOD_LINES:
+            req = nlp.parse_log_line(line, log)
+            req_bytes = nlp.parse_log_line_bytes(line.encode('utf-8'), log)
+            self.assertEqual(req_bytes, nlp.Request(req.ts.encode(), req.url.encode(), req.duration,
+                                                    req.method, req.status))
+            self.assertEqual(nlp.parse_log_line_strict_bytes(line.encode('utf-8'), log), req_bytes)
+        for line in BAD_LINES:
+            self.assertIsNone(nlp.parse_log_line_bytes(line.encode('utf-8'), log))
+
+    def test_parser_selection(self):
+        self.assertIs(nlp.PARSERS['fast'], nlp.parse_log_line_fast)
+        self.assertIs(nlp.PARSERS['strict'], nlp.parse_log_line)
+
 if __name__ == "__main__":
     ut.main()
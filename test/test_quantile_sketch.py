@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import unittest as ut
+import pickle
+import random
+import math
+from array import array
+import quantile_sketch as qs
+
+class TestExactQuantiles(ut.TestCase):
+    "Exact quantiles must agree with the classic median"
+
+    def test_empty(self):
+        self.assertEqual(qs.ExactQuantiles().quantiles((0.5, 0.99)), [0, 0])
+
+    def test_median_even(self):
+        est = qs.ExactQuantiles(array('l', [17, 13]))
+        self.assertEqual(est.quantiles((0.5,)), [15])
+
+    def test_median_odd(self):
+        est = qs.ExactQuantiles(array('l', [17, 13, 15]))
+        self.assertEqual(est.quantiles((0.5,)), [15])
+
+    def test_merge(self):
+        left, right = qs.ExactQuantiles(), qs.ExactQuantiles()
+        for v in range(1, 51):
+            left.add(v)
+            right.add(v + 50)
+        left.merge(right)
+        self.assertEqual(left.count, 100)
+        self.assertEqual(left.quantiles((0.0, 1.0)), [1, 100])
+
+class TestLogHistogram(ut.TestCase):
+    "The histogram must keep the relative error and a bounded number of buckets"
+
+    def check_error(self, values, relative_error):
+        sketch = qs.LogHistogram(relative_error)
+        for v in values:
+            sketch.add(v)
+        sorted_values = sorted(values)
+        fractions = (0.1, 0.5, 0.9, 0.99)
+        for q, approx in zip(fractions, sketch.quantiles(fractions)):
+            # the true quantile lies between two closest ranks; +1 for rounding to integers
+            rank = q * (len(values) - 1)
+            low, high = sorted_values[math.floor(rank)], sorted_values[math.ceil(rank)]
+            self.assertGreaterEqual(approx, low * (1 - relative_error) - 1, f'q={q}')
+            self.assertLessEqual(approx, high * (1 + relative_error) + 1, f'q={q}')
+
+    def test_uniform(self):
+        self.check_error(list(range(1, 10001)), 0.01)
+
+    def test_lognormal(self):
+        rnd = random.Random(42)
+        self.check_error([int(rnd.lognormvariate(4, 1.5)) + 1 for _ in range(20000)], 0.02)
+
+    def test_large_values(self):
+        self.check_error([v * 1000 for v in range(60, 200)], 0.01)
+
+    def test_bounded_size(self):
+        sketch = qs.LogHistogram(0.01)
+        for v in range(1, 3 * 3600 * 1000, 97):
+            sketch.add(v)
+        self.assertLess(len(sketch.buckets), 1000)
+
+    def test_zeros(self):
+        sketch = qs.LogHistogram()
+        for v in (0, 0, 0, 10):
+            sketch.add(v)
+        self.assertEqual(sketch.quantiles((0.5, 1.0)), [0, 10])
+
+    def test_merge(self):
+        left, right, whole = qs.LogHistogram(), qs.LogHistogram(), qs.LogHistogram()
+        for v in range(1, 1000):
+            (left if v % 2 else right).add(v)
+            whole.add(v)
+        left.merge(right)
+        self.assertEqual(left.buckets, whole.buckets)
+        self.assertEqual(left.count, whole.count)
+
+    def test_merge_different_errors(self):
+        with self.assertRaises(ValueError):
+            qs.LogHistogram(0.01).merge(qs.LogHistogram(0.02))
+
+    def test_pickle(self):
+        sketch = qs.LogHistogram(0.05)
+        for v in range(1, 100):
+            sketch.add(v)
+        restored = pickle.loads(pickle.dumps(sketch))
+        self.assertEqual(restored.quantiles((0.5, 0.9)), sketch.quantiles((0.5, 0.9)))
+        restored.add(1000)
+        self.assertEqual(restored.count, 100)
+
+    def test_factory(self):
+        self.assertIsInstance(qs.estimator_factory('exact')(), qs.ExactQuantiles)
+        sketch = qs.estimator_factory('sketch', 0.05)()
+        self.assertEqual(sketch.relative_error, 0.05)
+
+if __name__ == "__main__":
+    ut.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import unittest as ut
+import pickle
+import time_series as tms
+import quantile_sketch as qs
+
+class TestUrlSeries(ut.TestCase):
+    "Buckets of a URL are kept in flat arrays, a slot per bucket"
+
+    def test_add(self):
+        us = tms.UrlSeries()
+        for bucket, duration in ((10, 5), (10, 7), (13, 100), (8, 1)):
+            us.add(bucket, duration)
+        self.assertEqual(us.slots, {10: 0, 13: 1, 8: 2})
+        self.assertEqual(list(us.counts), [2, 1, 1])
+        self.assertEqual(list(us.sums), [12, 100, 1])
+        self.assertEqual(len(us.bins), 3 * tms.SERIES_BINS)
+        self.assertEqual([point[:3] for point in us.points((0.5,))], [(8, 1, 1), (10, 2, 12), (13, 1, 100)])
+
+    def test_sparse(self):
+        "A URL seen at both ends of a day takes two slots"
+        us = tms.UrlSeries()
+        us.add(0, 10)
+        us.add(1439, 20)
+        self.assertEqual(len(us.counts), 2)
+        self.assertEqual(len(us.bins), 2 * tms.SERIES_BINS)
+
+    def test_merge(self):
+        left, right, whole = tms.UrlSeries(), tms.UrlSeries(), tms.UrlSeries()
+        for bucket, duration in ((5, 10), (6, 20), (7, 30)):
+            left.add(bucket, duration)
+            whole.add(bucket, duration)
+        for bucket, duration in ((3, 40), (6, 50), (9, 60)):
+            right.add(bucket, duration)
+            whole.add(bucket, duration)
+        left.merge(right)
+        fractions = (0.5, 0.99)
+        self.assertEqual(list(left.points(fractions)), list(whole.points(fractions)))
+
+    def test_quantiles(self):
+        "Estimates are within 20% of exact quantiles"
+        us, exact = tms.UrlSeries(), qs.ExactQuantiles()
+        for v in range(1, 5000, 7):
+            us.add(0, v)
+            exact.add(v)
+        fractions = (0.5, 0.9, 0.99)
+        for estimate, value in zip(us.quantiles(0, fractions), exact.quantiles(fractions)):
+            self.assertLess(abs(estimate - value) / value, 0.2)
+        # the times above the last bin are in it
+        us.add(1, 10 ** 6)
+        self.assertEqual(us.quantiles(us.slots[1], (0.5,)), [tms.BIN_VALUES[-1]])
+
+class TestTimeSeries(ut.TestCase):
+
+    def test_buckets(self):
+        series = tms.TimeSeries(3600)
+        bucket = series.bucket_of(b'29/Jun/2017:03:50:23 +0300')
+        self.assertEqual(series.utcoffset, 3 * 3600)
+        self.assertEqual(series.bucket_of('29/Jun/2017:03:00:00 +0300'), bucket)
+        self.assertEqual(series.bucket_of('29/Jun/2017:04:00:00 +0300'), bucket + 1)
+        self.assertIsNone(series.bucket_of('31/Jun/2017:03:00:00 +0300'))
+        self.assertEqual(series.bucket_start(bucket).isoformat(), '2017-06-29T03:00:00+03:00')
+
+    def test_decode_and_pickle(self):
+        series = tms.TimeSeries(60, 0, {b'/a': tms.UrlSeries()})
+        series.urls[b'/a'].add(1, 3)
+        decoded = pickle.loads(pickle.dumps(series.decoded()))
+        self.assertEqual(list(decoded.urls), ['/a'])
+        self.assertEqual(list(decoded.urls['/a'].counts), [1])
+        self.assertEqual(decoded.interval, 60)
+
+if __name__ == "__main__":
+    ut.main()
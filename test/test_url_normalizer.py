@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import unittest as ut
+import pathlib as pl
+import pickle
+import url_normalizer as un
+
+TEMPDIR = '/tmp'
+
+class TestUrlNormalizer(ut.TestCase):
+    "Normalization steps, str and bytes URLs"
+
+    def test_no_settings(self):
+        self.assertIsNone(un.make_normalizer(un.UrlSettings()))
+
+    def test_strip_query(self):
+        norm = un.UrlNormalizer(un.UrlSettings(strip_query=True))
+        self.assertEqual(norm('/api/v2/banner?id=1&x=2'), '/api/v2/banner')
+        self.assertEqual(norm('/export/#top'), '/export/')
+        self.assertEqual(norm(b'/api/1?key=x'), b'/api/1')
+
+    def test_collapse_ids(self):
+        norm = un.UrlNormalizer(un.UrlSettings(collapse_ids=True))
+        self.assertEqual(norm('/api/v2/banner/25019354'), '/api/v2/banner/{id}')
+        self.assertEqual(norm('/api/1/photogenic_banners/list/?server_name=WIN7RB4'),
+                         '/api/{id}/photogenic_banners/list/?server_name=WIN7RB4')
+        self.assertEqual(norm('/s/0f8fad5b-d9cb-469f-a165-70867728950e/x'), '/s/{uuid}/x')
+        self.assertEqual(norm(b'/t/3f2a9c0d4e5b6a7f1c2d/123'), b'/t/{hex}/{id}')
+        # not whole segments and words aren't changed
+        self.assertEqual(norm('/v2/deadbeefdeadbeef/slot4'), '/v2/deadbeefdeadbeef/slot4')
+
+    def test_rules(self):
+        rules_fn = pl.Path(TEMPDIR, 'test_url_rules.txt')
+        rules_fn.write_text('# comment\n\n^/export/.*  /export/*\n/campaign/\\w+ /campaign/NAME\n'
+                            '/static/[^/]+\t/static/FILE\n/v1/\n')
+        try:
+            rules = un.load_rules(rules_fn)
+        finally:
+            rules_fn.unlink()
+        self.assertEqual(len(rules), 4)
+        self.assertEqual(rules[2:], (('/static/[^/]+', '/static/FILE'), ('/v1/', '')))
+        norm = un.UrlNormalizer(un.UrlSettings(rules=rules, collapse_ids=True))
+        self.assertEqual(norm('/export/appinstall_raw/2017-06-30/'), '/export/*')
+        self.assertEqual(norm(b'/campaign/summer/7'), b'/campaign/NAME/{id}')
+        self.assertEqual(norm('/static/app.js'), '/static/FILE')
+
+    def test_bad_rule(self):
+        rules_fn = pl.Path(TEMPDIR, 'test_url_rules_bad.txt')
+        rules_fn.write_text('/api/(unclosed /api\n')
+        try:
+            with self.assertRaises(ValueError):
+                un.load_rules(rules_fn)
+        finally:
+            rules_fn.unlink()
+
+    def test_memoization(self):
+        norm = un.UrlNormalizer(un.UrlSettings(strip_query=True))
+        first = norm('/api?x=1')
+        self.assertIs(norm('/api?x=1'), first)
+        self.assertEqual(len(norm.cache), 1)
+
+    def test_pickle(self):
+        norm = pickle.loads(pickle.dumps(un.UrlNormalizer(un.UrlSettings(collapse_ids=True))))
+        self.assertEqual(norm('/a/1'), '/a/{id}')
+
+if __name__ == "__main__":
+    ut.main()
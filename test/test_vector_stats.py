@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import unittest as ut
+import random
+from array import array
+import quantile_sketch as qs
+import vector_stats as vs
+
+FRACTIONS = (0.5, 0.9, 0.99)
+
+@ut.skipUnless(vs.available(), 'NumPy is not installed')
+class TestSegmentQuantiles(ut.TestCase):
+    "Vectorized quantiles must be the same as the pure Python ones"
+
+    def segments_to_arrays(self, segments):
+        values, lengths = array('l'), array('q')
+        for seg in segments:
+            values.extend(seg)
+            lengths.append(len(seg))
+        return values, lengths
+
+    def test_same_as_python(self):
+        rnd = random.Random(3)
+        segments = [[rnd.randint(1, 5000) for _ in range(rnd.choice([1, 2, 3, 10, 101]))]
+                    for _ in range(500)]
+        self.assertEqual(vs.segment_quantiles(*self.segments_to_arrays(segments), FRACTIONS),
+                         [qs.ExactQuantiles(array('l', seg)).quantiles(FRACTIONS) for seg in segments])
+
+    def test_empty_segments(self):
+        segments = [[], [7, 3], []]
+        self.assertEqual(vs.segment_quantiles(*self.segments_to_arrays(segments), FRACTIONS),
+                         [[0, 0, 0], [5, 6, 6], [0, 0, 0]])
+        self.assertEqual(vs.segment_quantiles(array('l'), array('q'), FRACTIONS), [])
+
+    def test_large_values(self):
+        segment = [1 << 40, 3, 1 << 35]
+        self.assertEqual(vs.segment_quantiles(*self.segments_to_arrays([segment]), FRACTIONS),
+                         [qs.ExactQuantiles(array('l', segment)).quantiles(FRACTIONS)])
+
+class TestBackends(ut.TestCase):
+
+    def test_resolve(self):
+        self.assertEqual(vs.resolve_backend('python'), 'python')
+        self.assertEqual(vs.resolve_backend('auto'), 'numpy' if vs.available() else 'python')
+
+if __name__ == "__main__":
+    ut.main()